@@ -0,0 +1,6 @@
+"""
+Benchmarks for the Employee service
+
+Run them from the root of the repository, for example:
+    python -m benchmarks.bench_serialization
+"""
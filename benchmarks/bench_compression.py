@@ -0,0 +1,99 @@
+"""
+Compression Benchmark
+
+Measures what each format of the employee list costs on the wire and in CPU:
+a page of --page-size employees as JSON, NDJSON and columnar JSON, and the
+whole table streamed as JSON and NDJSON, each sent uncompressed, gzipped and
+(when brotli is installed) brotli compressed. Bytes are the size of the body
+as sent, CPU is the best process time of --repeat requests in milliseconds,
+including reading the rows. Seeds --rows employees into a throwaway SQLite
+database unless DATABASE_URI is set.
+
+Usage:
+    python -m benchmarks.bench_compression [--rows 10000] [--page-size 1000] [--repeat 5]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+
+os.environ.setdefault("DATABASE_URI", f"sqlite:///{tempfile.gettempdir()}/employee-benchmark.db")
+
+# pylint: disable=wrong-import-position
+from service import create_app  # noqa: E402
+from service.common.compression import compression  # noqa: E402
+from service.models import Employee, db  # noqa: E402
+from benchmarks.load_test import InProcessClient, seed  # noqa: E402
+
+FORMATS = {
+    "page_json": ({}, "application/json"),
+    "page_ndjson": ({}, "application/x-ndjson"),
+    "page_columnar": ({}, "application/vnd.columnar+json"),
+    "stream_json": ({"stream": "true"}, "application/json"),
+    "stream_ndjson": ({"stream": "true"}, "application/x-ndjson"),
+}
+
+
+def measure(client, query: dict, headers: dict, repeat: int) -> tuple:
+    """Returns the body size in bytes and the best CPU time of a request in milliseconds"""
+    best, size = float("inf"), 0
+    for _ in range(repeat):
+        start = time.process_time()
+        response = client.get("/employees", query_string=query, headers=headers)
+        size = len(response.get_data())
+        best = min(best, time.process_time() - start)
+        if response.status_code != 200:
+            raise RuntimeError(f"Expected 200, got {response.status_code}")
+    return size, round(best * 1000, 3)
+
+
+def fill(app, rows: int) -> int:
+    """Creates employees until the table holds at least rows of them and returns how many it holds"""
+    count = db.select(db.func.count(Employee.id))
+    missing = rows - db.session.scalar(count)
+    if missing > 0:
+        seed(InProcessClient(app), missing)
+    return db.session.scalar(count)
+
+
+def main(argv=None) -> dict:
+    """Runs the benchmark and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=10000, help="employees in the table")
+    parser.add_argument("--page-size", type=int, default=1000, help="employees per page")
+    parser.add_argument("--repeat", type=int, default=5, help="requests per measurement, the best one counts")
+    args = parser.parse_args(argv)
+
+    app = create_app()
+    app.logger.setLevel("CRITICAL")
+    app.config["PAGE_SIZE_MAX"] = max(app.config["PAGE_SIZE_MAX"], args.page_size)
+    encodings = ("identity",) + compression.encodings
+    timings = {}
+    with app.app_context():
+        db.create_all()
+        rows = fill(app, args.rows)
+        client = app.test_client()
+        for name, (query, mimetype) in FORMATS.items():
+            query = dict(query, limit=args.page_size)
+            timings[name] = {}
+            for encoding in encodings:
+                size, cpu_ms = measure(client, query, {"Accept": mimetype, "Accept-Encoding": encoding}, args.repeat)
+                timings[name][encoding] = {"bytes": size, "cpu_ms": cpu_ms}
+    results = {
+        "benchmark": "compression",
+        "rows": rows,
+        "page_size": args.page_size,
+        "min_size": app.config["COMPRESS_MIN_SIZE"],
+        "gzip_level": app.config["COMPRESS_GZIP_LEVEL"],
+        "brotli_quality": app.config["COMPRESS_BROTLI_QUALITY"] if "br" in encodings else None,
+        "timings": timings,
+    }
+    json.dump(results, sys.stdout, indent=2)
+    print()
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Serialization Benchmark
+
+Compares building a list response from hydrated Employee objects encoded
+with the standard library against building it from row tuples encoded by
+the JSON provider, at 1k, 10k and 100k rows. Uses a throwaway SQLite
+database unless DATABASE_URI is set.
+
+Usage:
+    python -m benchmarks.bench_serialization [--sizes 1000 10000 100000] [--repeat 5]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+
+os.environ.setdefault("DATABASE_URI", f"sqlite:///{tempfile.gettempdir()}/employee-benchmark.db")
+
+# pylint: disable=wrong-import-position
+from service import create_app  # noqa: E402
+from service.models import Employee, db  # noqa: E402
+from tests.factories import EmployeeFactory  # noqa: E402
+
+
+def seed(count: int) -> None:
+    """Makes sure the table holds exactly count employees"""
+    db.create_all()
+    db.session.query(Employee).delete()
+    db.session.commit()
+    Employee.bulk_create(EmployeeFactory.build_batch(count), chunk_size=5000)
+
+
+def orm_path(app, limit: int) -> int:
+    """Hydrates Employee objects, calls serialize() and encodes with the standard library"""
+    employees = Employee.query.order_by(Employee.id).limit(limit).all()
+    body = json.dumps([employee.serialize() for employee in employees], default=app.json.default)
+    db.session.expunge_all()
+    return len(body)
+
+
+def rows_path(app, limit: int) -> int:
+    """Builds dictionaries straight from row tuples and encodes with the JSON provider"""
+    body = app.json.dumps(Employee.find_page(limit))
+    return len(body)
+
+
+def measure(function, app, limit: int, repeat: int) -> float:
+    """Returns the best time of repeat runs in seconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(app, limit)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None) -> dict:
+    """Runs the benchmark and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    app = create_app()
+    results = {"benchmark": "serialization", "json_encoder": "orjson" if app.json.use_orjson else "json", "runs": []}
+    with app.app_context():
+        seed(max(args.sizes))
+        for size in args.sizes:
+            orm_seconds = measure(orm_path, app, size, args.repeat)
+            rows_seconds = measure(rows_path, app, size, args.repeat)
+            results["runs"].append(
+                {
+                    "rows": size,
+                    "orm_seconds": round(orm_seconds, 6),
+                    "rows_seconds": round(rows_seconds, 6),
+                    "speedup": round(orm_seconds / rows_seconds, 2),
+                }
+            )
+    json.dump(results, sys.stdout, indent=2)
+    print()
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Validation Benchmark
+
+Measures what checking a write costs: validate_employee() and deserialize()
+on their own, and whole POST /employees requests that are valid, invalid
+(rejected before the database is used) or over the size limit (rejected
+before the body is read). Times are the best of --repeat rounds of --number
+calls, in microseconds per call. Uses a throwaway SQLite database unless
+DATABASE_URI is set.
+
+Usage:
+    python -m benchmarks.bench_validation [--number 2000] [--repeat 5]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+
+os.environ.setdefault("DATABASE_URI", f"sqlite:///{tempfile.gettempdir()}/employee-benchmark.db")
+
+# pylint: disable=wrong-import-position
+from service import create_app  # noqa: E402
+from service.models import Employee, DataValidationError, db, validate_employee  # noqa: E402
+from tests.factories import EmployeeFactory  # noqa: E402
+
+
+def measure(function, number: int, repeat: int) -> float:
+    """Returns the best time of one call in microseconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, (time.perf_counter() - start) / number)
+    return round(best * 1_000_000, 3)
+
+
+def rejected(function):
+    """Wraps a call that is expected to raise a DataValidationError"""
+    def call():
+        try:
+            function()
+        except DataValidationError:
+            pass
+    return call
+
+
+def post(client, body: bytes, expected: int):
+    """Returns a call that posts body to /employees and checks the status code"""
+    def call():
+        response = client.post("/employees", data=body, content_type="application/json")
+        if response.status_code != expected:
+            raise RuntimeError(f"Expected {expected}, got {response.status_code}: {response.get_data(as_text=True)}")
+    return call
+
+
+def main(argv=None) -> dict:
+    """Runs the benchmark and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--number", type=int, default=2000, help="calls per round")
+    parser.add_argument("--repeat", type=int, default=5, help="rounds, the best one counts")
+    args = parser.parse_args(argv)
+
+    app = create_app()
+    app.logger.setLevel("CRITICAL")
+    valid = EmployeeFactory.build().serialize()
+    invalid = dict(valid, gender="OTHER")
+    too_long = dict(valid, last_name="x" * 256)
+    oversized = json.dumps(dict(valid, padding="x" * (1024 * 1024))).encode()
+
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+        timings = {
+            "validate_valid": measure(lambda: validate_employee(valid), args.number, args.repeat),
+            "validate_invalid": measure(rejected(lambda: validate_employee(invalid)), args.number, args.repeat),
+            "deserialize_valid": measure(lambda: Employee().deserialize(valid), args.number, args.repeat),
+            "request_invalid": measure(post(client, json.dumps(invalid).encode(), 400), args.number, args.repeat),
+            "request_too_long": measure(post(client, json.dumps(too_long).encode(), 400), args.number, args.repeat),
+            "request_too_large": measure(post(client, oversized, 413), args.number, args.repeat),
+            "request_valid": measure(post(client, json.dumps(valid).encode(), 201), args.number, 1),
+        }
+    results = {
+        "benchmark": "validation",
+        "unit": "microseconds per call",
+        "max_content_length": app.config["EMPLOYEE_MAX_CONTENT_LENGTH"],
+        "timings": timings,
+    }
+    json.dump(results, sys.stdout, indent=2)
+    print()
+    return results
+
+
+if __name__ == "__main__":
+    main()
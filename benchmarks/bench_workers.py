@@ -0,0 +1,90 @@
+"""
+Worker Benchmark
+
+Runs the load test against gunicorn once per worker configuration, given as
+WORKERSxTHREADS, and prints the throughput and latency of each one next to
+the configuration that gunicorn.conf.py would pick on this machine. Every run
+starts its own gunicorn with the settings of gunicorn.conf.py, so
+keep-alive, preloading and worker recycling are the ones used in production.
+The throwaway SQLite database is used unless DATABASE_URI is set.
+
+Usage:
+    python -m benchmarks.bench_workers [--configs 1x1 2x1 1x4 2x4 4x4] [--requests 2000]
+"""
+import sys
+import json
+import argparse
+import importlib.util
+from pathlib import Path
+
+from benchmarks import load_test
+
+CONFIG_FILE = Path(__file__).resolve().parent.parent / "gunicorn.conf.py"
+
+
+def parse_config(value: str) -> tuple:
+    """Parses "2x4" into (2 workers, 4 threads)"""
+    workers, _, threads = value.partition("x")
+    try:
+        return int(workers), int(threads or 1)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(f"Expected WORKERSxTHREADS, got {value}") from error
+
+
+def default_config() -> dict:
+    """Returns the workers, threads and worker class that gunicorn.conf.py derives here"""
+    spec = importlib.util.spec_from_file_location("gunicorn_conf", CONFIG_FILE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return {
+        "cpus": module.cpu_count(),
+        "workers": module.workers,
+        "threads": module.threads,
+        "worker_class": module.worker_class,
+    }
+
+
+def main(argv=None) -> list:
+    """Runs the benchmark and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--configs", nargs="+", type=parse_config, default=[(1, 1), (2, 1), (1, 4), (2, 4), (4, 4)],
+                        help="worker configurations as WORKERSxTHREADS")
+    parser.add_argument("--worker-class", default="gthread", help="gunicorn worker class")
+    parser.add_argument("--no-preload", dest="preload", action="store_false", help="import the app in every worker")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per configuration")
+    parser.add_argument("--concurrency", type=int, default=16, help="client threads")
+    parser.add_argument("--mix", default=load_test.DEFAULT_MIX, help="weights of list, get, create, update and delete")
+    parser.add_argument("--seed-rows", type=int, default=500, help="employees to create before each run")
+    args = parser.parse_args(argv)
+
+    runs = []
+    for workers, threads in args.configs:
+        options = load_test.parse_args([
+            "--target", "gunicorn",
+            "--workers", str(workers),
+            "--threads", str(threads),
+            "--worker-class", args.worker_class,
+            "--requests", str(args.requests),
+            "--concurrency", str(args.concurrency),
+            "--mix", args.mix,
+            "--seed-rows", str(args.seed_rows),
+        ] + ([] if args.preload else ["--no-preload"]))
+        total = load_test.run(options)["total"]
+        runs.append({"workers": workers, "threads": threads, **total})
+
+    results = {
+        "benchmark": "workers",
+        "default": default_config(),
+        "worker_class": args.worker_class,
+        "preload": args.preload,
+        "concurrency": args.concurrency,
+        "mix": args.mix,
+        "runs": runs,
+    }
+    json.dump(results, sys.stdout, indent=2)
+    print()
+    return runs
+
+
+if __name__ == "__main__":
+    main()
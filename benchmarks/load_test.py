@@ -0,0 +1,334 @@
+"""
+Load Test
+
+Seeds employees with EmployeeFactory, then drives the API with a weighted
+mix of list/get/create/update/delete requests from several threads and
+prints the latency percentiles and throughput of every operation as JSON.
+
+The requests go to the Flask test client in this process, to a gunicorn
+started for the run, or to a server that is already running. The throwaway
+SQLite database is used unless DATABASE_URI is set. Pass --baseline with the
+output of an earlier run to exit with status 1 when the p95 of any operation
+got slower by more than --threshold.
+
+Usage:
+    python -m benchmarks.load_test --target inprocess --seed-rows 1000 --requests 2000 --concurrency 8
+    python -m benchmarks.load_test --target gunicorn --workers 4 --output run.json
+    python -m benchmarks.load_test --target http --url http://localhost:8080 --baseline run.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import argparse
+import platform
+import threading
+import subprocess
+import http.client
+from functools import partial
+from urllib.parse import urlsplit
+
+os.environ.setdefault("DATABASE_URI", f"sqlite:///{tempfile.gettempdir()}/employee-benchmark.db")
+
+# pylint: disable=wrong-import-position
+from tests.factories import EmployeeFactory  # noqa: E402
+
+DEFAULT_MIX = "list=40,get=40,create=10,update=5,delete=5"
+EXPECTED_STATUS = {
+    "list": {200},
+    "get": {200, 404},
+    "create": {201},
+    "update": {200, 404},
+    "delete": {204},
+}
+
+
+class InProcessClient:  # pylint: disable=too-few-public-methods
+    """Sends requests to the Flask test client, one per thread"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method: str, path: str, payload=None):
+        """Returns the status code and JSON body of a request"""
+        response = self.client.open(path, method=method, json=payload)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpClient:  # pylint: disable=too-few-public-methods
+    """Sends requests over a keep-alive HTTP connection, one per thread"""
+
+    def __init__(self, url: str):
+        parts = urlsplit(url)
+        self.connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+
+    def request(self, method: str, path: str, payload=None):
+        """Returns the status code and JSON body of a request"""
+        body = None if payload is None else json.dumps(payload)
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        self.connection.request(method, path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        data = response.read()
+        try:
+            return response.status, json.loads(data) if data else None
+        except ValueError:
+            return response.status, None
+
+
+class IdPool:
+    """The ids of the employees that exist, shared by every thread"""
+
+    def __init__(self, ids: list):
+        self._ids = list(ids)
+        self._lock = threading.Lock()
+
+    def pick(self, rng: random.Random):
+        """Returns a random existing id"""
+        with self._lock:
+            return rng.choice(self._ids) if self._ids else 0
+
+    def take(self, rng: random.Random):
+        """Removes and returns a random id so that no one else deletes it"""
+        with self._lock:
+            if not self._ids:
+                return 0
+            position = rng.randrange(len(self._ids))
+            self._ids[position], self._ids[-1] = self._ids[-1], self._ids[position]
+            return self._ids.pop()
+
+    def add(self, employee_id: int) -> None:
+        """Adds the id of a new employee"""
+        with self._lock:
+            self._ids.append(employee_id)
+
+
+def run_operation(client, operation: str, ids: IdPool, rng: random.Random):
+    """Sends one request of the given kind and returns its status code"""
+    if operation == "list":
+        return client.request("GET", "/employees?limit=100")[0]
+    if operation == "get":
+        return client.request("GET", f"/employees/{ids.pick(rng)}")[0]
+    if operation == "create":
+        code, body = client.request("POST", "/employees", new_employee())
+        if code == 201:
+            ids.add(body["id"])
+        return code
+    if operation == "update":
+        employee_id = ids.pick(rng)
+        return client.request("PUT", f"/employees/{employee_id}", dict(new_employee(), id=employee_id))[0]
+    return client.request("DELETE", f"/employees/{ids.take(rng)}")[0]
+
+
+def new_employee() -> dict:
+    """Returns the JSON of a fake employee"""
+    data = EmployeeFactory.build().serialize()
+    data.pop("id")
+    return data
+
+
+def seed(client, count: int, chunk: int = 1000) -> list:
+    """Creates count employees with the bulk endpoint and returns their ids"""
+    ids = []
+    for start in range(0, count, chunk):
+        rows = [new_employee() for _ in range(min(chunk, count - start))]
+        code, body = client.request("POST", "/employees/bulk", rows)
+        if code != 201:
+            raise RuntimeError(f"Seeding failed with status {code}: {body}")
+        ids.extend(result["id"] for result in body)
+    return ids
+
+
+def parse_mix(mix: str) -> dict:
+    """Parses "list=40,get=40" into weights per operation"""
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if name not in EXPECTED_STATUS:
+            raise ValueError(f"Unknown operation in mix: {name}")
+        weights[name] = float(weight)
+    return weights
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Returns the nearest-rank percentile of already sorted values"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+def summarize(samples: list, elapsed: float) -> dict:
+    """Returns the request count, errors, req/s and latency percentiles in milliseconds"""
+    latencies = sorted(latency for latency, _ in samples)
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for _, ok in samples if not ok),
+        "requests_per_second": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def drive(make_client, ids: IdPool, args) -> dict:
+    """Sends args.requests requests from args.concurrency threads and returns the summary"""
+    weights = parse_mix(args.mix)
+    operations, cumulative = list(weights), list(weights.values())
+    samples = {operation: [] for operation in operations}
+    lock = threading.Lock()
+    per_thread = [args.requests // args.concurrency + (1 if n < args.requests % args.concurrency else 0)
+                  for n in range(args.concurrency)]
+
+    def worker(number: int):
+        rng = random.Random(args.seed + number)
+        client = make_client()
+        local = {operation: [] for operation in operations}
+        for _ in range(per_thread[number]):
+            operation = rng.choices(operations, weights=cumulative)[0]
+            start = time.perf_counter()
+            try:
+                ok = run_operation(client, operation, ids, rng) in EXPECTED_STATUS[operation]
+            except (OSError, http.client.HTTPException):
+                ok = False
+            local[operation].append((time.perf_counter() - start, ok))
+        with lock:
+            for operation, values in local.items():
+                samples[operation].extend(values)
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    everything = [sample for values in samples.values() for sample in values]
+    return {
+        "elapsed_seconds": round(elapsed, 3),
+        "total": summarize(everything, elapsed),
+        "operations": {operation: summarize(values, elapsed) for operation, values in samples.items() if values},
+    }
+
+
+def start_gunicorn(args) -> subprocess.Popen:
+    """Creates the tables, then starts gunicorn serving wsgi:app and waits until /ready answers"""
+    subprocess.run([sys.executable, "-m", "flask", "--app", "wsgi:app", "db-init"], check=True)
+    command = [
+        sys.executable, "-m", "gunicorn", "wsgi:app",
+        "--bind", f"127.0.0.1:{args.port}",
+        "--workers", str(args.workers),
+        "--threads", str(args.threads),
+        "--worker-class", args.worker_class,
+        "--log-level", "warning",
+    ]
+    # the rest of the settings come from gunicorn.conf.py, as in production
+    env = dict(os.environ, GUNICORN_PRELOAD=str(args.preload).lower())
+    process = subprocess.Popen(command, env=env)  # pylint: disable=consider-using-with
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline and process.poll() is None:
+        try:
+            if HttpClient(f"http://127.0.0.1:{args.port}").request("GET", "/ready")[0] == 200:
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"gunicorn did not become healthy (exit code {process.poll()})")
+
+
+def regressions(result: dict, baseline: dict, threshold: float) -> list:
+    """Returns the operations whose p95 is more than threshold slower than in the baseline"""
+    slower = []
+    for operation, summary in result["operations"].items():
+        before = baseline.get("operations", {}).get(operation)
+        if before and before["p95_ms"] and summary["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            slower.append({"operation": operation, "baseline_p95_ms": before["p95_ms"], "p95_ms": summary["p95_ms"]})
+    return slower
+
+
+def git_commit() -> str:
+    """Returns the commit being measured, if this is a git checkout"""
+    try:
+        output = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        return output.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def parse_args(argv=None):
+    """Parses the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--target", choices=["inprocess", "gunicorn", "http"], default="inprocess")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="server to load when --target http")
+    parser.add_argument("--port", type=int, default=8765, help="port of the gunicorn started by --target gunicorn")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=1, help="gunicorn threads per worker")
+    parser.add_argument("--worker-class", default="gthread", help="gunicorn worker class")
+    parser.add_argument("--no-preload", dest="preload", action="store_false", help="import the app in every worker")
+    parser.add_argument("--seed-rows", type=int, default=1000, help="employees to create before the run")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weights of list, get, create, update and delete")
+    parser.add_argument("--seed", type=int, default=42, help="random seed, for repeatable runs")
+    parser.add_argument("--output", help="also write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed p95 slowdown against the baseline")
+    return parser.parse_args(argv)
+
+
+def run(args) -> dict:
+    """Seeds the employees, loads the target and returns the results"""
+    process = None
+    if args.target == "inprocess":
+        from wsgi import app  # pylint: disable=import-outside-toplevel
+        from service.models import db  # pylint: disable=import-outside-toplevel
+        app.logger.setLevel("WARNING")
+        with app.app_context():
+            db.create_all()
+        make_client = partial(InProcessClient, app)
+    else:
+        if args.target == "gunicorn":
+            process = start_gunicorn(args)
+            args.url = f"http://127.0.0.1:{args.port}"
+        make_client = partial(HttpClient, args.url)
+
+    try:
+        EmployeeFactory.reset_sequence()
+        ids = IdPool(seed(make_client(), args.seed_rows))
+        result = drive(make_client, ids, args)
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+    result.update(
+        benchmark="load_test",
+        commit=git_commit(),
+        python=platform.python_version(),
+        database=os.environ["DATABASE_URI"].split("://", 1)[0],
+        config={key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+    )
+    return result
+
+
+def main(argv=None) -> int:
+    """Runs the load test and prints the results as JSON"""
+    args = parse_args(argv)
+    result = run(args)
+    status = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            result["regressions"] = regressions(result, json.load(file), args.threshold)
+        status = 1 if result["regressions"] else 0
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(result, file, indent=2)
+    json.dump(result, sys.stdout, indent=2)
+    print()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
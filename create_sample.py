@@ -1,9 +1,37 @@
 """
 Script to create sample data and write to json file.
+
+Without arguments it writes 10 factory employees to sample_employees.json.
+With --rows it generates up to millions of employees for performance tests:
+names are drawn from pools that Faker fills once per seed, chunks are made by
+several processes, and every chunk has its own seed so the output only
+depends on --seed and never on --workers. The rows are written to an NDJSON
+or CSV file that "flask employees-import" can load, or straight into
+DATABASE_URI. The generation rate is reported on stderr.
+
+Usage:
+    python create_sample.py
+    python create_sample.py --rows 1000000 --output employees.ndjson --workers 4
+    python create_sample.py --rows 5000000 --output employees.csv --seed 7
+    python create_sample.py --rows 1000000 --database
 """
+import io
+import csv
+import sys
 import json
+import random
+import argparse
+import multiprocessing
+from faker import Faker
+
+from service.models import Gender
+from tests.factories import EmployeeFactory, DEPARTMENTS
+
+GENDERS = [gender.name for gender in Gender]
+POOL_SIZE = 1000
+CHUNK_SIZE = 50000
 
-from tests.factories import EmployeeFactory
+_pools = {}
 
 
 def generate():
@@ -16,9 +44,127 @@ def generate():
         employee_dict.pop("id", None)
         employees.append(employee_dict)
 
-    with open("sample_employees.json", "w") as file:
+    with open("sample_employees.json", "w", encoding="utf-8") as file:
         json.dump(employees, file, indent=4)
 
 
+def name_pools(seed: int) -> tuple:
+    """Returns the first and last names to draw from, the same for the same seed"""
+    if seed not in _pools:
+        fake = Faker()
+        fake.seed_instance(seed)
+        _pools[seed] = (
+            [fake.first_name() for _ in range(POOL_SIZE)],
+            [fake.last_name() for _ in range(POOL_SIZE)],
+        )
+    return _pools[seed]
+
+
+def encoded_pools(seed: int, file_format: str) -> tuple:
+    """Returns the pools with every value already encoded as a JSON string or CSV field"""
+    key = (seed, file_format)
+    if key not in _pools:
+        encode = json.dumps if file_format == "ndjson" else csv_field
+        first_names, last_names = name_pools(seed)
+        _pools[key] = tuple([encode(value) for value in pool] for pool in (first_names, last_names, DEPARTMENTS, GENDERS))
+    return _pools[key]
+
+
+def csv_field(value: str) -> str:
+    """Returns value quoted the way the csv module would quote it"""
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="").writerow([value])
+    return buffer.getvalue()
+
+
+def make_chunk(spec: tuple):
+    """
+    Generates one chunk of employees
+    :param spec: (seed, chunk number, first id, rows, format), where format is
+        "ndjson" or "csv" for text or "rows" for (first, last, department, gender) tuples
+    """
+    seed, number, first_id, count, file_format = spec
+    rng = random.Random(f"{seed}:{number}")
+    pools = name_pools(seed) + (DEPARTMENTS, GENDERS) if file_format == "rows" else encoded_pools(seed, file_format)
+    columns = [rng.choices(pool, k=count) for pool in pools]
+    if file_format == "rows":
+        return list(zip(*columns))
+    ids = range(first_id, first_id + count)
+    if file_format == "csv":
+        return "".join(f"{i},{f},{l},{d},{g}\n" for i, f, l, d, g in zip(ids, *columns))
+    return "".join(
+        f'{{"id":{i},"first_name":{f},"last_name":{l},"department":{d},"gender":{g}}}\n'
+        for i, f, l, d, g in zip(ids, *columns)
+    )
+
+
+def chunk_specs(rows: int, seed: int, file_format: str, chunk_size: int = CHUNK_SIZE):
+    """Yields the spec of every chunk in order"""
+    for number, start in enumerate(range(0, rows, chunk_size)):
+        yield seed, number, start + 1, min(chunk_size, rows - start), file_format
+
+
+def generate_chunks(rows: int, seed: int, file_format: str, workers: int):
+    """Yields the chunks in order, made by workers processes"""
+    specs = chunk_specs(rows, seed, file_format)
+    if workers <= 1:
+        yield from map(make_chunk, specs)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap(make_chunk, specs)
+
+
+def write_file(args, progress) -> None:
+    """Writes the employees to args.output"""
+    file_format = "csv" if args.output.lower().endswith(".csv") else "ndjson"
+    with open(args.output, "w", encoding="utf-8") as file:
+        if file_format == "csv":
+            file.write("id,first_name,last_name,department,gender\n")
+        for number, chunk in enumerate(generate_chunks(args.rows, args.seed, file_format, args.workers)):
+            file.write(chunk)
+            progress.add(min(CHUNK_SIZE, args.rows - number * CHUNK_SIZE))
+
+
+def write_database(args, progress) -> None:
+    """Writes the employees into DATABASE_URI with the import path of the service"""
+    # pylint: disable=import-outside-toplevel
+    from wsgi import app
+    from service.models import db
+    from service.common import transfer
+
+    def rows():
+        for chunk in generate_chunks(args.rows, args.seed, "rows", args.workers):
+            for first_name, last_name, department, gender in chunk:
+                yield {"first_name": first_name, "last_name": last_name, "department": department, "gender": Gender[gender]}
+
+    with app.app_context():
+        db.create_all()
+        transfer.write_rows(rows(), app.config["BULK_CHUNK_SIZE"], progress)
+
+
+def main(argv=None) -> None:
+    """Generates the employees asked for on the command line"""
+    parser = argparse.ArgumentParser(description="Generates sample employees")
+    parser.add_argument("--rows", type=int, help="employees to generate")
+    parser.add_argument("--output", help="NDJSON or CSV file to write, by its extension")
+    parser.add_argument("--database", action="store_true", help="insert into DATABASE_URI instead")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    args = parser.parse_args(argv)
+    if not args.rows:
+        generate()
+        return
+    if not args.output and not args.database:
+        parser.error("--rows needs --output or --database")
+
+    from service.common.transfer import Progress  # pylint: disable=import-outside-toplevel
+    progress = Progress("Generated", every=1000000, echo=lambda message: print(message, file=sys.stderr))
+    if args.database:
+        write_database(args, progress)
+    else:
+        write_file(args, progress)
+    progress.finish()
+
+
 if __name__ == "__main__":
-    generate()
+    main()
@@ -0,0 +1,89 @@
+"""
+Gunicorn configuration
+
+gunicorn reads this file from the working directory. Every setting can be
+changed with an environment variable, and command line options still win.
+
+By default each CPU the container may use runs a gthread worker with a few
+threads, since requests mostly wait on the database. The app is preloaded in
+the master so that the workers share its imported modules copy-on-write; the
+master opens no database connections, and post_fork() drops any pools and
+restarts the log thread that fork did not copy. Workers are recycled after
+a jittered number of requests so that they never all restart at once, and
+worker_exit() keeps the metrics a recycled worker collected.
+
+Usage:
+    gunicorn wsgi:app
+    GUNICORN_WORKERS=4 GUNICORN_THREADS=8 gunicorn wsgi:app
+"""
+# pylint: disable=invalid-name
+import os
+import math
+from service import config as _config
+
+
+def cpu_count() -> int:
+    """Returns the CPUs this process may use, honoring its affinity and a cgroup v2 CPU quota"""
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover
+        count = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max", encoding="utf-8") as file:
+            quota, period = file.read().split()
+        if quota != "max":
+            count = min(count, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return count
+
+
+def default_workers(cpus: int, threaded: bool) -> int:
+    """Returns one worker per CPU for threaded workers and 2 * CPUs + 1 for sync ones, never fewer than 2"""
+    return max(2, cpus if threaded else 2 * cpus + 1)
+
+
+def default_threads(threaded: bool, pool_size: int) -> int:
+    """Returns 4 threads per threaded worker, but no more than the connections its pool can hand out"""
+    return max(1, min(4, pool_size)) if threaded else 1
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """Gets a worker forked from a preloaded master ready to serve"""
+    if server.cfg.preload_app:
+        # pylint: disable=import-outside-toplevel
+        from wsgi import app
+        from service import after_fork
+        after_fork(app)
+
+
+def worker_exit(server, worker):  # pylint: disable=unused-argument
+    """Folds the metrics of an exiting worker into those of the workers that exited before it"""
+    # pylint: disable=import-outside-toplevel
+    from service.common.metrics import metrics
+    metrics.retire()
+
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+_threaded = worker_class == "gthread"
+workers = int(os.getenv("GUNICORN_WORKERS", os.getenv("WEB_CONCURRENCY", str(default_workers(cpu_count(), _threaded)))))
+threads = int(os.getenv("GUNICORN_THREADS", str(default_threads(_threaded, _config.DB_POOL_SIZE + _config.DB_MAX_OVERFLOW))))
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '8080')}")
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+# Keep idle connections open longer than the load balancer in front does
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+
+# Recycle workers to bound slow leaks, at jittered points so they restart one at a time
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", str(max_requests // 10)))
+
+# The heartbeat files of the workers go to memory when a tmpfs is there, as in Docker
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
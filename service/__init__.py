@@ -4,6 +4,7 @@ Package for the application models and service routes
 This module creates and configures the Flask app and sets up the logging and SQL database
 """
 import sys
+import time
 from flask import Flask
 from service import config
 from service.common import log_handlers
@@ -11,31 +12,74 @@ from service.common import log_handlers
 
 def create_app():
     """Initialize the core application"""
+    start = time.perf_counter()
     app = Flask(__name__)
     app.config.from_object(config)
+    # pylint: disable=import-outside-toplevel
+    from service.common.json_provider import JSONProvider
+    app.json = JSONProvider(app)
 
     # Initialize Plugins
-    # pylint: disable=import-outside-toplevel
     from service.models import db
+    from service.common.cache import cache
+    from service.common.pool_metrics import init_pool_metrics
+    init_pool_metrics(app)
     db.init_app(app)
+    cache.init_app(app)
+    from service.common.compression import compression
+    compression.init_app(app)
 
     with app.app_context():
+        from service.common.metrics import metrics
+        metrics.init_app(app, db.engine)
+        from service.common.profiler import profiler
+        profiler.init_app(app, db.engine)
+        init_replicas(app, db, (metrics, profiler))
+        from service.common.limits import limiter
+        limiter.init_app(app)
+
         # Dependencies requires that we import the routes AFTER the Flask app is created
         # pylint: disable=wrong-import-position, wrong-import-order, unused-import
         from service import routes, models
         from service.common import error_handlers, cli_commands
-        try:
-            models.init_db()
-        except Exception as error:  # pylint: disable=broad-except
-            app.logger.critical("%s: Cannot continue", error)
-            # gunicorn requires exit code 4 to stop spawning workers when they die
-            sys.exit(4)
+        # The tables are created by "flask db-init" before the workers start, so that
+        # booting does not wait for the database, which is only connected on first use
+        if app.config["DB_CREATE_ON_STARTUP"]:
+            try:
+                models.init_db()
+            except Exception as error:  # pylint: disable=broad-except
+                app.logger.critical("%s: Cannot continue", error)
+                # gunicorn requires exit code 4 to stop spawning workers when they die
+                sys.exit(4)
 
         log_handlers.init_logging(app, "gunicorn.error")
 
         app.logger.info(70 * "*")
         app.logger.info(" EMPLOYEE MANAGEMENT SERVICE ".center(70, "*"))
         app.logger.info(70 * "*")
-        app.logger.info("Service initialized!")
+        app.logger.info("Service initialized in %.3f seconds!", time.perf_counter() - start)
 
         return app
+
+
+def init_replicas(app, db, watchers: tuple) -> None:
+    """Sends the reads of GET requests to the replica binds and lets the watchers see their queries"""
+    from service.common.replicas import replicas  # pylint: disable=import-outside-toplevel
+    engines = [db.engines[key] for key in app.config.get("SQLALCHEMY_BINDS") or {} if key.startswith("replica-")]
+    replicas.init_app(app, db.session, engines)
+    for engine in engines:
+        for watcher in watchers:
+            watcher.watch(engine)
+
+
+def after_fork(app) -> None:
+    """
+    Gets a worker that gunicorn forked from a preloaded master ready to serve:
+    new connection pools and a new log thread, since fork copies neither safely
+    """
+    from service.models import db  # pylint: disable=import-outside-toplevel
+    with app.app_context():
+        for engine in db.engines.values():
+            # the pool may hold the sockets of the master, forget them without closing them
+            engine.dispose(close=False)
+    log_handlers.restart_queue_listener()
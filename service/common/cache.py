@@ -0,0 +1,197 @@
+"""
+Cache
+
+This module contains a read-through cache for serialized resources with
+pluggable backends: an in-process LRU with a TTL and a size bound, and a
+shared backend that can sit in front of any Redis-like client
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheBackend:
+    """Interface that every cache backend implements"""
+
+    def get(self, key: str):
+        """Returns the value stored under key, or None if it is missing or expired"""
+        raise NotImplementedError
+
+    def set(self, key: str, value) -> None:
+        """Stores value under key"""
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        """Removes key from the cache"""
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        """Removes every key from the cache"""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        """Returns the hit, miss and eviction counters of the cache"""
+        raise NotImplementedError
+
+
+class NullCache(CacheBackend):
+    """Backend that never stores anything, used when caching is disabled"""
+
+    def __init__(self):
+        self.misses = 0
+
+    def get(self, key: str):
+        self.misses += 1
+
+    def set(self, key: str, value) -> None:
+        pass
+
+    def delete(self, key: str) -> None:
+        pass
+
+    def clear(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": "null", "hits": 0, "misses": self.misses, "evictions": 0}
+
+
+class LRUCache(CacheBackend):
+    """In-process least-recently-used cache whose entries expire after ttl seconds"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires, value = item
+            if expires <= self._clock():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value) -> None:
+        with self._lock:
+            self._data[key] = (self._clock() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            "backend": "lru",
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class SharedCache(CacheBackend):
+    """
+    Cache shared between workers, stored as JSON in a Redis-like client
+
+    The client needs get(key), set(key, value, ex=seconds), delete(key) and
+    scan_iter(match=pattern), which redis.Redis provides
+    """
+
+    def __init__(self, client, ttl: float = 60.0, prefix: str = "cache:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    def set(self, key: str, value) -> None:
+        self.client.set(self.prefix + key, json.dumps(value), ex=int(self.ttl))
+
+    def delete(self, key: str) -> None:
+        self.client.delete(self.prefix + key)
+
+    def clear(self) -> None:
+        for key in list(self.client.scan_iter(match=self.prefix + "*")):
+            self.client.delete(key)
+
+    def stats(self) -> dict:
+        # evictions happen inside the shared store, so they are not visible here
+        return {"backend": "shared", "hits": self.hits, "misses": self.misses, "evictions": 0}
+
+
+class Cache:
+    """Read-through cache that delegates to a pluggable CacheBackend"""
+
+    def __init__(self, backend: CacheBackend = None):
+        self.backend = backend or NullCache()
+
+    def init_app(self, app, backend: CacheBackend = None) -> None:
+        """Configures the backend from CACHE_SIZE and CACHE_TTL unless one is given"""
+        if backend is None:
+            size = app.config.get("CACHE_SIZE", 1024)
+            ttl = app.config.get("CACHE_TTL", 60)
+            backend = LRUCache(size, ttl) if size > 0 else NullCache()
+        self.backend = backend
+
+    @property
+    def enabled(self) -> bool:
+        """Whether values are kept at all"""
+        return not isinstance(self.backend, NullCache)
+
+    def get(self, key: str):
+        """Returns the value stored under key, or None on a miss"""
+        return self.backend.get(key)
+
+    def set(self, key: str, value) -> None:
+        """Stores value under key"""
+        self.backend.set(key, value)
+
+    def delete(self, key: str) -> None:
+        """Invalidates key"""
+        self.backend.delete(key)
+
+    def clear(self) -> None:
+        """Invalidates every key"""
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        """Returns the hit, miss and eviction counters of the backend"""
+        return self.backend.stats()
+
+
+# The cache used by the service, configured in create_app()
+cache = Cache()
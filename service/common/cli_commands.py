@@ -1,8 +1,13 @@
 """
 Flask CLI Command Extensions
 """
+from datetime import timedelta
+import click
 from flask import current_app as app  # Import Flask application
-from service.models import db
+from service.models import (
+    db, init_db, upgrade_db, DataValidationError, Employee, EmployeeTombstone, IdempotencyKey, database_now
+)
+from service.common import transfer
 
 
 ######################################################################
@@ -19,3 +24,116 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to create the tables that do not exist yet
+# Usage:
+#   flask db-init
+######################################################################
+@app.cli.command("db-init")
+def db_init():
+    """
+    Creates any missing tables, retrying until the database is reachable.
+    Run it once per deployment before starting the workers
+    """
+    init_db()
+    app.logger.info("Database tables created")
+
+
+######################################################################
+# Command to add the indexes that an existing database is missing
+# Usage:
+#   flask db-upgrade
+######################################################################
+@app.cli.command("db-upgrade")
+def db_upgrade():
+    """
+    Creates the missing tables and indexes and drops the obsolete indexes.
+    Safe to run again, run it after deploying a version that adds an index
+    """
+    for statement in upgrade_db():
+        click.echo(statement)
+
+
+######################################################################
+# Commands to move the employee table between environments
+# Usage:
+#   flask employees-export --output employees.ndjson
+#   flask employees-import employees.csv
+######################################################################
+@app.cli.command("employees-export")
+@click.option("--output", "-o", type=click.File("w", lazy=False), default="-", help="File to write, - for stdout")
+@click.option("--format", "file_format", type=click.Choice(transfer.FORMATS), help="Guessed from the file name")
+@click.option("--batch-size", type=int, help="Rows read from the cursor at a time")
+@click.option("--progress-every", type=int, default=100000, help="Report progress every so many rows, 0 for never")
+def employees_export(output, file_format, batch_size, progress_every):
+    """
+    Streams every employee to an NDJSON or CSV file in constant memory
+    """
+    progress = transfer.Progress("Exported", progress_every)
+    batch_size = batch_size or app.config["STREAM_BATCH_SIZE"]
+    transfer.export_employees(output, transfer.format_of(output, file_format), batch_size, progress)
+
+
+@app.cli.command("employees-import")
+@click.argument("source", type=click.File("r", lazy=False), default="-")
+@click.option("--format", "file_format", type=click.Choice(transfer.FORMATS), help="Guessed from the file name")
+@click.option("--batch-size", type=int, help="Rows written at a time")
+@click.option("--keep-ids", is_flag=True, help="Keep the ids of the file instead of assigning new ones")
+@click.option("--progress-every", type=int, default=100000, help="Report progress every so many rows, 0 for never")
+def employees_import(source, file_format, batch_size, keep_ids, progress_every):  # pylint: disable=too-many-arguments
+    """
+    Streams employees from an NDJSON or CSV file into the database, with COPY on PostgreSQL
+    """
+    progress = transfer.Progress("Imported", progress_every)
+    batch_size = batch_size or app.config["BULK_CHUNK_SIZE"]
+    try:
+        transfer.import_employees(source, transfer.format_of(source, file_format), batch_size, progress, keep_ids)
+    except DataValidationError as error:
+        raise click.ClickException(f"{error} ({progress.rows} rows were imported before the error)") from error
+
+
+######################################################################
+# Command to forget old deletions
+# Usage:
+#   flask tombstones-prune --days 30
+######################################################################
+@app.cli.command("tombstones-prune")
+@click.option("--days", type=float, default=30, help="Keep the tombstones of the last so many days")
+def tombstones_prune(days):
+    """
+    Removes the tombstones of deleted employees that the change feed no longer needs
+    """
+    count = EmployeeTombstone.prune(database_now() - timedelta(days=days))
+    click.echo(f"Removed {count} tombstones")
+
+
+######################################################################
+# Command to remove the expired idempotency keys
+# Usage:
+#   flask idempotency-prune
+######################################################################
+@app.cli.command("idempotency-prune")
+@click.option("--hours", type=float, default=None, help="Keep the keys of the last so many hours (IDEMPOTENCY_TTL_HOURS)")
+def idempotency_prune(hours):
+    """
+    Removes the idempotency keys that retries can no longer use
+    """
+    hours = app.config["IDEMPOTENCY_TTL_HOURS"] if hours is None else hours
+    count = IdempotencyKey.prune(database_now() - timedelta(hours=hours))
+    click.echo(f"Removed {count} idempotency keys")
+
+
+######################################################################
+# Command to build the search index of an existing table
+# Usage:
+#   flask search-reindex
+######################################################################
+@app.cli.command("search-reindex")
+def search_reindex():
+    """
+    Creates the index of /employees/search if it is missing and fills it
+    """
+    Employee.rebuild_search_index()
+    click.echo("Search index rebuilt")
@@ -0,0 +1,104 @@
+"""
+Response Compression
+
+This module compresses the JSON and text responses with brotli, when it is
+installed, or gzip, whichever the client prefers in Accept-Encoding. Bodies
+shorter than COMPRESS_MIN_SIZE are sent as they are, since compressing them
+costs more CPU than the bytes it saves. Streamed bodies are compressed chunk
+by chunk and flushed after each one, so the client still gets every batch as
+soon as it is produced. The ETag of a compressed response is made weak, as
+its bytes are not those of the uncompressed one
+"""
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# Responses that are never worth compressing, or that must not be changed
+SKIPPED_STATUS = frozenset((204, 206, 304))
+
+
+class ResponseCompression:
+    """Compresses the responses of a Flask app that the client accepts compressed"""
+
+    def __init__(self):
+        self.min_size = 1024
+        self.gzip_level = 6
+        self.brotli_quality = 4
+        self.encodings = ("br", "gzip") if brotli else ("gzip",)
+
+    def init_app(self, app) -> None:
+        """Registers the response hook on app"""
+        self.min_size = app.config.get("COMPRESS_MIN_SIZE", 1024)
+        self.gzip_level = app.config.get("COMPRESS_GZIP_LEVEL", 6)
+        self.brotli_quality = app.config.get("COMPRESS_BROTLI_QUALITY", 4)
+        if app.config.get("COMPRESS_RESPONSES", True):
+            app.after_request(self._after_request)
+
+    def compressor(self, encoding: str) -> tuple:
+        """
+        Returns the (compress, flush, finish) functions of a new streaming compressor:
+        compress(data) and flush() return the bytes ready so far, finish() the last ones
+        """
+        if encoding == "br":
+            stream = brotli.Compressor(quality=self.brotli_quality)
+            return stream.process, stream.flush, stream.finish
+        stream = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # with a gzip header
+        return stream.compress, lambda: stream.flush(zlib.Z_SYNC_FLUSH), stream.flush
+
+    def _after_request(self, response):
+        if not compressible(response):
+            return response
+        # caches must keep the compressed and uncompressed responses apart
+        response.vary.add("Accept-Encoding")
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if not encoding:
+            return response
+        if response.is_streamed:
+            original = response.response
+            response.response = compress_stream(response.iter_encoded(), original, self.compressor(encoding))
+            response.headers.pop("Content-Length", None)
+        else:
+            body = response.get_data()
+            if len(body) < self.min_size:
+                return response
+            compress, _, finish = self.compressor(encoding)
+            response.set_data(compress(body) + finish())
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+def compressible(response) -> bool:
+    """Returns True if the response is text or JSON that may still be compressed"""
+    return (
+        request.method != "HEAD"
+        and 200 <= response.status_code
+        and response.status_code not in SKIPPED_STATUS
+        and not response.direct_passthrough
+        and "Content-Encoding" not in response.headers
+        and "no-transform" not in response.headers.get("Cache-Control", "")
+        and (response.mimetype.startswith("text/") or response.mimetype.endswith("json"))
+    )
+
+
+def compress_stream(chunks, original, compressor: tuple):
+    """Yields the compressed chunks, flushing after each one so that none waits for the next"""
+    compress, flush, finish = compressor
+    try:
+        for chunk in chunks:
+            yield compress(chunk) + flush()
+        yield finish()
+    finally:
+        # the server closes this generator, which has to close the body it replaced
+        if hasattr(original, "close"):
+            original.close()
+
+
+# The response compression of the service, configured in create_app()
+compression = ResponseCompression()
@@ -0,0 +1,64 @@
+"""
+JSON Provider
+
+This module contains the JSON provider of the service. It encodes with
+orjson when it is installed and JSON_ENCODER is "orjson", falls back to the
+standard library otherwise, and reports how long every encode took to the
+metrics
+"""
+import time
+from flask.json.provider import DefaultJSONProvider
+from service.common.metrics import metrics
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask JSON provider with a fast orjson path and a standard library fallback"""
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.use_orjson = orjson is not None and app.config.get("JSON_ENCODER", "orjson") == "orjson"
+
+    def dumps(self, obj, **kwargs) -> str:
+        start = time.perf_counter()
+        try:
+            encoded = self._orjson_dumps(obj, kwargs)
+            if encoded is not None:
+                return encoded.decode("utf-8")
+            return super().dumps(obj, **kwargs)
+        finally:
+            metrics.observe_serialization(time.perf_counter() - start)
+
+    def response(self, *args, **kwargs):
+        """Returns a JSON response, encoding straight to bytes when orjson is used"""
+        if not self.use_orjson:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = (self.compact is None and self._app.debug) or self.compact is False
+        start = time.perf_counter()
+        try:
+            body = self._orjson_dumps(obj, {"indent": 2} if pretty else {})
+        finally:
+            metrics.observe_serialization(time.perf_counter() - start)
+        if body is None:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
+
+    def _orjson_dumps(self, obj, kwargs: dict):
+        """Returns obj encoded by orjson, or None if the standard library has to do it"""
+        if not self.use_orjson or set(kwargs) - {"indent", "separators"} or kwargs.get("indent") not in (None, 2):
+            return None
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=self.default, option=option)
+        except orjson.JSONEncodeError:
+            # e.g. integers wider than 64 bits, which the standard library can encode
+            return None
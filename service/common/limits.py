@@ -0,0 +1,211 @@
+"""
+Rate Limits and Load Shedding
+
+This module keeps bursts of requests from exhausting the database. A token
+bucket per client and route lets every client call a route
+RATE_LIMIT_PER_SECOND times a second on average, in bursts of up to
+RATE_LIMIT_BURST, and answers 429 with Retry-After beyond that. The buckets
+are kept by a pluggable backend: in this process, or in a Redis-like store
+shared by every worker. A concurrency limiter then lets at most
+CONCURRENCY_LIMIT requests of a worker use the database at once. Up to
+CONCURRENCY_QUEUE more wait CONCURRENCY_QUEUE_TIMEOUT seconds for a turn and
+the rest are answered 503 right away, so that an overload is shed fast
+instead of timing out slowly on the connection pool. Only the views marked
+with uses_database() wait for a turn before they run; views that use the
+database only sometimes, such as reads served from the cache, call
+use_database() right before they do
+"""
+import math
+import time
+import threading
+from collections import OrderedDict
+from flask import g, request, current_app
+from werkzeug.exceptions import TooManyRequests, ServiceUnavailable
+from service.common.metrics import metrics
+
+
+class RateLimitBackend:
+    """Interface that every rate limit backend implements"""
+
+    def take(self, key: str, rate: float, burst: float) -> float:
+        """
+        Takes a token from the bucket of key, which holds up to burst tokens and
+        gains rate tokens a second. Returns 0 if there was one, or else the
+        seconds until there will be
+        """
+        raise NotImplementedError
+
+
+class MemoryBuckets(RateLimitBackend):
+    """Token buckets of this process, forgetting the least recently used past maxsize keys"""
+
+    def __init__(self, maxsize: int = 10000, clock=time.monotonic):
+        self.maxsize = maxsize
+        self._clock = clock
+        self._buckets = OrderedDict()  # key: (tokens, time they were counted)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: float) -> float:
+        now = self._clock()
+        with self._lock:
+            tokens, stamp = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - stamp) * rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            self._buckets[key] = (tokens - 1 if not wait else tokens, now)
+            self._buckets.move_to_end(key)
+            # a forgotten bucket comes back full, which is what it would be after a quiet spell
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class SharedBuckets(RateLimitBackend):
+    """
+    Token buckets shared between workers, kept as hashes in a Redis-like client
+
+    The client needs eval(script, numkeys, *keys_and_args), which redis.Redis
+    provides. The bucket is updated by a script so that two workers never
+    take the same token, on the clock of the store so that theirs don't matter
+    """
+
+    SCRIPT = """
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'stamp')
+local tokens = math.min(burst, (tonumber(bucket[1]) or burst) + (now - (tonumber(bucket[2]) or now)) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'stamp', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+    def __init__(self, client, prefix: str = "ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+
+    def take(self, key: str, rate: float, burst: float) -> float:
+        # the wait is returned as text, since Redis would round a number down to an integer
+        return float(self.client.eval(self.SCRIPT, 1, self.prefix + key, rate, burst))
+
+
+class ConcurrencyLimiter:
+    """Lets limit callers in at once and up to queue_size more wait timeout seconds for a turn"""
+
+    def __init__(self, limit: int, queue_size: int = 0, timeout: float = 0.0):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        """Returns True with a slot taken, or False if the queue is full or the wait timed out"""
+        acquired = self._slots.acquire(blocking=False)
+        if not acquired:
+            with self._lock:
+                if self.waiting >= self.queue_size or self.timeout <= 0:
+                    return False
+                self.waiting += 1
+            try:
+                acquired = self._slots.acquire(timeout=self.timeout)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+        if acquired:
+            with self._lock:
+                self.active += 1
+        return acquired
+
+    def release(self) -> None:
+        """Gives back the slot taken by acquire()"""
+        with self._lock:
+            self.active -= 1
+        self._slots.release()
+
+
+class RequestLimiter:
+    """Rate limits and sheds the requests of a Flask app before they reach the database"""
+
+    def __init__(self):
+        self.backend = MemoryBuckets()
+        self.rate = 0.0
+        self.burst = 0.0
+        self.client_header = ""
+        self.concurrency = None
+
+    def init_app(self, app, backend: RateLimitBackend = None) -> None:
+        """Configures the limits from the app config and registers the request hooks"""
+        self.backend = backend or MemoryBuckets()
+        self.rate = app.config.get("RATE_LIMIT_PER_SECOND", 0.0)
+        self.burst = max(app.config.get("RATE_LIMIT_BURST", 0.0), 1.0)
+        self.client_header = app.config.get("RATE_LIMIT_CLIENT_HEADER", "")
+        limit = app.config.get("CONCURRENCY_LIMIT", 0)
+        self.concurrency = None
+        if limit > 0:
+            queue_size = app.config.get("CONCURRENCY_QUEUE", limit)
+            self.concurrency = ConcurrencyLimiter(limit, queue_size, app.config.get("CONCURRENCY_QUEUE_TIMEOUT", 1.0))
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+        metrics.add_collector(self.collect)
+
+    @staticmethod
+    def exempt(view):
+        """Marks a view that must always answer, such as a health check"""
+        view.limits_exempt = True
+        return view
+
+    @staticmethod
+    def uses_database(view):
+        """Marks a view that always uses the database, so that it waits for a database slot before it runs"""
+        view.limits_database = True
+        return view
+
+    def use_database(self) -> None:
+        """Waits for a database slot for the rest of the request, or sheds it with 503_SERVICE_UNAVAILABLE"""
+        if not self.concurrency or g.get("limits_slot"):
+            return
+        if not self.concurrency.acquire():
+            shed("overloaded")
+            retry_after = max(1, math.ceil(self.concurrency.timeout))
+            raise ServiceUnavailable("The service is overloaded, try again later.", retry_after=retry_after)
+        g.limits_slot = True
+
+    def client(self) -> str:
+        """Returns who is making the request: the client header when it is configured, or the address"""
+        return (self.client_header and request.headers.get(self.client_header)) or request.remote_addr or "unknown"
+
+    def collect(self, registry) -> None:
+        """Reports how many requests are using the database and waiting for a turn"""
+        if self.concurrency:
+            registry.set("http_requests_db_active", value=self.concurrency.active)
+            registry.set("http_requests_db_waiting", value=self.concurrency.waiting)
+
+    def _before_request(self) -> None:
+        view = current_app.view_functions.get(request.endpoint)
+        if view is None or getattr(view, "limits_exempt", False):
+            return
+        if self.rate > 0:
+            wait = self.backend.take(f"{self.client()}|{request.endpoint}", self.rate, self.burst)
+            if wait:
+                shed("rate_limited")
+                raise TooManyRequests("Too many requests, slow down.", retry_after=max(1, math.ceil(wait)))
+        if getattr(view, "limits_database", False):
+            self.use_database()
+
+    def _teardown_request(self, error=None) -> None:  # pylint: disable=unused-argument
+        # a streamed response holds its slot until the stream ends and its request is torn down
+        if g.pop("limits_slot", False):
+            self.concurrency.release()
+
+
+def shed(reason: str) -> None:
+    """Counts a request refused to protect the database"""
+    metrics.registry.inc("http_requests_shed_total", {"endpoint": request.endpoint, "reason": reason})
+
+
+# The request limiter of the service, configured in create_app()
+limiter = RequestLimiter()
@@ -1,21 +1,126 @@
-
 """
 Log Handlers
 
 This module contains utility functions to set up logging
-consistently
+consistently. Records are put on a queue by the request threads and written
+as JSON lines by a background listener, so a slow log sink never holds up a
+request, and every request is summarized in a single sampled line
 """
+import json
+import time
+import queue
+import atexit
+import random
 import logging
+from logging.handlers import QueueHandler, QueueListener
+from flask import g, request, current_app
+
+# Attributes of every LogRecord, anything else was passed with extra=
+RESERVED_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, including the extra= fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S%z"),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        data.update((key, value) for key, value in vars(record).items() if key not in RESERVED_ATTRIBUTES)
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
 
 
 def init_logging(app, logger_name: str):
     """Set up logging for production"""
     app.logger.propagate = False
     gunicorn_logger = logging.getLogger(logger_name)
-    app.logger.handlers = gunicorn_logger.handlers
-    app.logger.setLevel(gunicorn_logger.level)
+    level = app.config.get("LOGGING_LEVEL") or gunicorn_logger.level
+    handlers = list(gunicorn_logger.handlers)
     # Make all log formats consistent
-    formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z")
-    for handler in app.logger.handlers:
+    if app.config.get("LOG_FORMAT", "json") == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z")
+    for handler in handlers:
         handler.setFormatter(formatter)
+    if app.config.get("LOG_QUEUE", True):
+        handlers = [start_queue_listener(handlers)]
+    # The models log through the "flask.app" logger, send it to the same place
+    for logger in (app.logger, logging.getLogger("flask.app")):
+        logger.handlers = handlers
+        logger.setLevel(level)
+        logger.propagate = False
+    app.after_request(log_request)
     app.logger.info("Logging handler established")
+
+
+def start_queue_listener(handlers: list) -> QueueHandler:
+    """Starts a thread that writes the records to handlers and returns the handler that queues them"""
+    global _listener  # pylint: disable=global-statement
+    stop_queue_listener()
+    records = queue.SimpleQueue()
+    _listener = QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    return QueueHandler(records)
+
+
+def restart_queue_listener() -> None:
+    """
+    Starts the listener again in a forked worker: fork copies the queue and the
+    handlers but not the thread that writes them. The records already queued
+    are dropped, the listener of the parent writes them
+    """
+    global _listener  # pylint: disable=global-statement
+    if _listener is not None:
+        try:
+            while True:
+                _listener.queue.get_nowait()
+        except queue.Empty:
+            pass
+        _listener = QueueListener(_listener.queue, *_listener.handlers, respect_handler_level=True)
+        _listener.start()
+
+
+@atexit.register
+def stop_queue_listener() -> None:
+    """Writes the records still queued and stops the listener thread"""
+    global _listener  # pylint: disable=global-statement
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def log_request(response):
+    """Logs one summary line per request, sampling the successful ones"""
+    if response.status_code < 400 and random.random() >= current_app.config.get("LOG_SAMPLE_RATE", 1.0):
+        return response
+    level = logging.WARNING if response.status_code >= 500 else logging.INFO
+    if not current_app.logger.isEnabledFor(level):
+        return response
+    start = g.get("metrics_start")
+    duration_ms = round((time.perf_counter() - start) * 1000, 3) if start else None
+    route = request.url_rule.rule if request.url_rule else request.path
+    current_app.logger.log(
+        level,
+        "%s %s %s",
+        request.method,
+        route,
+        response.status_code,
+        extra={
+            "route": route,
+            "method": request.method,
+            "status": response.status_code,
+            "duration_ms": duration_ms,
+            "db_ms": round(g.get("db_seconds", 0.0) * 1000, 3),
+            "db_queries": g.get("db_queries", 0),
+        },
+    )
+    return response
@@ -0,0 +1,351 @@
+"""
+Metrics
+
+This module collects request, database and serialization metrics and
+exposes them in the Prometheus text format. When PROMETHEUS_MULTIPROC_DIR
+is set, every worker process writes its samples to a file in that directory
+so that whichever worker answers the scrape can report the whole container.
+The counters of workers that have exited are folded into a single file, so
+recycled workers leave nothing else behind
+"""
+import os
+import glob
+import json
+import time
+import fcntl
+import threading
+from contextlib import contextmanager
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from service.common.cache import cache
+from service.common.pool_metrics import pool_metrics
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# The counters of every worker that has exited, kept next to the metrics-<pid>.json files
+EXITED_FILE = "metrics-exited.json"
+
+# name: (type, help, buckets)
+METRICS = {
+    "http_requests_total": ("counter", "Requests by endpoint, method and status code", None),
+    "http_request_duration_seconds": ("histogram", "Request latency by endpoint, method and status code", DEFAULT_BUCKETS),
+    "http_requests_in_progress": ("gauge", "Requests being handled right now", None),
+    "http_request_db_queries": ("histogram", "Database queries per request by endpoint", QUERY_BUCKETS),
+    "http_request_db_seconds": ("histogram", "Time spent in the database per request by endpoint", DEFAULT_BUCKETS),
+    "http_request_serialization_seconds": ("histogram", "Time spent encoding JSON per request by endpoint", DEFAULT_BUCKETS),
+    "http_requests_shed_total": ("counter", "Requests refused to protect the database by endpoint and reason", None),
+    "http_requests_db_active": ("gauge", "Requests allowed to use the database right now", None),
+    "http_requests_db_waiting": ("gauge", "Requests waiting for a turn to use the database", None),
+    "db_pool_checkouts_total": ("counter", "Connections checked out of the pool", None),
+    "db_pool_timeouts_total": ("counter", "Checkouts that timed out waiting for a connection", None),
+    "db_pool_invalidations_total": ("counter", "Connections thrown away because they failed", None),
+    "db_pool_wait_seconds_total": ("counter", "Time spent waiting to check out connections", None),
+    "db_pool_checked_out": ("gauge", "Connections checked out of the pool right now", None),
+    "db_pool_overflow": ("gauge", "Connections open beyond the size of the pool", None),
+    "cache_hits_total": ("counter", "Employee cache hits", None),
+    "cache_misses_total": ("counter", "Employee cache misses", None),
+    "cache_evictions_total": ("counter", "Employee cache evictions", None),
+}
+
+
+class Registry:
+    """The metric samples of this process, keyed on metric name and labels"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def inc(self, name: str, labels: dict = None, amount: float = 1.0) -> None:
+        """Adds amount to a counter or gauge"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.samples[key] = self.samples.get(key, 0.0) + amount
+
+    def set(self, name: str, labels: dict = None, value: float = 0.0) -> None:
+        """Sets a counter or gauge to value"""
+        with self._lock:
+            self.samples[(name, _label_key(labels))] = float(value)
+
+    def observe(self, name: str, labels: dict = None, value: float = 0.0) -> None:
+        """Records value in a histogram"""
+        buckets = METRICS[name][2]
+        key = (name, _label_key(labels))
+        with self._lock:
+            counts = self.samples.get(key)
+            if counts is None:
+                # one count per bucket, then +Inf, then the sum
+                counts = self.samples[key] = [0] * (len(buckets) + 2)
+            for position, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[position] += 1
+                    break
+            else:
+                counts[len(buckets)] += 1
+            counts[-1] += value
+
+    def dump(self) -> list:
+        """Returns the samples as a list that can be written as JSON"""
+        with self._lock:
+            return [
+                [name, dict(labels), list(value) if isinstance(value, list) else value]
+                for (name, labels), value in self.samples.items()
+            ]
+
+    def clear(self) -> None:
+        """Removes every sample"""
+        with self._lock:
+            self.samples.clear()
+
+
+def _label_key(labels: dict = None) -> tuple:
+    return tuple(sorted((labels or {}).items()))
+
+
+def merge(dumps: list) -> dict:
+    """
+    Adds up the samples of several processes
+    :param dumps: a list of (alive, samples) where samples came from Registry.dump()
+    """
+    merged = {}
+    for alive, samples in dumps:
+        for name, labels, value in samples:
+            if name not in METRICS or (METRICS[name][0] == "gauge" and not alive):
+                continue
+            key = (name, _label_key(labels))
+            if isinstance(value, list):
+                total = merged.setdefault(key, [0] * len(value))
+                merged[key] = [left + right for left, right in zip(total, value)]
+            else:
+                merged[key] = merged.get(key, 0.0) + value
+    return merged
+
+
+def render(samples: dict) -> str:
+    """Formats merged samples in the Prometheus text exposition format"""
+    lines = []
+    for name, (kind, description, buckets) in METRICS.items():
+        family = sorted((labels, value) for (sample_name, labels), value in samples.items() if sample_name == name)
+        if not family:
+            continue
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in family:
+            if kind == "histogram":
+                lines.extend(_render_histogram(name, labels, value, buckets))
+            else:
+                lines.append(f"{name}{_render_labels(labels)} {_render_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _render_histogram(name: str, labels: tuple, counts: list, buckets: tuple) -> list:
+    lines = []
+    cumulative = 0
+    for bound, count in zip(list(buckets) + ["+Inf"], counts):
+        cumulative += count
+        le = bound if bound == "+Inf" else _render_number(bound)
+        lines.append(f"{name}_bucket{_render_labels(labels + (('le', le),))} {cumulative}")
+    lines.append(f"{name}_sum{_render_labels(labels)} {_render_number(counts[-1])}")
+    lines.append(f"{name}_count{_render_labels(labels)} {cumulative}")
+    return lines
+
+
+def _render_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _render_number(value: float) -> str:
+    return repr(float(value))
+
+
+def _dump(samples: dict) -> list:
+    """Turns merged samples back into the list that Registry.dump() returns"""
+    return [[name, dict(labels), value] for (name, labels), value in samples.items()]
+
+
+def _read(path: str):
+    try:
+        with open(path, encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write(path: str, data: dict) -> None:
+    with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+        json.dump(data, file)
+    os.replace(f"{path}.tmp", path)
+
+
+@contextmanager
+def _locked(directory: str):
+    """Holds the lock of the multiprocess directory so that one process at a time folds or reads the files"""
+    with open(os.path.join(directory, "metrics.lock"), "a", encoding="utf-8") as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        yield
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # pragma: no cover
+        return True
+    return True
+
+
+class Metrics:
+    """Collects the metrics of a Flask app with request hooks and SQLAlchemy cursor events"""
+
+    def __init__(self):
+        self.registry = Registry()
+        self.directory = None
+        self.flush_interval = 1.0
+        self._last_flush = 0.0
+        self._collectors = []
+
+    def init_app(self, app, engine) -> None:
+        """Registers the request hooks on app and the cursor events on engine"""
+        self.directory = app.config.get("PROMETHEUS_MULTIPROC_DIR") or None
+        self.flush_interval = app.config.get("METRICS_FLUSH_INTERVAL", 1.0)
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        self.watch(engine)
+        self.add_collector(lambda registry: collect_pool(registry, engine.pool))
+        self.add_collector(collect_cache)
+
+    @staticmethod
+    def watch(engine) -> None:
+        """Counts the queries run on engine and the time they take"""
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+    def add_collector(self, collector) -> None:
+        """Adds a function that updates the registry just before it is reported"""
+        self._collectors.append(collector)
+
+    def observe_serialization(self, seconds: float) -> None:
+        """Adds the time taken to encode JSON to the current request"""
+        if has_request_context() and "metrics_start" in g:
+            g.serialization_seconds += seconds
+
+    def _before_request(self) -> None:
+        g.metrics_start = time.perf_counter()
+        g.db_queries = 0
+        g.db_seconds = 0.0
+        g.serialization_seconds = 0.0
+        self.registry.inc("http_requests_in_progress")
+
+    def _after_request(self, response):
+        if "metrics_start" not in g:
+            return response
+        endpoint = request.endpoint or "none"
+        labels = {"endpoint": endpoint, "method": request.method, "status": str(response.status_code)}
+        self.registry.inc("http_requests_total", labels)
+        self.registry.observe("http_request_duration_seconds", labels, time.perf_counter() - g.metrics_start)
+        self.registry.observe("http_request_db_queries", {"endpoint": endpoint}, g.db_queries)
+        self.registry.observe("http_request_db_seconds", {"endpoint": endpoint}, g.db_seconds)
+        self.registry.observe("http_request_serialization_seconds", {"endpoint": endpoint}, g.serialization_seconds)
+        if self.directory and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+        return response
+
+    def _teardown_request(self, error=None) -> None:  # pylint: disable=unused-argument
+        if g.pop("metrics_start", None) is not None:
+            self.registry.inc("http_requests_in_progress", amount=-1)
+
+    def collect(self) -> None:
+        """Runs the collectors so that gauges and external counters are up to date"""
+        for collector in self._collectors:
+            collector(self.registry)
+
+    def flush(self) -> None:
+        """Writes the samples of this process to the multiprocess directory"""
+        self.collect()
+        self._last_flush = time.monotonic()
+        _write(self._path(), {"pid": os.getpid(), "samples": self.registry.dump()})
+
+    def retire(self) -> None:
+        """Folds the final samples of this process into the exited file, called when a worker exits"""
+        if not self.directory:
+            return
+        self.collect()
+        with _locked(self.directory):
+            self._fold([(self._path(), self.registry.dump())])
+
+    def report(self) -> str:
+        """Returns the metrics of this process, or of every worker in multiprocess mode"""
+        if not self.directory:
+            self.collect()
+            return render(merge([(True, self.registry.dump())]))
+        self.flush()
+        with _locked(self.directory):
+            alive, dead = [], []
+            for path in glob.glob(os.path.join(self.directory, "metrics-[0-9]*.json")):
+                data = _read(path)
+                if data is not None:
+                    (alive if _pid_alive(data["pid"]) else dead).append((path, data["samples"]))
+            # workers killed before worker_exit could run are folded in here instead
+            if dead:
+                self._fold(dead)
+            exited = _read(os.path.join(self.directory, EXITED_FILE)) or {"samples": []}
+        return render(merge([(True, samples) for _, samples in alive] + [(False, exited["samples"])]))
+
+    def _path(self) -> str:
+        return os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+
+    def _fold(self, retired: list) -> None:
+        """Adds the counters of (path, samples) to the exited file and removes the paths, with the lock held"""
+        path = os.path.join(self.directory, EXITED_FILE)
+        exited = _read(path) or {"samples": []}
+        samples = merge([(False, exited["samples"])] + [(False, samples) for _, samples in retired])
+        _write(path, {"samples": _dump(samples)})
+        for retired_path, _ in retired:
+            try:
+                os.remove(retired_path)
+            except FileNotFoundError:
+                pass
+
+
+def collect_pool(registry: Registry, pool) -> None:
+    """Copies the connection pool counters into the registry"""
+    snapshot = pool_metrics.snapshot(pool)
+    registry.set("db_pool_checkouts_total", value=snapshot["checkouts"])
+    registry.set("db_pool_timeouts_total", value=snapshot["timeouts"])
+    registry.set("db_pool_invalidations_total", value=snapshot["invalidations"])
+    registry.set("db_pool_wait_seconds_total", value=snapshot["wait_seconds_total"])
+    registry.set("db_pool_checked_out", value=snapshot.get("checked_out", 0))
+    registry.set("db_pool_overflow", value=snapshot.get("overflow", 0))
+
+
+def collect_cache(registry: Registry) -> None:
+    """Copies the employee cache counters into the registry"""
+    stats = cache.stats()
+    registry.set("cache_hits_total", value=stats["hits"])
+    registry.set("cache_misses_total", value=stats["misses"])
+    registry.set("cache_evictions_total", value=stats["evictions"])
+
+
+def _before_cursor_execute(*_args):
+    if has_request_context() and "metrics_start" in g:
+        g.db_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(*_args):
+    if has_request_context() and "db_query_start" in g:
+        g.db_queries += 1
+        g.db_seconds += time.perf_counter() - g.pop("db_query_start")
+
+
+# The metrics of the service, configured in create_app()
+metrics = Metrics()
@@ -0,0 +1,108 @@
+"""
+Pool Metrics
+
+This module instruments the SQLAlchemy connection pool of each worker so
+that pools can be sized against the max_connections of the database
+"""
+import threading
+import time
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+class PoolMetrics:
+    """Counters of connection pool activity in this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Sets every counter back to zero"""
+        with self._lock:
+            self.checkouts = 0
+            self.checkins = 0
+            self.connects = 0
+            self.invalidations = 0
+            self.timeouts = 0
+            self.wait_seconds_total = 0.0
+            self.wait_seconds_max = 0.0
+
+    def observe_checkout(self, seconds: float) -> None:
+        """Records how long a caller waited to check out a connection"""
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def increment(self, name: str) -> None:
+        """Adds one to the counter called name"""
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self, pool=None) -> dict:
+        """Returns the counters, plus the current size and usage of pool if it is a QueuePool"""
+        with self._lock:
+            data = {
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+            }
+        if isinstance(pool, QueuePool):
+            data.update(
+                size=pool.size(),
+                checked_in=pool.checkedin(),
+                checked_out=pool.checkedout(),
+                overflow=pool.overflow(),
+            )
+        return data
+
+
+# The metrics of the pools used by this process
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long every checkout waited for a connection"""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            pool_metrics.increment("timeouts")
+            raise
+        finally:
+            pool_metrics.observe_checkout(time.perf_counter() - start)
+
+
+@event.listens_for(InstrumentedQueuePool, "connect")
+def on_connect(dbapi_connection, connection_record):  # pylint: disable=unused-argument
+    """Counts new connections opened to the database"""
+    pool_metrics.increment("connects")
+
+
+@event.listens_for(InstrumentedQueuePool, "checkin")
+def on_checkin(dbapi_connection, connection_record):  # pylint: disable=unused-argument
+    """Counts connections returned to the pool"""
+    pool_metrics.increment("checkins")
+
+
+@event.listens_for(InstrumentedQueuePool, "invalidate")
+def on_invalidate(dbapi_connection, connection_record, exception):  # pylint: disable=unused-argument
+    """Counts connections that were thrown away because they failed"""
+    pool_metrics.increment("invalidations")
+
+
+def init_pool_metrics(app) -> None:
+    """Makes the app use an InstrumentedQueuePool, must be called before db.init_app()"""
+    uri = app.config["SQLALCHEMY_DATABASE_URI"]
+    if uri.startswith("sqlite") and (uri == "sqlite://" or ":memory:" in uri):
+        # in-memory SQLite needs a single shared connection instead of a pool
+        return
+    options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+    options.setdefault("poolclass", InstrumentedQueuePool)
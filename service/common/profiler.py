@@ -0,0 +1,133 @@
+"""
+SQL Profiler
+
+This module times every SQL statement with SQLAlchemy cursor events. The
+statements slower than SLOW_QUERY_MS are logged with the route that ran them.
+When a request is profiled, because SQL_PROFILE is on or because it sent the
+X-SQL-Profile header and SQL_PROFILE_HEADER allows that, its statement count,
+database time and slowest statements are returned in a Server-Timing header
+"""
+import time
+import heapq
+import logging
+from flask import g, request, has_request_context
+from sqlalchemy import event
+
+logger = logging.getLogger("flask.app")
+
+PROFILE_HEADER = "X-SQL-Profile"
+
+# Characters of a statement shown in the Server-Timing header and the slow-query log
+STATEMENT_LENGTH = 100
+
+
+class QueryProfile:  # pylint: disable=too-few-public-methods
+    """The statements of one request: how many, how long, and the slowest ones"""
+
+    def __init__(self, top: int):
+        self.top = top
+        self.start = time.perf_counter()
+        self.count = 0
+        self.seconds = 0.0
+        self.slowest = []  # a min-heap of (seconds, order, statement)
+
+    def add(self, seconds: float, statement: str) -> None:
+        """Counts a statement and keeps it if it is one of the slowest"""
+        self.count += 1
+        self.seconds += seconds
+        entry = (seconds, self.count, statement)
+        if len(self.slowest) < self.top:
+            heapq.heappush(self.slowest, entry)
+        elif self.top:
+            heapq.heappushpop(self.slowest, entry)
+
+    def server_timing(self) -> str:
+        """Returns the profile as the value of a Server-Timing header, times in milliseconds"""
+        metrics = [
+            f"app;dur={(time.perf_counter() - self.start) * 1000:.3f}",
+            f'db;dur={self.seconds * 1000:.3f};desc="{self.count} queries"',
+        ]
+        for rank, (seconds, _, statement) in enumerate(sorted(self.slowest, reverse=True), start=1):
+            metrics.append(f'sql-{rank};dur={seconds * 1000:.3f};desc="{_quote(statement)}"')
+        return ", ".join(metrics)
+
+
+class QueryProfiler:
+    """Profiles the SQL of the requests of a Flask app and logs the slow statements"""
+
+    def __init__(self):
+        self.always = False
+        self.allow_header = False
+        self.top = 3
+        self.slow_seconds = 0.0
+
+    def init_app(self, app, engine) -> None:
+        """Registers the request hooks on app and the cursor events on engine"""
+        self.always = app.config.get("SQL_PROFILE", False)
+        self.allow_header = app.config.get("SQL_PROFILE_HEADER", False)
+        self.top = app.config.get("SQL_PROFILE_TOP", 3)
+        self.slow_seconds = app.config.get("SLOW_QUERY_MS", 0) / 1000
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        self.watch(engine)
+
+    def watch(self, engine) -> None:
+        """Times the statements run on engine"""
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_request(self) -> None:
+        if self.always or (self.allow_header and request.headers.get(PROFILE_HEADER)):
+            g.sql_profile = QueryProfile(self.top)
+
+    def _after_request(self, response):
+        profile = g.pop("sql_profile", None)
+        if profile is not None:
+            response.headers.add("Server-Timing", profile.server_timing())
+        return response
+
+    def _after_cursor_execute(self, _connection, _cursor, statement, _parameters, context, _executemany):
+        started = getattr(context, "profiler_start", None)
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+        if self.slow_seconds and seconds >= self.slow_seconds:
+            log_slow_query(statement, seconds)
+        if has_request_context() and "sql_profile" in g:
+            g.sql_profile.add(seconds, statement)
+
+
+def _before_cursor_execute(_connection, _cursor, _statement, _parameters, context, _executemany):
+    # kept on the context of the statement, which is dropped with it when the statement fails
+    if context is not None:
+        context.profiler_start = time.perf_counter()
+
+
+def log_slow_query(statement: str, seconds: float) -> None:
+    """Logs a statement that took longer than SLOW_QUERY_MS, with the route that ran it"""
+    route = None
+    if has_request_context():
+        route = request.url_rule.rule if request.url_rule else request.path
+    duration_ms = round(seconds * 1000, 3)
+    logger.warning(
+        "Slow query (%.1f ms) on %s: %s",
+        duration_ms,
+        route,
+        _shorten(statement),
+        extra={"route": route, "duration_ms": duration_ms, "statement": statement},
+    )
+
+
+def _shorten(statement: str) -> str:
+    """Returns the statement on one line and at most STATEMENT_LENGTH characters long"""
+    statement = " ".join(statement.split())
+    return statement if len(statement) <= STATEMENT_LENGTH else f"{statement[:STATEMENT_LENGTH - 3]}..."
+
+
+def _quote(statement: str) -> str:
+    """Returns the shortened statement escaped for a quoted header parameter"""
+    return _shorten(statement).replace("\\", "\\\\").replace('"', '\\"').encode("ascii", "replace").decode("ascii")
+
+
+# The SQL profiler of the service, configured in create_app()
+profiler = QueryProfiler()
@@ -0,0 +1,109 @@
+"""
+Read Replicas
+
+This module sends the reads of GET requests to read replicas. Each request
+reads from one replica, taken in turn, and writes always go to the primary.
+A replica whose connection fails is left out for REPLICA_EJECT_SECONDS and
+the read is run again on the primary. After a client writes, a cookie keeps
+its reads on the primary for REPLICA_STICKY_SECONDS so that it sees its own
+changes while the replicas catch up
+"""
+import time
+import logging
+import itertools
+import threading
+from contextlib import contextmanager
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+logger = logging.getLogger("flask.app")
+
+STICKY_COOKIE = "read_primary"
+READ_METHODS = frozenset(("GET", "HEAD"))
+
+
+class ReplicaRouter:
+    """Picks the read replica of every GET request, round-robin over the healthy ones"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.replicas = []
+        self.eject_seconds = 30.0
+        self.sticky_seconds = 5.0
+        self._ejected = {}
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+
+    def init_app(self, app, session, replicas: list) -> None:
+        """Routes the SELECTs of session to replicas, a list of engines, during the GET requests of app"""
+        self.replicas = list(replicas)
+        self.eject_seconds = app.config.get("REPLICA_EJECT_SECONDS", 30.0)
+        self.sticky_seconds = app.config.get("REPLICA_STICKY_SECONDS", 5.0)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        event.listen(session, "do_orm_execute", self._route)
+
+    def pick(self):
+        """Returns the next replica that is not ejected, or None to read from the primary"""
+        now = self.clock()
+        with self._lock:
+            for _ in self.replicas:
+                replica = self.replicas[next(self._turn) % len(self.replicas)]
+                if self._ejected.get(replica, 0.0) <= now:
+                    return replica
+        return None
+
+    def eject(self, replica, error) -> None:
+        """Leaves a failing replica out for eject_seconds"""
+        logger.warning("Ejecting read replica %s for %ss: %s", replica.url, self.eject_seconds, error)
+        with self._lock:
+            self._ejected[replica] = self.clock() + self.eject_seconds
+
+    def stats(self) -> dict:
+        """Returns the replicas and whether each one is healthy"""
+        now = self.clock()
+        return {
+            "replicas": [
+                {"url": replica.url.render_as_string(hide_password=True),
+                 "healthy": self._ejected.get(replica, 0.0) <= now}
+                for replica in self.replicas
+            ]
+        }
+
+    def _before_request(self) -> None:
+        reads = self.replicas and request.method in READ_METHODS and not request.cookies.get(STICKY_COOKIE)
+        g.db_replica = self.pick() if reads else None
+
+    def _after_request(self, response):
+        if self.replicas and request.method not in READ_METHODS and response.status_code < 400:
+            # the replicas may not have this write yet, so read from the primary for a while
+            response.set_cookie(STICKY_COOKIE, "1", max_age=int(self.sticky_seconds), httponly=True, samesite="Lax")
+        return response
+
+    def _route(self, state):
+        replica = g.get("db_replica") if has_request_context() else None
+        if replica is None or not state.is_select or state.bind_arguments.get("bind") is not None:
+            return None
+        try:
+            return state.invoke_statement(bind_arguments={"bind": replica})
+        except (OperationalError, InterfaceError) as error:
+            self.eject(replica, error)
+            g.pop("db_replica", None)
+            # returning nothing runs the statement as usual, on the primary
+            return None
+
+
+@contextmanager
+def primary(enabled: bool = True):
+    """Sends the reads of the block to the primary when enabled, for example to fill a shared cache"""
+    replica = g.pop("db_replica", None) if enabled and has_request_context() else None
+    try:
+        yield
+    finally:
+        if replica is not None:
+            g.db_replica = replica
+
+
+# The read replicas of the service, configured in create_app()
+replicas = ReplicaRouter()
@@ -0,0 +1,186 @@
+"""
+Employee Import and Export
+
+This module streams the employee table to and from NDJSON and CSV files in
+constant memory. Exports read the table from a server-side cursor in batches,
+imports write it with COPY on PostgreSQL and with batched INSERTs elsewhere
+"""
+import csv
+import json
+import time
+import click
+from flask import current_app
+from service.models import Employee, Gender, DataValidationError, db
+
+FORMATS = ("ndjson", "csv")
+COLUMNS = ("first_name", "last_name", "department", "gender")
+
+
+class Progress:
+    """Counts the rows moved and reports the rate every so many rows"""
+
+    def __init__(self, label: str, every: int = 100000, echo=None, clock=time.perf_counter):
+        self.label = label
+        self.every = every
+        self.echo = echo or (lambda message: click.echo(message, err=True))
+        self.clock = clock
+        self.rows = 0
+        self.start = clock()
+        self._next_report = every
+
+    def add(self, count: int) -> None:
+        """Adds count rows and reports the progress when another every rows are done"""
+        self.rows += count
+        if self.every and self.rows >= self._next_report:
+            self.echo(f"{self.label} {self.rows} rows ({self.rate():.0f} rows/sec)")
+            self._next_report = (self.rows // self.every + 1) * self.every
+
+    def rate(self) -> float:
+        """Returns the rows per second so far"""
+        elapsed = self.clock() - self.start
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def finish(self) -> dict:
+        """Reports and returns the totals"""
+        seconds = self.clock() - self.start
+        self.echo(f"{self.label} {self.rows} rows in {seconds:.2f} seconds ({self.rate():.0f} rows/sec)")
+        return {"rows": self.rows, "seconds": seconds, "rows_per_second": self.rate()}
+
+
+def format_of(file, file_format: str = None) -> str:
+    """Returns file_format, or guesses it from the name of the file"""
+    if file_format:
+        return file_format
+    return "csv" if str(getattr(file, "name", "")).lower().endswith(".csv") else "ndjson"
+
+
+######################################################################
+# Export
+######################################################################
+def export_employees(file, file_format: str, batch_size: int, progress: Progress) -> dict:
+    """Writes every Employee to file, reading batch_size rows at a time"""
+    if file_format == "csv":
+        writer = csv.DictWriter(file, fieldnames=Employee.FIELDS, lineterminator="\n")
+        writer.writeheader()
+        write = writer.writerows
+    else:
+        dumps = current_app.json.dumps
+
+        def write(batch):
+            file.write("".join(f"{dumps(row)}\n" for row in batch))
+
+    for batch in Employee.stream(batch_size):
+        write(batch)
+        progress.add(len(batch))
+    file.flush()
+    return progress.finish()
+
+
+######################################################################
+# Import
+######################################################################
+def read_rows(file, file_format: str):
+    """Yields the line number and dictionary of every record in file"""
+    if file_format == "csv":
+        reader = csv.DictReader(file)
+        for data in reader:
+            yield reader.line_num, data
+        return
+    for line_number, line in enumerate(file, start=1):
+        if line.strip():
+            try:
+                yield line_number, json.loads(line)
+            except ValueError as error:
+                raise DataValidationError(f"Line {line_number}: invalid JSON: {error}") from error
+
+
+def to_row(line_number: int, data: dict, keep_ids: bool) -> dict:
+    """Validates a record and returns the column values to insert"""
+    try:
+        row = {name: str(data[name]) for name in COLUMNS[:-1]}
+        row["gender"] = Gender[str(data["gender"]).upper()]
+        if keep_ids:
+            row["id"] = int(data["id"])
+    except KeyError as error:
+        raise DataValidationError(f"Line {line_number}: missing or invalid {error.args[0]}") from error
+    except (TypeError, ValueError, AttributeError) as error:
+        raise DataValidationError(f"Line {line_number}: invalid employee: {error}") from error
+    if not all(row[name] for name in COLUMNS[:-1]):
+        raise DataValidationError(f"Line {line_number}: first_name, last_name and department are required")
+    return row
+
+
+def import_employees(file, file_format: str, batch_size: int, progress: Progress, keep_ids: bool = False) -> dict:
+    """Loads every record of file into the employee table"""
+    rows = (to_row(line_number, data, keep_ids) for line_number, data in read_rows(file, file_format))
+    write_rows(rows, batch_size, progress, keep_ids)
+    return progress.finish()
+
+
+def write_rows(rows, batch_size: int, progress: Progress, keep_ids: bool = False) -> None:
+    """Writes to_row() style rows into the employee table, with COPY when the database supports it"""
+    if db.engine.dialect.name == "postgresql" and db.engine.driver == "psycopg":
+        connection = db.engine.raw_connection()
+        try:
+            copy_rows(connection, rows, keep_ids, batch_size, progress)
+            connection.commit()
+        except Exception as error:
+            connection.rollback()
+            progress.rows = 0  # COPY is a single transaction, so nothing was imported
+            if isinstance(error, DataValidationError):
+                raise
+            raise DataValidationError(error) from error
+        finally:
+            connection.close()
+    else:
+        insert_rows(rows, batch_size, progress)
+    Employee.invalidate([])
+    if keep_ids and db.engine.dialect.name == "postgresql":
+        # ids were given explicitly, so move the sequence past them
+        db.session.execute(
+            db.text("SELECT setval(pg_get_serial_sequence('employee', 'id'), (SELECT MAX(id) FROM employee))")
+        )
+        db.session.commit()
+
+
+def copy_rows(connection, rows, keep_ids: bool, batch_size: int, progress: Progress) -> None:
+    """Streams rows into the employee table with COPY FROM STDIN on a psycopg connection"""
+    columns = COLUMNS + ("created_at", "last_updated") + (("id",) if keep_ids else ())
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT LOCALTIMESTAMP")
+        now = cursor.fetchone()[0]
+        with cursor.copy(f"COPY employee ({', '.join(columns)}) FROM STDIN") as copy:
+            pending = 0
+            for row in rows:
+                values = (row["first_name"], row["last_name"], row["department"], row["gender"].name, now, now)
+                copy.write_row(values + ((row["id"],) if keep_ids else ()))
+                pending += 1
+                if pending == batch_size:
+                    progress.add(pending)
+                    pending = 0
+            progress.add(pending)
+
+
+def insert_rows(rows, batch_size: int, progress: Progress) -> None:
+    """Inserts rows into the employee table batch_size at a time, committing every batch"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            _insert_batch(batch)
+            progress.add(len(batch))
+            batch = []
+    if batch:
+        _insert_batch(batch)
+        progress.add(len(batch))
+
+
+def _insert_batch(batch: list) -> None:
+    try:
+        # a Core executemany skips the ORM bulk persistence bookkeeping
+        db.session.execute(Employee.__table__.insert(), batch)
+        db.session.commit()
+    except Exception as error:
+        db.session.rollback()
+        # the error of the driver, without the thousand rows of parameters
+        raise DataValidationError(getattr(error, "orig", None) or error) from error
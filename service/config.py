@@ -13,8 +13,116 @@ DATABASE_URI = os.getenv(
 # Configure SQLAlchemy
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
-# SQLALCHEMY_POOL_SIZE = 2
+
+# Create the tables when the app starts instead of with "flask db-init" (development only)
+DB_CREATE_ON_STARTUP = os.getenv("DB_CREATE_ON_STARTUP", "false").lower() == "true"
+
+# Configure the connection pool of each worker
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# Read replicas: the reads of GET requests go to DATABASE_REPLICA_URIS (comma
+# separated) in turn, a replica that fails is left out for REPLICA_EJECT_SECONDS,
+# and a client reads from the primary for REPLICA_STICKY_SECONDS after it writes
+DATABASE_REPLICA_URIS = [uri.strip() for uri in os.getenv("DATABASE_REPLICA_URIS", "").split(",") if uri.strip()]
+SQLALCHEMY_BINDS = {f"replica-{number}": uri for number, uri in enumerate(DATABASE_REPLICA_URIS)}
+REPLICA_EJECT_SECONDS = float(os.getenv("REPLICA_EJECT_SECONDS", "30"))
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+
+# Statement timeout in milliseconds, PostgreSQL only (0 means no timeout)
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", "0"))
+
+SQLALCHEMY_ENGINE_OPTIONS = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+}
+if DB_STATEMENT_TIMEOUT and DATABASE_URI.startswith("postgresql"):
+    SQLALCHEMY_ENGINE_OPTIONS["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT}"}
+
+# Pagination and streaming of the employee list
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "100"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "1000"))
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+
+# Search results can be paged up to this many matches
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "1000"))
+
+# The change feed leaves out changes younger than this, so that a transaction
+# stamped before the watermark but committed after it is not skipped
+CHANGES_SETTLE_SECONDS = float(os.getenv("CHANGES_SETTLE_SECONDS", "5"))
+
+# Largest request bodies in bytes: MAX_CONTENT_LENGTH for every request and the
+# bulk endpoints, EMPLOYEE_MAX_CONTENT_LENGTH for a single employee. Longer
+# bodies are rejected with 413 before they are read
+MAX_CONTENT_LENGTH = int(os.getenv("MAX_CONTENT_LENGTH", str(8 * 1024 * 1024)))
+EMPLOYEE_MAX_CONTENT_LENGTH = int(os.getenv("EMPLOYEE_MAX_CONTENT_LENGTH", "16384"))
+
+# JSON and text responses of at least COMPRESS_MIN_SIZE bytes are compressed
+# with brotli (when it is installed) or gzip, as the client accepts. Turn
+# COMPRESS_RESPONSES off when a proxy in front of the service compresses
+COMPRESS_RESPONSES = os.getenv("COMPRESS_RESPONSES", "true").lower() == "true"
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+
+# Load shedding. Every client may call a route RATE_LIMIT_PER_SECOND times a
+# second (0 turns it off) in bursts of up to RATE_LIMIT_BURST, and gets 429
+# beyond that. Clients are told apart by RATE_LIMIT_CLIENT_HEADER when it is set,
+# or by their address. At most CONCURRENCY_LIMIT requests of a worker (by default
+# one per pooled connection, 0 turns it off) use the database at once; up to
+# CONCURRENCY_QUEUE more wait CONCURRENCY_QUEUE_TIMEOUT seconds and the others get 503
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", "0"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", str(max(RATE_LIMIT_PER_SECOND * 2, 1))))
+RATE_LIMIT_CLIENT_HEADER = os.getenv("RATE_LIMIT_CLIENT_HEADER", "")
+CONCURRENCY_LIMIT = int(os.getenv("CONCURRENCY_LIMIT", str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+CONCURRENCY_QUEUE = int(os.getenv("CONCURRENCY_QUEUE", str(CONCURRENCY_LIMIT)))
+CONCURRENCY_QUEUE_TIMEOUT = float(os.getenv("CONCURRENCY_QUEUE_TIMEOUT", "1"))
+
+# A POST /employees sent with an Idempotency-Key header gets the same response
+# when it is retried within IDEMPOTENCY_TTL_HOURS. A retry that comes while the
+# first request is still running gets 409, unless that request started more
+# than IDEMPOTENCY_LOCK_SECONDS ago and is taken for dead
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+IDEMPOTENCY_LOCK_SECONDS = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "60"))
+
+# Number of rows written per statement by the bulk endpoints
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+
+# Read-through cache of serialized employees (CACHE_SIZE=0 disables it)
+CACHE_SIZE = int(os.getenv("CACHE_SIZE", "1024"))
+CACHE_TTL = int(os.getenv("CACHE_TTL", "60"))
+
+# JSON encoder of the responses: "orjson" when it is installed, or "json"
+JSON_ENCODER = os.getenv("JSON_ENCODER", "orjson")
+
+# Metrics: point PROMETHEUS_MULTIPROC_DIR at a directory shared by the gunicorn
+# workers so /metrics reports all of them, written at most every interval seconds.
+# Workers that exit leave their counters in one metrics-exited.json file
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "1.0"))
+
+# SQL profiling: statements slower than SLOW_QUERY_MS are logged with their route
+# (0 turns this off). SQL_PROFILE adds the statement count, database time and the
+# SQL_PROFILE_TOP slowest statements of every request to a Server-Timing header,
+# SQL_PROFILE_HEADER only of the requests sent with "X-SQL-Profile: 1". The
+# header shows SQL text, so leave both off in production
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+SQL_PROFILE = os.getenv("SQL_PROFILE", "false").lower() == "true"
+SQL_PROFILE_HEADER = os.getenv("SQL_PROFILE_HEADER", "false").lower() == "true"
+SQL_PROFILE_TOP = int(os.getenv("SQL_PROFILE_TOP", "3"))
 
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "sup3r-s3cr3t")
-LOGGING_LEVEL = logging.INFO
+
+# Logging: LOG_FORMAT is "json" or "text", records are written by a background
+# thread when LOG_QUEUE is true, and LOG_SAMPLE_RATE of the successful requests
+# get a summary line (errors always do). Request payloads are only logged at DEBUG
+LOGGING_LEVEL = getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE = os.getenv("LOG_QUEUE", "true").lower() == "true"
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
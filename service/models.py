@@ -4,10 +4,19 @@ Models for Employee Demo Service
 All of the models are stored in this module
 """
 import os
+import re
+import json
+import base64
 import logging
+from datetime import datetime, timedelta
+from itertools import repeat
 from enum import Enum
 from retry import retry
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
 from flask_sqlalchemy import SQLAlchemy
+from service.common.cache import cache
+from service.common.replicas import primary
 
 # global variables for retry (must be int)
 RETRY_COUNT = int(os.environ.get("RETRY_COUNT", 5))
@@ -26,6 +35,41 @@ def init_db() -> None:
     db.create_all()
 
 
+def upgrade_db() -> list:
+    """
+    Adds the missing tables, columns and indexes to an existing database and drops the obsolete indexes
+
+    create_all() skips the tables that exist, so it never adds the columns and
+    indexes that were declared after they were created. Added columns need a
+    server default to fill the existing rows. Every statement can be run again. On
+    PostgreSQL the indexes are built CONCURRENTLY, without blocking writes
+    :return: the statements that were run
+    """
+    db.create_all()
+    inspector = db.inspect(db.engine)
+    statements = []
+    for table in db.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        statements += [
+            f"ALTER TABLE {table.name} ADD COLUMN {db.schema.CreateColumn(column).compile(dialect=db.engine.dialect)}"
+            for column in table.columns
+            if column.name not in existing
+        ]
+    statements += [
+        str(db.schema.CreateIndex(index, if_not_exists=True).compile(dialect=db.engine.dialect))
+        for table in db.metadata.sorted_tables
+        for index in sorted(table.indexes, key=lambda index: index.name)
+    ]
+    statements += [f"DROP INDEX IF EXISTS {name}" for name in OBSOLETE_INDEXES]
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        if connection.dialect.name == "postgresql":
+            statements = [re.sub(r"^(CREATE (UNIQUE )?INDEX|DROP INDEX)", r"\1 CONCURRENTLY", ddl) for ddl in statements]
+        for statement in statements:
+            logger.info("Running %s", statement)
+            connection.exec_driver_sql(statement)
+    return statements
+
+
 class DataValidationError(Exception):
     """Used for data validation errors when deserializing"""
 
@@ -38,20 +82,34 @@ class Gender(Enum):
     UNKNOWN = 3
 
 
-class Employee(db.Model):
+class Employee(db.Model):  # pylint: disable=too-many-public-methods
     """
     Class that represents an Employee
     """
 
+    # Fields that can be selected and sorted on by the list endpoint
+    FIELDS = ("id", "first_name", "last_name", "department", "gender")
+
+    # Key of the cached counts of stats()
+    STATS_KEY = "employee:stats"
+
+    __table_args__ = (
+        db.Index("ix_employee_last_name_first_name", "last_name", "first_name"),
+        # covers the GROUP BY of stats() so it can be read from the index alone
+        db.Index("ix_employee_department_gender", "department", "gender"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     first_name = db.Column(db.String(255), nullable=False)
     last_name = db.Column(db.String(255), nullable=False)
     department = db.Column(db.String(255), nullable=False)
     gender = db.Column(
-        db.Enum(Gender), nullable=False, server_default=(Gender.UNKNOWN.name)
+        db.Enum(Gender), nullable=False, server_default=(Gender.UNKNOWN.name), index=True
     )
     created_at = db.Column(db.DateTime, default=db.func.now(), nullable=False)
-    last_updated = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now(), nullable=False)
+    last_updated = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now(), nullable=False, index=True)
+    # incremented by every write, the ETag and If-Match are derived from it
+    version = db.Column(db.Integer, default=1, server_default="1", nullable=False)
 
     def __repr__(self):
         """Employee representation"""
@@ -61,8 +119,9 @@ class Employee(db.Model):
         """
         Saves an Employee to the database
         """
-        logger.info("Creating %s %s", self.first_name, self.last_name)
+        logger.debug("Creating %s %s", self.first_name, self.last_name)
         self.id = None
+        self.version = 1
         try:
             db.session.add(self)
             db.session.commit()
@@ -70,47 +129,528 @@ class Employee(db.Model):
             db.session.rollback()
             logger.error("Error creating record: %s", self)
             raise DataValidationError(e) from e
+        self.invalidate([self.id])
 
     def update(self) -> None:
         """
         Updates an Employee to the database
         """
-        logger.info("Saving %s %s", self.first_name, self.last_name)
+        logger.debug("Saving %s %s", self.first_name, self.last_name)
         if not self.id:
             raise DataValidationError("Update called with empty ID field")
 
+        self.version = Employee.version + 1
         try:
             db.session.commit()
         except Exception as e:
             db.session.rollback()
             logger.error("Error updating record: %s", self)
             raise DataValidationError(e) from e
+        self.invalidate([self.id])
 
     def delete(self) -> None:
         """
         Removes an Employee from the database
         """
-        logger.info("Deleting %s %s", self.first_name, self.last_name)
+        logger.debug("Deleting %s %s", self.first_name, self.last_name)
+        employee_id = self.id
         try:
             db.session.delete(self)
+            db.session.add(EmployeeTombstone(employee_id=employee_id))
             db.session.commit()
         except Exception as e:
             db.session.rollback()
             logger.error("Error deleting record: %s", self)
             raise DataValidationError(e) from e
+        self.invalidate([employee_id])
+
+    @classmethod
+    def create_serialized(cls, employee, then=None) -> tuple:
+        """
+        Saves an Employee with a single INSERT ... RETURNING
+        :param then: a function of the serialized Employee and its ETag that
+            returns a statement to commit in the same transaction
+        :return: a tuple of the serialized Employee and its ETag
+        """
+        logger.debug("Creating %s %s", employee.first_name, employee.last_name)
+        statement = db.insert(cls).values(employee.to_row()).returning(*cls._returned_columns())
+        when_found = [lambda row: then(*cls._serialized(row))] if then else ()
+        row = cls._write_returning(statement, f"creating record: {employee}", when_found)
+        employee.id = row["id"]
+        cls.invalidate([employee.id])
+        return cls._serialized(row)
+
+    @classmethod
+    def update_serialized(cls, employee_id: int, employee, versions: list = None):
+        """
+        Updates an Employee with a single UPDATE ... RETURNING
+        :param versions: only update the Employee if it is at one of these versions
+        :return: a tuple of the serialized Employee and its ETag, or None if not found
+        """
+        logger.debug("Saving %s %s", employee.first_name, employee.last_name)
+        statement = (
+            db.update(cls)
+            .where(cls.id == employee_id, *cls._version_clauses(versions))
+            .values(dict(employee.to_row(), version=cls.version + 1))
+            .returning(*cls._returned_columns())
+        )
+        row = cls._write_returning(statement, f"updating record: {employee_id}")
+        if row is None:
+            return None
+        cls.invalidate([employee_id])
+        return cls._serialized(row)
+
+    @classmethod
+    def delete_by_id(cls, employee_id: int, versions: list = None) -> bool:
+        """
+        Removes an Employee and records its tombstone, returning whether it was found
+
+        PostgreSQL does both in one statement with a data-modifying CTE, other
+        databases insert the tombstone only if the DELETE ... RETURNING found a row
+        :param versions: only remove the Employee if it is at one of these versions
+        """
+        logger.debug("Deleting the Employee with id %s", employee_id)
+        statement = cls.__table__.delete().where(cls.id == employee_id, *cls._version_clauses(versions)).returning(cls.id)
+        tombstone = [db.insert(EmployeeTombstone).values(employee_id=employee_id)]
+        if db.engine.dialect.name == "postgresql":
+            deleted = statement.cte("deleted")
+            statement = (
+                EmployeeTombstone.__table__.insert()
+                .from_select(["employee_id"], db.select(deleted.c.id))
+                .returning(EmployeeTombstone.employee_id)
+            )
+            tombstone = []
+        row = cls._write_returning(statement, f"deleting record: {employee_id}", tombstone)
+        if row is None:
+            return False
+        cls.invalidate([employee_id])
+        return True
+
+    @classmethod
+    def _version_clauses(cls, versions: list = None) -> list:
+        """Returns the WHERE clauses of a write that must find the Employee at one of versions, if they are given"""
+        # checked by the write itself, so no other write can come between the check and this one
+        return [] if versions is None else [cls.version.in_(versions)]
+
+    @classmethod
+    def _returned_columns(cls) -> list:
+        """Returns the columns that the single statement writes return, enough for serialize() and the ETag"""
+        return [cls._select_column(name) for name in cls.FIELDS] + [cls.version]
+
+    @classmethod
+    def _serialized(cls, row) -> tuple:
+        """Returns the serialized Employee and its ETag from a returned row"""
+        data = {name: row[name] for name in cls.FIELDS}
+        return data, make_etag(row["id"], row["version"])
+
+    @staticmethod
+    def _write_returning(statement, action: str, when_found: list = ()):
+        """
+        Executes a write and commits it
+        :param when_found: statements, or functions of the returned row that build
+            them, to run in the same transaction if a row was returned
+        :return: the first returned row, or None
+        """
+        try:
+            row = db.session.execute(statement).mappings().first()
+            for other in when_found if row is not None else ():
+                db.session.execute(other(row) if callable(other) else other)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error %s", action)
+            raise DataValidationError(e) from e
+        return row
+
+    @classmethod
+    def bulk_create(cls, employees: list, chunk_size: int = 1000) -> list:
+        """
+        Saves many Employees to the database in a single transaction
+        :param employees: the Employees to insert, chunk_size rows per statement
+        :return: the new ids in the same order as employees
+        """
+        logger.debug("Bulk creating %d Employees", len(employees))
+        statement = db.insert(cls).returning(cls.id, sort_by_parameter_order=True)
+        ids = []
+        try:
+            for chunk in _chunks([employee.to_row() for employee in employees], chunk_size):
+                ids.extend(db.session.scalars(statement, chunk))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error bulk creating %d records", len(employees))
+            raise DataValidationError(e) from e
+        for employee, employee_id in zip(employees, ids):
+            employee.id = employee_id
+        cls.invalidate(ids)
+        return ids
+
+    @classmethod
+    def bulk_update(cls, employees: list, chunk_size: int = 1000) -> set:
+        """
+        Updates many Employees in the database in a single transaction
+        :param employees: the Employees to update, each with its id set
+        :return: the ids that were found and updated
+        """
+        logger.debug("Bulk updating %d Employees", len(employees))
+        table = cls.__table__
+        statement = table.update().where(table.c.id == db.bindparam("employee_id")).values(version=table.c.version + 1)
+        updated = set()
+        try:
+            for chunk in _chunks(employees, chunk_size):
+                ids = [employee.id for employee in chunk]
+                found = set(db.session.scalars(db.select(cls.id).where(cls.id.in_(ids))))
+                rows = [dict(employee.to_row(), employee_id=employee.id) for employee in chunk if employee.id in found]
+                if rows:
+                    db.session.execute(statement, rows)
+                updated |= found
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error bulk updating %d records", len(employees))
+            raise DataValidationError(e) from e
+        cls.invalidate(updated)
+        return updated
+
+    @classmethod
+    def bulk_delete(cls, employee_ids: list, chunk_size: int = 1000) -> set:
+        """
+        Removes many Employees from the database in a single transaction
+        :param employee_ids: the ids of the Employees to delete
+        :return: the ids that were found and deleted
+        """
+        logger.debug("Bulk deleting %d Employees", len(employee_ids))
+        deleted = set()
+        try:
+            for chunk in _chunks(employee_ids, chunk_size):
+                statement = db.delete(cls).where(cls.id.in_(chunk)).returning(cls.id)
+                ids = list(db.session.scalars(statement))
+                if ids:
+                    db.session.execute(db.insert(EmployeeTombstone), [{"employee_id": i} for i in ids])
+                deleted.update(ids)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error bulk deleting %d records", len(employee_ids))
+            raise DataValidationError(e) from e
+        cls.invalidate(deleted)
+        return deleted
 
     @classmethod
     def all(cls) -> list:
         """Returns all Employees in the database"""
-        logger.info("Processing all Employees")
+        logger.debug("Processing all Employees")
         return cls.query.all()
 
+    @classmethod
+    def find_page(cls, limit: int, cursor: str = None, fields=None, sort=None, filters: dict = None) -> list:
+        """
+        Returns up to limit Employees as dictionaries without loading them as objects
+        :param cursor: only return Employees that sort after the row page_cursor() was given
+        :param fields: the fields to select, always including the id and the sort fields
+        :param sort: the fields to sort on, prefixed with "-" for descending order
+        :param filters: department, gender and last_name prefix to match
+        """
+        logger.debug("Processing page of %d Employees after cursor %s", limit, cursor)
+        statement = cls.select_rows(fields, sort, filters, cursor).limit(limit)
+        result = db.session.execute(statement)
+        return serialize_rows(tuple(result.keys()), result)
+
+    @classmethod
+    def stream(cls, batch_size: int = 1000, fields=None, sort=None, filters: dict = None):
+        """
+        Returns a generator of every matching Employee in lists of up to batch_size dictionaries,
+        read from a server-side cursor
+
+        The query is built before the generator is returned, so an invalid field, sort or
+        filter raises DataValidationError here rather than halfway through a response
+        """
+        logger.debug("Streaming all Employees in batches of %d", batch_size)
+        statement = cls.select_rows(fields, sort, filters).execution_options(yield_per=batch_size)
+
+        def batches():
+            result = db.session.execute(statement)
+            keys = tuple(result.keys())
+            for partition in result.partitions():
+                yield serialize_rows(keys, partition)
+
+        return batches()
+
+    @classmethod
+    def select_rows(cls, fields=None, sort=None, filters: dict = None, cursor: str = None):
+        """
+        Builds a SELECT of the requested columns, filtered and sorted in the database
+
+        The sort always ends with the id, and the sort columns are always selected,
+        so that the last row of a page gives the keyset cursor of the next one
+        """
+        order = cls._order(sort)
+        names = ["id"] + [name for name in fields or cls.FIELDS if name != "id"]
+        names += [column.key for column, _ in order if column.key not in names]
+        columns = [cls._select_column(name) for name in names]
+
+        statement = db.select(*columns).where(*cls._filter_clauses(filters or {}))
+        if cursor is not None:
+            statement = statement.where(cls._after_clause(order, cls._cursor_values(order, cursor)))
+        return statement.order_by(*(column.desc() if descending else column for column, descending in order))
+
+    @classmethod
+    def page_cursor(cls, row: dict, sort=None) -> str:
+        """Returns the cursor of the page after row, holding its sort values rather than looking them up again"""
+        return page_cursor([row[column.key] for column, _ in cls._order(sort)])
+
+    @classmethod
+    def _order(cls, sort=None) -> list:
+        """Returns the (column, descending) pairs to sort on, always ending with the id"""
+        order = [(cls._column(name.lstrip("-")), name.startswith("-")) for name in sort or []]
+        if not any(column is cls.id for column, _ in order):
+            order.append((cls.id, False))
+        return order
+
+    @classmethod
+    def _cursor_values(cls, order: list, cursor: str) -> list:
+        """Returns the sort values held by a cursor, raising DataValidationError if they do not fit the order"""
+        values = parse_cursor(cursor)
+        if values is None or len(values) != len(order):
+            raise DataValidationError("Invalid cursor")
+        for position, ((column, _), value) in enumerate(zip(order, values)):
+            if column is cls.id:
+                valid = isinstance(value, int) and not isinstance(value, bool)
+            elif column is cls.gender:
+                valid = value in Gender.__members__
+                value = Gender[value] if valid else value
+            else:
+                valid = isinstance(value, str)
+            if not valid:
+                raise DataValidationError("Invalid cursor")
+            values[position] = value
+        return values
+
+    @classmethod
+    def _column(cls, name: str):
+        """Returns the column for a field that may be selected or sorted on"""
+        if name not in cls.FIELDS:
+            raise DataValidationError(f"Invalid field: {name}")
+        return getattr(cls, name)
+
+    @classmethod
+    def _select_column(cls, name: str):
+        """Returns the column to select for a field, reading the gender as its name rather than a Gender"""
+        column = cls._column(name)
+        if column is cls.gender:
+            # the database stores the enum name, so skip converting it to a Gender and back
+            return db.type_coerce(cls.gender, db.String).label("gender")
+        return column
+
+    @classmethod
+    def _filter_clauses(cls, filters: dict) -> list:
+        """Returns the WHERE clauses for the department, gender and last_name prefix filters"""
+        clauses = []
+        if filters.get("department"):
+            clauses.append(cls.department == filters["department"])
+        if filters.get("gender"):
+            try:
+                clauses.append(cls.gender == Gender[filters["gender"].upper()])
+            except KeyError as error:
+                raise DataValidationError(f"Invalid gender: {filters['gender']}") from error
+        if filters.get("last_name"):
+            clauses.append(cls.last_name.startswith(filters["last_name"], autoescape=True))
+        return clauses
+
+    @classmethod
+    def _after_clause(cls, order: list, values: list):
+        """Returns the keyset clause that selects the rows sorted after the given sort values"""
+        clauses = []
+        for position, ((column, descending), value) in enumerate(zip(order, values)):
+            ties = [previous == previous_value for (previous, _), previous_value in zip(order[:position], values)]
+            after = column < value if descending else column > value
+            clauses.append(db.and_(*ties, after))
+        return db.or_(*clauses)
+
     @classmethod
     def find(cls, employee_id: int):
         """Finds en Employee by its ID"""
-        logger.info("Processing lookup for id %s ...", employee_id)
+        logger.debug("Processing lookup for id %s ...", employee_id)
         return cls.query.session.get(cls, employee_id)
 
+    @classmethod
+    def exists(cls, employee_id: int) -> bool:
+        """Returns True if there is an Employee with the given id, reading the database rather than the cache"""
+        return db.session.scalar(db.select(cls.id).where(cls.id == employee_id)) is not None
+
+    @classmethod
+    def find_serialized(cls, employee_id: int, before_read=None):
+        """
+        Finds an Employee by its ID, reading through the cache and calling before_read first on a miss
+        :return: a tuple of the serialized Employee and its ETag, or None if not found
+        """
+        key = cls.cache_key(employee_id)
+        entry = cache.get(key)
+        if entry is None:
+            if before_read:
+                before_read()
+            # what a lagging replica returns must not be cached for everyone
+            with primary(cache.enabled):
+                employee = cls.find(employee_id)
+            if not employee:
+                return None
+            entry = {"data": employee.serialize(), "etag": employee.etag}
+            cache.set(key, entry)
+        return entry["data"], entry["etag"]
+
+    @classmethod
+    def collection_version(cls) -> str:
+        """Returns a version of the whole table that changes whenever any Employee is created, updated or deleted"""
+        return str(TableVersion.current(cls.__tablename__))
+
+    @classmethod
+    def changes(cls, since: tuple = None, until: datetime = None, limit: int = 100) -> list:
+        """
+        Returns the Employees created, updated or deleted after a watermark, oldest first
+        :param since: the (changed_at, deleted, id) of the last change already seen
+        :param until: leave out the changes made after this time
+        :return: dictionaries with the id, changed_at and deleted flag of every change,
+            plus the fields of the Employee unless it was deleted
+        """
+        logger.debug("Processing changes since %s", since)
+        changed_at, deleted, employee_id = since or (datetime(1970, 1, 1), -1, 0)
+        start = _timestamp(changed_at)
+        updated = db.select(
+            cls.id.label("id"),
+            cls.last_updated.label("changed_at"),
+            db.literal(0).label("deleted"),
+            *(cls._select_column(name) for name in cls.FIELDS if name != "id"),
+        ).where(cls.last_updated >= start)
+        removed = db.select(
+            EmployeeTombstone.employee_id, EmployeeTombstone.deleted_at, db.literal(1), *([db.null()] * (len(cls.FIELDS) - 1))
+        ).where(EmployeeTombstone.deleted_at >= start)
+        if until is not None:
+            updated = updated.where(cls.last_updated <= _timestamp(until))
+            removed = removed.where(EmployeeTombstone.deleted_at <= _timestamp(until))
+        union = db.union_all(updated, removed).subquery()
+        order = (union.c.changed_at, union.c.deleted, union.c.id)
+        statement = (
+            db.select(union)
+            .where(db.tuple_(*order) > db.tuple_(start, db.literal(deleted), db.literal(employee_id)))
+            .order_by(*order)
+            .limit(limit)
+        )
+        return [cls._change(row) for row in db.session.execute(statement).mappings()]
+
+    @classmethod
+    def _change(cls, row) -> dict:
+        """Returns a row of the change feed as a dictionary, without the empty fields of deletions"""
+        change = {"id": row["id"], "changed_at": row["changed_at"], "deleted": bool(row["deleted"])}
+        if not change["deleted"]:
+            change.update((name, row[name]) for name in cls.FIELDS if name != "id")
+        return change
+
+    @classmethod
+    def stats(cls, before_read=None) -> dict:
+        """
+        Counts the Employees by department, by gender and by both, reading through the cache
+        and calling before_read first on a miss
+        :return: the total and the three groupings, as dictionaries of counts
+        """
+        entry = cache.get(cls.STATS_KEY)
+        if entry is None:
+            if before_read:
+                before_read()
+            logger.debug("Processing employee statistics")
+            gender = db.type_coerce(cls.gender, db.String)
+            statement = db.select(cls.department, gender, db.func.count()).group_by(cls.department, gender)
+            entry = {"total": 0, "by_department": {}, "by_gender": {}, "by_department_gender": {}}
+            with primary(cache.enabled):
+                rows = db.session.execute(statement).all()
+            for department, gender_name, count in rows:
+                entry["total"] += count
+                entry["by_department"][department] = entry["by_department"].get(department, 0) + count
+                entry["by_gender"][gender_name] = entry["by_gender"].get(gender_name, 0) + count
+                entry["by_department_gender"].setdefault(department, {})[gender_name] = count
+            cache.set(cls.STATS_KEY, entry)
+        return entry
+
+    @classmethod
+    def search(cls, text: str, limit: int = 100, offset: int = 0) -> list:
+        """
+        Returns the Employees whose names or department match text, best matches first
+        :param text: words that match the beginning of a name, or roughly match it on PostgreSQL
+        """
+        logger.debug("Processing search for %s", text)
+        statement = cls.search_statement(text, db.engine.dialect.name).limit(limit).offset(offset)
+        result = db.session.execute(statement)
+        return serialize_rows(tuple(result.keys()), result)
+
+    @classmethod
+    def search_statement(cls, text: str, dialect: str):
+        """
+        Builds the ranked search for text on the given database
+
+        PostgreSQL ranks by trigram word similarity to the names and department,
+        with prefix matches first. SQLite ranks FTS5 prefix matches with bm25,
+        names weighing more than the department. Other databases, and PostgreSQL
+        for text shorter than a trigram, which its index cannot look up, match prefixes
+        """
+        words = re.findall(r"\w+", text.lower())
+        if not words:
+            raise DataValidationError("Search text must contain letters or digits")
+        columns = [cls._select_column(name) for name in cls.FIELDS]
+        statement = db.select(*columns)
+        query = " ".join(words)
+        if dialect == "postgresql" and len(query) >= TRIGRAM_LENGTH:
+            return cls._trigram_search(statement, query)
+        if dialect == "sqlite":
+            fts = db.table("employee_fts", db.column("rowid"))
+            match = " ".join(f'"{word}"*' for word in words)
+            rank = db.func.bm25(db.literal_column("employee_fts"), 10.0, 10.0, 1.0)
+            return (
+                statement.join(fts, fts.c.rowid == cls.id)
+                .where(db.literal_column("employee_fts").match(match))
+                .order_by(rank, cls.id)
+            )
+        searched = (cls.first_name, cls.last_name, cls.department)
+        prefixes = [
+            db.or_(*(db.func.lower(column).startswith(word, autoescape=True) for column in searched)) for word in words
+        ]
+        return statement.where(*prefixes).order_by(cls.last_name, cls.first_name, cls.id)
+
+    @classmethod
+    def _trigram_search(cls, statement, query: str):
+        """Adds the PostgreSQL trigram match and ranking of query to statement"""
+        document = db.literal_column(SEARCH_DOCUMENT)
+        # _ is a word character but a wildcard of ILIKE
+        pattern = re.sub(r"([\\%_])", r"\\\1", query)
+        prefix = db.or_(cls.first_name.ilike(f"{pattern}%", escape="\\"), cls.last_name.ilike(f"{pattern}%", escape="\\"))
+        score = db.func.word_similarity(query, document) + db.case((prefix, 1.0), else_=0.0)
+        matches = db.or_(db.literal(query).op("<%")(document), document.ilike(f"%{pattern}%", escape="\\"))
+        return statement.where(matches).order_by(score.desc(), cls.id)
+
+    @classmethod
+    def rebuild_search_index(cls) -> None:
+        """Creates the search index if it is missing and fills it from the employee table"""
+        logger.info("Rebuilding the search index")
+        with db.engine.begin() as connection:
+            create_search_index(cls.__table__, connection)
+            if connection.dialect.name == "sqlite":
+                connection.exec_driver_sql("INSERT INTO employee_fts(employee_fts) VALUES ('rebuild')")
+
+    @classmethod
+    def invalidate(cls, employee_ids) -> None:
+        """Removes the given Employees and the statistics from the cache after a write"""
+        for employee_id in employee_ids:
+            cache.delete(cls.cache_key(employee_id))
+        cache.delete(cls.STATS_KEY)
+
+    @staticmethod
+    def cache_key(employee_id: int) -> str:
+        """Returns the key an Employee is cached under"""
+        return f"employee:{employee_id}"
+
+    @property
+    def etag(self) -> str:
+        """Returns a strong entity tag that changes every time the Employee is updated"""
+        return make_etag(self.id, self.version)
+
     def serialize(self) -> dict:
         """Serializes an Employee into a dictionary"""
         return {
@@ -121,22 +661,340 @@ class Employee(db.Model):
             "gender": self.gender.name,
         }
 
+    def to_row(self) -> dict:
+        """Returns the column values of an Employee for a bulk INSERT or UPDATE"""
+        return {
+            "first_name": self.first_name,
+            "last_name": self.last_name,
+            "department": self.department,
+            "gender": self.gender,
+        }
+
     def deserialize(self, data: dict):
         """
         Deserializes an Employee from a dictionary
         :param data: a dictionary containing the Employee data
         """
-        try:
-            self.first_name = data["first_name"]
-            self.last_name = data["last_name"]
-            self.department = data["department"]
-            self.gender = Gender[data["gender"].upper()]
-        except AttributeError as error:
-            raise DataValidationError("Invalid attribute: " + error.args[0]) from error
-        except KeyError as error:
-            raise DataValidationError("Invalid employee: missing " + error.args[0]) from error
-        except TypeError as error:
-            raise DataValidationError(
-                "Invalid employee: body of request contained bad or no data " + str(error)
-            ) from error
+        validate_employee(data)
+        self.first_name = data["first_name"]
+        self.last_name = data["last_name"]
+        self.department = data["department"]
+        self.gender = Gender[data["gender"].upper()]
         return self
+
+
+def make_validator(strings: tuple, enums: tuple):
+    """
+    Builds a function that checks a decoded JSON object in one pass and raises a
+    DataValidationError for the first field that could not be saved
+    :param strings: (name, maximum length) of the fields that must be strings
+    :param enums: (name, Enum) of the fields that must be the name of a member, in any case
+    """
+    choices = tuple((name, frozenset(enum.__members__)) for name, enum in enums)
+
+    def validate(data) -> None:
+        if not isinstance(data, dict):
+            raise DataValidationError("Invalid employee: body of request contained bad or no data")
+        for name, length in strings:
+            value = data.get(name)
+            if not isinstance(value, str):
+                raise DataValidationError(_invalid(data, name, "must be a string"))
+            if len(value) > length:
+                raise DataValidationError(f"Invalid employee: {name} is longer than {length} characters")
+        for name, members in choices:
+            value = data.get(name)
+            if not isinstance(value, str) or value.upper() not in members:
+                raise DataValidationError(_invalid(data, name, f"must be one of {', '.join(sorted(members))}"))
+
+    return validate
+
+
+def _invalid(data: dict, name: str, reason: str) -> str:
+    """Returns the message for a field that is missing or not valid"""
+    return f"Invalid employee: missing {name}" if name not in data else f"Invalid employee: {name} {reason}"
+
+
+# Checks the fields of an Employee against the columns before anything is built from them
+validate_employee = make_validator(
+    tuple((name, Employee.__table__.c[name].type.length) for name in ("first_name", "last_name", "department")),
+    (("gender", Gender),),
+)
+
+
+# Indexes that older versions created and upgrade_db() drops: ix_employee_department_gender serves the department filter
+OBSOLETE_INDEXES = ("ix_employee_department",)
+
+# The shortest text that the trigram index can look up
+TRIGRAM_LENGTH = 3
+
+# The text matched by the trigram index on PostgreSQL, the same expression as in SEARCH_DDL
+SEARCH_DOCUMENT = "(employee.first_name || ' ' || employee.last_name || ' ' || employee.department)"
+
+# Statements that create the search index, every one of them can be run again
+SEARCH_DDL = {
+    "postgresql": [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS ix_employee_search_trgm ON employee "
+        "USING gin ((first_name || ' ' || last_name || ' ' || department) gin_trgm_ops)",
+    ],
+    "sqlite": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS employee_fts USING fts5("
+        "first_name, last_name, department, content='employee', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        "CREATE TRIGGER IF NOT EXISTS employee_fts_insert AFTER INSERT ON employee BEGIN "
+        "INSERT INTO employee_fts(rowid, first_name, last_name, department) "
+        "VALUES (new.id, new.first_name, new.last_name, new.department); END",
+        "CREATE TRIGGER IF NOT EXISTS employee_fts_delete AFTER DELETE ON employee BEGIN "
+        "INSERT INTO employee_fts(employee_fts, rowid, first_name, last_name, department) "
+        "VALUES ('delete', old.id, old.first_name, old.last_name, old.department); END",
+        "CREATE TRIGGER IF NOT EXISTS employee_fts_update AFTER UPDATE OF first_name, last_name, department "
+        "ON employee BEGIN "
+        "INSERT INTO employee_fts(employee_fts, rowid, first_name, last_name, department) "
+        "VALUES ('delete', old.id, old.first_name, old.last_name, old.department); "
+        "INSERT INTO employee_fts(rowid, first_name, last_name, department) "
+        "VALUES (new.id, new.first_name, new.last_name, new.department); END",
+    ],
+}
+
+
+@event.listens_for(Employee.__table__, "after_create")
+def create_search_index(target, connection, **kwargs):  # pylint: disable=unused-argument
+    """Creates the search index of the database together with the employee table"""
+    for statement in SEARCH_DDL.get(connection.dialect.name, []):
+        connection.exec_driver_sql(statement)
+
+
+@event.listens_for(Employee.__table__, "before_drop")
+def drop_search_index(target, connection, **kwargs):  # pylint: disable=unused-argument
+    """Drops the SQLite full-text table, which is not dropped with the employee table"""
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("DROP TABLE IF EXISTS employee_fts")
+
+
+class EmployeeTombstone(db.Model):  # pylint: disable=too-few-public-methods
+    """
+    Class that records the deletion of an Employee for the change feed
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    employee_id = db.Column(db.Integer, nullable=False, index=True)
+    deleted_at = db.Column(db.DateTime, default=db.func.now(), nullable=False, index=True)
+
+    @classmethod
+    def prune(cls, before: datetime) -> int:
+        """Removes the tombstones older than before and returns how many there were"""
+        logger.info("Pruning tombstones older than %s", before)
+        count = db.session.execute(db.delete(cls).where(cls.deleted_at < _timestamp(before))).rowcount
+        db.session.commit()
+        return count
+
+
+class IdempotencyKey(db.Model):
+    """
+    Class that keeps the response to a request sent with an Idempotency-Key
+    header, so that a retry gets the same response instead of writing again
+    """
+
+    __tablename__ = "idempotency_key"
+
+    key = db.Column(db.String(255), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    # the response, which stays empty while the first request is in progress
+    status_code = db.Column(db.Integer, nullable=True)
+    body = db.Column(db.Text, nullable=True)
+    location = db.Column(db.String(2048), nullable=True)
+    etag = db.Column(db.String(64), nullable=True)
+    created_at = db.Column(db.DateTime, default=db.func.now(), nullable=False, index=True)
+
+    @classmethod
+    def claim(cls, key: str, fingerprint: str, ttl: timedelta, lock: timedelta, attempts: int = 3):
+        """
+        Reserves key for a new request with a single INSERT
+
+        The primary key lets only one of several simultaneous requests with the
+        same key through. The record of an earlier request gives way once it is
+        older than ttl, or than lock if that request never finished
+        :return: None if the key is now reserved, or else the record that holds it
+        """
+        for _ in range(attempts):
+            try:
+                db.session.execute(db.insert(cls).values(key=key, fingerprint=fingerprint))
+                db.session.commit()
+                return None
+            except IntegrityError:
+                db.session.rollback()
+            now = database_now()
+            stale = db.or_(
+                cls.created_at < _timestamp(now - ttl),
+                db.and_(cls.status_code.is_(None), cls.created_at < _timestamp(now - lock)),
+            )
+            removed = db.session.execute(db.delete(cls).where(cls.key == key, stale)).rowcount
+            db.session.commit()
+            if not removed:
+                record = db.session.execute(db.select(cls.__table__).where(cls.key == key)).mappings().first()
+                if record is not None:
+                    return record
+        raise DataValidationError(f"Idempotency-Key {key} could not be reserved")
+
+    @classmethod
+    def complete(cls, key: str, status_code: int, body: str, location: str, etag: str):
+        """Returns the UPDATE that keeps the response to the request that reserved key"""
+        return (
+            db.update(cls)
+            .where(cls.key == key)
+            .values(status_code=status_code, body=body, location=location, etag=etag)
+        )
+
+    @classmethod
+    def release(cls, key: str) -> None:
+        """Frees the reservation of a request that failed, so that a retry runs again"""
+        db.session.execute(db.delete(cls).where(cls.key == key, cls.status_code.is_(None)))
+        db.session.commit()
+
+    @classmethod
+    def prune(cls, before: datetime) -> int:
+        """Removes the keys created before before and returns how many there were"""
+        logger.info("Pruning idempotency keys older than %s", before)
+        count = db.session.execute(db.delete(cls).where(cls.created_at < _timestamp(before))).rowcount
+        db.session.commit()
+        return count
+
+
+class TableVersion(db.Model):  # pylint: disable=too-few-public-methods
+    """
+    Class that counts the writes to a table, so that a version of the whole
+    table can be read with a short primary key range scan instead of a table scan
+
+    The counter is incremented by triggers in the transaction of every write
+    (see VERSION_DDL), so it changes together with what the write changed. It is
+    spread over VERSION_SLOTS rows, and a transaction keeps to one slot that no
+    other transaction has locked, so a long bulk write or import does not hold
+    up the other writers
+    """
+
+    __tablename__ = "table_version"
+
+    name = db.Column(db.String(64), primary_key=True)
+    slot = db.Column(db.Integer, primary_key=True, autoincrement=False, default=0)
+    version = db.Column(db.BigInteger, default=0, nullable=False)
+
+    @classmethod
+    def current(cls, name: str) -> int:
+        """Returns the number of writes to the table with the given name"""
+        return db.session.scalar(db.select(db.func.sum(cls.version)).where(cls.name == name)) or 0
+
+
+# Rows the write counter of a table is spread over on PostgreSQL
+VERSION_SLOTS = 16
+
+# Statements that count the writes to the employee table, every one of them can be run again.
+# On PostgreSQL the first write of a transaction picks a slot that is not locked, skipping the
+# ones held by other open transactions, and keeps it in a transaction-local setting; it only
+# waits when every slot is taken. SQLite has one writer at a time and no statement triggers,
+# so it counts every row written in a single slot
+VERSION_DDL = {
+    "postgresql": [
+        "INSERT INTO table_version (name, slot, version) "
+        f"SELECT 'employee', slot, 0 FROM generate_series(0, {VERSION_SLOTS - 1}) AS slot "
+        "ON CONFLICT (name, slot) DO NOTHING",
+        "CREATE OR REPLACE FUNCTION employee_count_write() RETURNS trigger LANGUAGE plpgsql AS $$ "
+        "DECLARE chosen integer := nullif(current_setting('service.employee_version_slot', true), '')::integer; "
+        "BEGIN "
+        "IF chosen IS NULL THEN "
+        "SELECT slot INTO chosen FROM table_version WHERE name = 'employee' "
+        "ORDER BY random() LIMIT 1 FOR UPDATE SKIP LOCKED; "
+        f"chosen := coalesce(chosen, floor(random() * {VERSION_SLOTS})::integer); "
+        "PERFORM set_config('service.employee_version_slot', chosen::text, true); "
+        "END IF; "
+        "UPDATE table_version SET version = version + 1 WHERE name = 'employee' AND slot = chosen; "
+        "RETURN NULL; END $$",
+        # DROP TRIGGER would lock the table against reads on every start, so only create a missing one
+        "DO $$ BEGIN IF NOT EXISTS (SELECT FROM pg_trigger WHERE tgname = 'employee_version' "
+        "AND tgrelid = 'employee'::regclass) THEN "
+        "CREATE TRIGGER employee_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON employee "
+        "FOR EACH STATEMENT EXECUTE FUNCTION employee_count_write(); END IF; END $$",
+    ],
+    "sqlite": [
+        "INSERT OR IGNORE INTO table_version (name, slot, version) VALUES ('employee', 0, 0)",
+    ] + [
+        f"CREATE TRIGGER IF NOT EXISTS employee_version_{event_name.lower()} AFTER {event_name} ON employee BEGIN "
+        "UPDATE table_version SET version = version + 1 WHERE name = 'employee' AND slot = 0; END"
+        for event_name in ("INSERT", "UPDATE", "DELETE")
+    ],
+}
+
+
+@event.listens_for(db.metadata, "after_create")
+def create_version_triggers(target, connection, **kwargs):  # pylint: disable=unused-argument
+    """Creates the triggers that count the writes to the employee table, on every create_all()"""
+    for statement in VERSION_DDL.get(connection.dialect.name, []):
+        connection.exec_driver_sql(statement)
+
+
+def make_etag(employee_id: int, version: int) -> str:
+    """Returns the strong entity tag of a version of an Employee"""
+    return f"{employee_id}-{version}"
+
+
+def parse_etag(etag: str):
+    """Returns the (id, version) of an entity tag made by make_etag(), or None for any other tag"""
+    match = re.fullmatch(r"([0-9]{1,18})-([0-9]{1,18})", etag)
+    return (int(match[1]), int(match[2])) if match else None
+
+
+def page_cursor(values: list) -> str:
+    """Returns an opaque page cursor holding the sort values of the last Employee of a page"""
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(",", ":")).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def parse_cursor(cursor: str):
+    """Returns the sort values of a cursor made by page_cursor(), or None for anything else"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        return None
+    return values if isinstance(values, list) else None
+
+
+def database_now() -> datetime:
+    """Returns the current time of the database, in the same form as the timestamps it stores"""
+    now = db.session.scalar(db.select(db.func.now()))
+    return now.replace(tzinfo=None)
+
+
+def changes_horizon(settle_seconds: float) -> datetime:
+    """
+    Returns the latest change time that the change feed can hand out without skipping a change committed later
+
+    PostgreSQL stamps rows with the start of their transaction, so a transaction that is still
+    writing may commit changes older than any settle window. The horizon stays before the start
+    of the oldest of them, read on the primary where the writes are
+    """
+    with primary():
+        horizon = database_now() - timedelta(seconds=settle_seconds)
+        if db.engine.dialect.name == "postgresql":
+            oldest = db.session.scalar(db.text(
+                "SELECT min(xact_start) FROM pg_stat_activity WHERE backend_xid IS NOT NULL AND datname = current_database()"
+            ))
+            if oldest is not None:
+                horizon = min(horizon, oldest.replace(tzinfo=None) - timedelta(microseconds=1))
+    return horizon
+
+
+def _timestamp(value: datetime):
+    """Returns a timestamp to compare with the stored ones"""
+    if db.engine.dialect.name == "sqlite":
+        # SQLite compares timestamps as text, and CURRENT_TIMESTAMP has no fraction of a second
+        return db.literal(value.isoformat(sep=" "), db.String)
+    return db.literal(value, db.DateTime)
+
+
+def serialize_rows(keys: tuple, rows) -> list:
+    """Builds serialize() style dictionaries straight from row tuples without creating Employee objects"""
+    return list(map(dict, map(zip, repeat(keys), rows)))
+
+
+def _chunks(items: list, size: int):
+    """Yields successive slices of items that are at most size long"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
@@ -5,23 +5,82 @@ This service implements a REST API that allows user to Create, Read, Update
 and Delete Drivers from the online ride-sharing application.
 """
 
-from flask import jsonify, request, url_for, abort  # noqa: F401
+import time
+import hashlib
+from datetime import datetime, timedelta
+from flask import jsonify, request, url_for, abort, Response, stream_with_context  # noqa: F401
 from flask import current_app as app
-from service.models import Employee
+from werkzeug.http import quote_etag
+from sqlalchemy.exc import SQLAlchemyError
+from service.models import (
+    Employee, DataValidationError, IdempotencyKey, db, changes_horizon, page_cursor, parse_etag,
+)
 from service.common import status
+from service.common.cache import cache
+from service.common.pool_metrics import pool_metrics
+from service.common.metrics import metrics
+from service.common.replicas import replicas
+from service.common.limits import limiter
+
+NDJSON = "application/x-ndjson"
+# A page of employees as one array per field, {"id": [1, 2], "first_name": [...]}
+COLUMNAR_JSON = "application/vnd.columnar+json"
 
 
 @app.route("/health")
+@limiter.exempt
 def health_check():
     """Check if the service is running"""
     return jsonify(status=200, message="Healthy"), status.HTTP_200_OK
 
 
+@app.route("/ready")
+@limiter.exempt
+def readiness_check():
+    """Check if the service can reach its database and is ready to take traffic"""
+    start = time.perf_counter()
+    try:
+        with db.engine.connect() as connection:
+            connection.execute(db.text("SELECT 1"))
+    except SQLAlchemyError as error:
+        app.logger.warning("Database unavailable: %s", error)
+        return (
+            jsonify(status=503, message="Database unavailable", database="unreachable"),
+            status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+    latency_ms = round((time.perf_counter() - start) * 1000, 3)
+    return jsonify(status=200, message="Ready", database="ok", latency_ms=latency_ms), status.HTTP_200_OK
+
+
+@app.route("/metrics")
+@limiter.exempt
+def prometheus_metrics():
+    """Returns the request, database and cache metrics in the Prometheus text format"""
+    return Response(metrics.report(), status=status.HTTP_200_OK, mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/cache/stats")
+@limiter.exempt
+def cache_stats():
+    """Returns the hit, miss and eviction counters of the employee cache"""
+    return jsonify(cache.stats()), status.HTTP_200_OK
+
+
+@app.route("/pool/stats")
+@limiter.exempt
+def pool_stats():
+    """Returns the checkout, wait and usage counters of the database connection pool"""
+    data = pool_metrics.snapshot(db.engine.pool)
+    if replicas.replicas:
+        data.update(replicas.stats())
+    return jsonify(data), status.HTTP_200_OK
+
+
 @app.route("/")
 def index():
     """Root URL response"""
 
-    app.logger.info("Request for Root URL")
+    app.logger.debug("Request for Root URL")
     return (
         jsonify(
             name="Employee Demo REST API Service",
@@ -33,14 +92,133 @@ def index():
 
 
 @app.route("/employees", methods=["GET"])
+@limiter.uses_database
 def list_employees():
-    """Returns all Employees"""
-    app.logger.info("Request for employee list")
-    employees = Employee.all()
+    """
+    Returns a page of Employees
+
+    Filter with ?department=, ?gender= and a ?last_name= prefix, order with
+    ?sort=last_name,-id and select only some fields with ?fields=id,last_name.
+    Pages are keyed on the sort fields and the id: pass ?limit= and follow the
+    Link header, or pass the X-Next-Cursor header back as ?cursor=, to get the
+    next page (?after_id= still works for the id order). A page is a JSON array of objects, or
+    NDJSON or one array per field when asked for application/x-ndjson or
+    application/vnd.columnar+json. Pass ?stream=true to stream every Employee
+    as a JSON array (or NDJSON when asked for application/x-ndjson)
+    """
+    app.logger.debug("Request for employee list")
+    etag = collection_etag()
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    query = get_list_args()
+    if request.args.get("stream", "").lower() == "true":
+        response = stream_employees(query)
+        response.set_etag(etag)
+        return response
+
+    limit = get_int_arg("limit", app.config["PAGE_SIZE_DEFAULT"], minimum=1)
+    limit = min(limit, app.config["PAGE_SIZE_MAX"])
+    after_id = get_int_arg("after_id", None, minimum=0)
+    # an id is the cursor of the id order, any other sort needs the cursor of the last page
+    cursor = request.args.get("cursor", page_cursor([after_id]) if after_id is not None else None)
+
+    # Ask for one extra row to find out if there is a next page
+    employees = Employee.find_page(limit + 1, cursor, **query)
+    headers = {"ETag": quote_etag(etag)}
+    if len(employees) > limit:
+        employees = employees[:limit]
+        # the cursor holds the sort values of the last row, so the next page does not depend on that row still existing
+        next_cursor = Employee.page_cursor(employees[-1], query["sort"])
+        args = {name: value for name, value in request.args.items() if name != "after_id"}
+        next_url = url_for("list_employees", **dict(args, limit=limit, cursor=next_cursor), _external=True)
+        headers["Link"] = f'<{next_url}>; rel="next"'
+        headers["X-Next-Cursor"] = next_cursor
+
+    employees = project_rows(employees, query["fields"])
+    app.logger.debug("Returning %d employees", len(employees))
+    return render_employees(employees, query["fields"]), status.HTTP_200_OK, headers
+
+
+@app.route("/employees/search", methods=["GET"])
+@limiter.uses_database
+def search_employees():
+    """
+    Searches the Employees by name and department
 
-    results = [employee.serialize() for employee in employees]
-    app.logger.info("Returning %d employees", len(results))
-    return jsonify(results), status.HTTP_200_OK
+    Every word of ?q= must match the beginning of the first name, last name or
+    department (or roughly match them on PostgreSQL). The best matches come
+    first, a page of ?limit= at a time: follow the Link header or pass ?offset=
+    """
+    app.logger.debug("Request to search employees")
+    text = request.args.get("q", "").strip()
+    if not text:
+        abort(status.HTTP_400_BAD_REQUEST, "Query parameter 'q' is required")
+    limit = min(get_int_arg("limit", app.config["PAGE_SIZE_DEFAULT"], minimum=1), app.config["PAGE_SIZE_MAX"])
+    offset = get_int_arg("offset", 0, minimum=0)
+    # Deep pages of a ranked search cost as much as everything before them
+    limit = min(limit, max(app.config["SEARCH_MAX_RESULTS"] - offset, 0))
+
+    # Ask for one extra match to find out if there is a next page
+    employees = Employee.search(text, limit + 1, offset) if limit else []
+    headers = {}
+    has_more = len(employees) > limit
+    employees = employees[:limit]
+    if has_more and offset + limit < app.config["SEARCH_MAX_RESULTS"]:
+        next_url = url_for("search_employees", **dict(request.args.to_dict(), limit=limit, offset=offset + limit),
+                           _external=True)
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    app.logger.debug("Returning %d matches", len(employees))
+    return jsonify(employees), status.HTTP_200_OK, headers
+
+
+@app.route("/employees/stats", methods=["GET"])
+def employee_stats():
+    """
+    Returns the number of Employees by department, by gender and by both
+
+    The counts are computed with a GROUP BY in the database and cached until
+    the next write or for CACHE_TTL seconds
+    """
+    app.logger.debug("Request for employee statistics")
+    stats = Employee.stats(before_read=limiter.use_database)
+    etag = hashlib.sha1(app.json.dumps(stats).encode("utf-8")).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    return jsonify(stats), status.HTTP_200_OK, {"ETag": quote_etag(etag)}
+
+
+@app.route("/employees/changes", methods=["GET"])
+@limiter.uses_database
+def list_employee_changes():
+    """
+    Returns the Employees created, updated or deleted since a watermark
+
+    Changes come oldest first, deleted Employees only with their id and
+    "deleted": true. Pass the "next" watermark of the response as ?since= to
+    get the following changes, without ?since= the feed starts at the beginning
+    """
+    app.logger.debug("Request for employee changes")
+    since = get_watermark()
+    limit = min(get_int_arg("limit", app.config["PAGE_SIZE_DEFAULT"], minimum=1), app.config["PAGE_SIZE_MAX"])
+    until = changes_horizon(app.config["CHANGES_SETTLE_SECONDS"])
+
+    # Ask for one extra change to find out if there are more
+    changes = Employee.changes(since, until, limit + 1)
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    if changes:
+        last = changes[-1]
+        watermark = f"{last['changed_at'].isoformat()},{int(last['deleted'])},{last['id']}"
+    else:
+        watermark = request.args.get("since", "")
+    for change in changes:
+        change["changed_at"] = change["changed_at"].isoformat()
+    app.logger.debug("Returning %d changes", len(changes))
+    return (
+        jsonify(changes=changes, next=watermark, has_more=has_more),
+        status.HTTP_200_OK,
+        {"X-Next-Watermark": watermark},
+    )
 
 
 @app.route("/employees/<int:employee_id>", methods=["GET"])
@@ -50,84 +228,196 @@ def get_employees(employee_id):
 
     This endpoint will return an Employee based on its id
     """
-    app.logger.info("Request to Retrieve an employee with id [%s]", employee_id)
+    app.logger.debug("Request to Retrieve an employee with id [%s]", employee_id)
 
     # Attempt to find the Employee and abort if not found
-    employee = Employee.find(employee_id)
-    if not employee:
+    # a read served from the cache needs no database slot
+    result = Employee.find_serialized(employee_id, before_read=limiter.use_database)
+    if not result:
         abort(status.HTTP_404_NOT_FOUND, f"Employee with id '{employee_id}' was not found.")
 
-    app.logger.info("Returning employee: %s %s", employee.first_name, employee.last_name)
-    return jsonify(employee.serialize()), status.HTTP_200_OK
+    employee, etag = result
+    if request.if_none_match.contains_weak(etag):
+        app.logger.debug("Employee with id [%s] not modified", employee_id)
+        return not_modified(etag)
+
+    app.logger.debug("Returning employee: %s %s", employee["first_name"], employee["last_name"])
+    return jsonify(employee), status.HTTP_200_OK, {"ETag": quote_etag(etag)}
 
 
 @app.route("/employees", methods=["POST"])
+@limiter.uses_database
 def create_employees():
     """
     Create an Employee
-    This endpoint will create an Employee based on the data in the body that is posted
+    This endpoint will create an Employee based on the data in the body that is posted.
+    Send a unique Idempotency-Key header to retry safely: a retry with the same key
+    and body gets the first response back instead of creating another Employee
     """
-    app.logger.info("Request to Create an Employee...")
+    app.logger.debug("Request to Create an Employee...")
     check_content_type("application/json")
 
-    employee = Employee()
-    # Get the data from the request and deserialize it
-    data = request.get_json()
-    app.logger.info("Processing: %s", data)
-    employee.deserialize(data)
-
-    employee.create()
-    app.logger.info("Employee with new id [%s] saved!", employee.id)
+    # Get the data from the request and validate it before the database is used
+    data = get_json_body(app.config["EMPLOYEE_MAX_CONTENT_LENGTH"])
+    app.logger.debug("Processing: %s", data)
+    employee = Employee().deserialize(data)
+
+    key = request.headers.get("Idempotency-Key")
+    then = None
+    if key is not None:
+        fingerprint = hashlib.sha256(app.json.dumps(data).encode("utf-8")).hexdigest()
+        stored = claim_idempotency_key(key, fingerprint)
+        if stored is not None:
+            return replay(stored, fingerprint)
+
+        # the response is kept in the transaction of the INSERT, so a retry never creates a second Employee
+        then = keep_response(key)
+
+    # A single INSERT ... RETURNING, so nothing is read back after the commit
+    try:
+        data, etag = Employee.create_serialized(employee, then)
+    except DataValidationError:
+        if key is not None:
+            IdempotencyKey.release(key)
+        raise
+    app.logger.debug("Employee with new id [%s] saved!", employee.id)
 
     # Return the location of the new Employee
     location_url = url_for("get_employees", employee_id=employee.id, _external=True)
-    return jsonify(employee.serialize()), status.HTTP_201_CREATED, {"location": location_url}
+    return (
+        jsonify(data),
+        status.HTTP_201_CREATED,
+        {"location": location_url, "ETag": quote_etag(etag)},
+    )
 
 
 @app.route("/employees/<int:employee_id>", methods=["PUT"])
+@limiter.uses_database
 def update_employees(employee_id):
     """
     Update an Employee
+
+    Send an If-Match header with the ETag of the Employee to only update it
+    if it has not been changed by someone else in the meantime
     """
-    app.logger.info("Request to Update an employee with id [%s]", employee_id)
+    app.logger.debug("Request to Update an employee with id [%s]", employee_id)
     check_content_type("application/json")
 
-    # Attempt to find the Employee and abort if not found
-    employee = Employee.find(employee_id)
-    if not employee:
-        abort(status.HTTP_404_NOT_FOUND, f"Employee with id '{employee_id}' was not found.")
-
-    # Update the Employee with the new data
-    data = request.get_json()
-    app.logger.info("Processing: %s", data)
-    employee.deserialize(data)
+    data = get_json_body(app.config["EMPLOYEE_MAX_CONTENT_LENGTH"])
+    app.logger.debug("Processing: %s", data)
+    employee = Employee().deserialize(data)
 
-    # Save the updates to the database
-    employee.update()
+    # Save the updates with a single UPDATE ... RETURNING that also checks If-Match, abort if not found
+    result = Employee.update_serialized(employee_id, employee, if_match_versions(employee_id))
+    if not result:
+        if request.if_match and Employee.exists(employee_id):
+            precondition_failed(employee_id)
+        abort(status.HTTP_404_NOT_FOUND, f"Employee with id '{employee_id}' was not found.")
 
-    app.logger.info("Employee with ID: %d updated.", employee.id)
-    return jsonify(employee.serialize()), status.HTTP_200_OK
+    data, etag = result
+    app.logger.debug("Employee with ID: %d updated.", employee_id)
+    return jsonify(data), status.HTTP_200_OK, {"ETag": quote_etag(etag)}
 
 
 @app.route("/employees/<int:employee_id>", methods=["DELETE"])
+@limiter.uses_database
 def delete_employees(employee_id):
     """
     Delete an Employee
 
     This endpoint will delete an Employee based on the id specified in the path
     """
-    app.logger.info("Request to Delete an Employee with id [%s]", employee_id)
+    app.logger.debug("Request to Delete an Employee with id [%s]", employee_id)
 
-    # Delete the Employee if it exists
-    employee = Employee.find(employee_id)
-    if employee:
-        app.logger.info("Employee with ID: %d found.", employee.id)
-        employee.delete()
+    # Delete the Employee if it exists, and if it is still the version that If-Match has
+    if Employee.delete_by_id(employee_id, if_match_versions(employee_id)):
+        app.logger.debug("Employee with ID: %d found.", employee_id)
+    elif request.if_match:
+        precondition_failed(employee_id)
 
-    app.logger.info("Employee with ID: %d delete complete.", employee_id)
+    app.logger.debug("Employee with ID: %d delete complete.", employee_id)
     return {}, status.HTTP_204_NO_CONTENT
 
 
+@app.route("/employees/bulk", methods=["POST"])
+@limiter.uses_database
+def create_employees_bulk():
+    """
+    Create many Employees
+
+    This endpoint will create every Employee in the JSON array that is posted
+    in a single transaction, or none of them if any row is not valid
+    """
+    app.logger.debug("Request to Bulk Create Employees...")
+    check_content_type("application/json")
+
+    employees = deserialize_employees(request.get_json())
+    ids = Employee.bulk_create(employees, app.config["BULK_CHUNK_SIZE"])
+    app.logger.debug("%d Employees created", len(ids))
+
+    results = [
+        {"index": index, "id": employee_id, "status": status.HTTP_201_CREATED}
+        for index, employee_id in enumerate(ids)
+    ]
+    return jsonify(results), status.HTTP_201_CREATED
+
+
+@app.route("/employees/bulk", methods=["PUT"])
+@limiter.uses_database
+def update_employees_bulk():
+    """
+    Update many Employees
+
+    This endpoint will update every Employee in the JSON array that is put,
+    matching them on their id, in a single transaction
+    """
+    app.logger.debug("Request to Bulk Update Employees...")
+    check_content_type("application/json")
+
+    employees = deserialize_employees(request.get_json(), require_id=True)
+    updated = Employee.bulk_update(employees, app.config["BULK_CHUNK_SIZE"])
+    app.logger.debug("%d Employees updated", len(updated))
+
+    results = [
+        {
+            "index": index,
+            "id": employee.id,
+            "status": status.HTTP_200_OK if employee.id in updated else status.HTTP_404_NOT_FOUND,
+        }
+        for index, employee in enumerate(employees)
+    ]
+    return jsonify(results), status.HTTP_200_OK
+
+
+@app.route("/employees/bulk", methods=["DELETE"])
+@limiter.uses_database
+def delete_employees_bulk():
+    """
+    Delete many Employees
+
+    This endpoint will delete every Employee whose id is in the JSON array
+    that is sent, in a single transaction
+    """
+    app.logger.debug("Request to Bulk Delete Employees...")
+    check_content_type("application/json")
+
+    employee_ids = request.get_json()
+    if not isinstance(employee_ids, list) or not all(map(is_employee_id, employee_ids)):
+        abort(status.HTTP_400_BAD_REQUEST, "Request body must be a JSON array of employee ids")
+    deleted = Employee.bulk_delete(employee_ids, app.config["BULK_CHUNK_SIZE"])
+    app.logger.debug("%d Employees deleted", len(deleted))
+
+    results = [
+        {
+            "index": index,
+            "id": employee_id,
+            "status": status.HTTP_204_NO_CONTENT if employee_id in deleted else status.HTTP_404_NOT_FOUND,
+        }
+        for index, employee_id in enumerate(employee_ids)
+    ]
+    return jsonify(results), status.HTTP_200_OK
+
+
 def check_content_type(content_type) -> None:
     """Checks that the media type is correct"""
     if "Content-Type" not in request.headers:
@@ -145,3 +435,213 @@ def check_content_type(content_type) -> None:
         status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
         f"Content-Type must be {content_type}",
     )
+
+
+def get_json_body(max_length: int):
+    """Returns the decoded JSON body, aborting with 413_REQUEST_ENTITY_TOO_LARGE before reading more than max_length bytes"""
+    max_length = min(max_length, app.config["MAX_CONTENT_LENGTH"] or max_length)
+    length = request.content_length
+    if length is None:
+        # a chunked body has no length up front; reading it stops at MAX_CONTENT_LENGTH
+        length = len(request.get_data(cache=True))
+    if length > max_length:
+        abort(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, f"Request body must be at most {max_length} bytes")
+    return request.get_json()
+
+
+def get_int_arg(name: str, default, minimum: int = 0):
+    """Returns an integer query parameter, aborting with 400_BAD_REQUEST if it is not valid"""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        abort(status.HTTP_400_BAD_REQUEST, f"Query parameter '{name}' must be an integer")
+    if value < minimum:
+        abort(status.HTTP_400_BAD_REQUEST, f"Query parameter '{name}' must be at least {minimum}")
+    return value
+
+
+def get_watermark():
+    """Parses the ?since= watermark into a (changed_at, deleted, id) tuple"""
+    since = request.args.get("since")
+    if not since:
+        return None
+    try:
+        changed_at, _, rest = since.partition(",")
+        if not rest:
+            # a plain timestamp includes the changes made at that time
+            return datetime.fromisoformat(changed_at), -1, 0
+        deleted, employee_id = rest.split(",")
+        return datetime.fromisoformat(changed_at), int(deleted), int(employee_id)
+    except ValueError as error:
+        raise DataValidationError(f"Invalid watermark: {since}") from error
+
+
+def get_list_args() -> dict:
+    """Returns the fields, sort and filters requested for the employee list"""
+    fields = [name for name in request.args.get("fields", "").split(",") if name]
+    sort = [name for name in request.args.get("sort", "").split(",") if name]
+    filters = {name: request.args[name] for name in ("department", "gender", "last_name") if name in request.args}
+    return {"fields": fields, "sort": sort, "filters": filters}
+
+
+def project(employee: dict, fields: list) -> dict:
+    """Returns only the requested fields of a serialized Employee"""
+    return {name: employee[name] for name in fields}
+
+
+def project_rows(employees: list, fields: list) -> list:
+    """Drops the id and sort columns that were selected but not requested"""
+    if not fields or not employees or set(employees[0]) == set(fields):
+        return employees
+    return [project(employee, fields) for employee in employees]
+
+
+def render_employees(employees: list, fields: list) -> Response:
+    """Returns a page of Employees in the format asked for by the Accept header"""
+    mimetype = request.accept_mimetypes.best_match(["application/json", NDJSON, COLUMNAR_JSON], "application/json")
+    if mimetype == NDJSON:
+        return Response("".join(app.json.dumps(employee) + "\n" for employee in employees), mimetype=NDJSON)
+    if mimetype == COLUMNAR_JSON:
+        # the field names are sent once instead of once per Employee
+        names = list(employees[0]) if employees else fields or list(Employee.FIELDS)
+        columns = {name: [employee[name] for employee in employees] for name in names}
+        return Response(app.json.dumps(columns) + "\n", mimetype=COLUMNAR_JSON)
+    return jsonify(employees)
+
+
+def stream_employees(query: dict) -> Response:
+    """Streams every matching Employee in chunks so memory stays flat regardless of table size"""
+    batch_size = app.config["STREAM_BATCH_SIZE"]
+    mimetype = request.accept_mimetypes.best_match(["application/json", NDJSON], "application/json")
+    app.logger.debug("Streaming employees as %s", mimetype)
+
+    # built here so that a bad query is answered with 400 before the 200 headers go out
+    rows = Employee.stream(batch_size, **query)
+
+    def batches():
+        for batch in rows:
+            yield project_rows(batch, query["fields"])
+
+    def generate_ndjson():
+        for batch in batches():
+            yield "\n".join(map(app.json.dumps, batch)) + "\n"
+
+    def generate_json():
+        separator = "["
+        for batch in batches():
+            # encode the whole batch at once and drop its enclosing brackets
+            yield separator + app.json.dumps(batch)[1:-1]
+            separator = ","
+        yield "[]" if separator == "[" else "]"
+
+    generate = generate_ndjson if mimetype == NDJSON else generate_json
+    return Response(stream_with_context(generate()), status=status.HTTP_200_OK, mimetype=mimetype)
+
+
+def deserialize_employees(data, require_id: bool = False) -> list:
+    """
+    Deserializes a JSON array of Employees, validating every row before any is saved
+
+    Aborts with 400_BAD_REQUEST listing the index and reason of each invalid row
+    """
+    if not isinstance(data, list):
+        abort(status.HTTP_400_BAD_REQUEST, "Request body must be a JSON array of employees")
+
+    employees = []
+    errors = []
+    for position, row in enumerate(data):
+        try:
+            employee = Employee().deserialize(row)
+            if require_id:
+                if not is_employee_id(row.get("id")):
+                    raise DataValidationError("Invalid employee: missing id")
+                employee.id = row["id"]
+            employees.append(employee)
+        except DataValidationError as error:
+            errors.append({"index": position, "message": str(error)})
+
+    if errors:
+        app.logger.warning("Rejecting bulk request with %d invalid rows", len(errors))
+        response = jsonify(
+            status=status.HTTP_400_BAD_REQUEST,
+            error="Bad Request",
+            message=f"{len(errors)} of {len(data)} employees are not valid",
+            errors=errors,
+        )
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        abort(response)
+    return employees
+
+
+def is_employee_id(value) -> bool:
+    """Returns True if a decoded JSON value is an integer id, which true and false are not"""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def claim_idempotency_key(key: str, fingerprint: str):
+    """Reserves the Idempotency-Key of a request, or returns the record of the request that has it"""
+    if not key or len(key) > 255:
+        abort(status.HTTP_400_BAD_REQUEST, "Idempotency-Key must be 1 to 255 characters long")
+    return IdempotencyKey.claim(
+        key,
+        fingerprint,
+        ttl=timedelta(hours=app.config["IDEMPOTENCY_TTL_HOURS"]),
+        lock=timedelta(seconds=app.config["IDEMPOTENCY_LOCK_SECONDS"]),
+    )
+
+
+def keep_response(key: str):
+    """Returns a function of a new Employee and its ETag that builds the UPDATE keeping the response under key"""
+    def then(created: dict, etag: str):
+        location = url_for("get_employees", employee_id=created["id"], _external=True)
+        return IdempotencyKey.complete(key, status.HTTP_201_CREATED, app.json.dumps(created), location, etag)
+    return then
+
+
+def replay(stored, fingerprint: str) -> Response:
+    """Returns the response kept for an Idempotency-Key, which must have come with the same body"""
+    if stored["fingerprint"] != fingerprint:
+        abort(status.HTTP_422_UNPROCESSABLE_ENTITY, "Idempotency-Key was already used with a different request")
+    if stored["status_code"] is None:
+        app.logger.warning("Request with Idempotency-Key %s is still in progress", stored["key"])
+        response = jsonify(
+            status=status.HTTP_409_CONFLICT,
+            error="Conflict",
+            message="A request with this Idempotency-Key is still in progress",
+        )
+        response.status_code = status.HTTP_409_CONFLICT
+        response.headers["Retry-After"] = "1"
+        abort(response)
+    app.logger.info("Replaying the response to Idempotency-Key %s", stored["key"])
+    headers = {"location": stored["location"], "ETag": quote_etag(stored["etag"]), "Idempotent-Replayed": "true"}
+    return Response(stored["body"], status=stored["status_code"], headers=headers, mimetype="application/json")
+
+
+def collection_etag() -> str:
+    """Returns an ETag for the employee list that changes with the table and the query"""
+    version = f"{Employee.collection_version()}|{request.query_string.decode()}|{request.headers.get('Accept', '')}"
+    return hashlib.sha1(version.encode("utf-8")).hexdigest()
+
+
+def not_modified(etag: str) -> Response:
+    """Returns an empty 304_NOT_MODIFIED response carrying the ETag"""
+    response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    response.set_etag(etag)
+    return response
+
+
+def if_match_versions(employee_id: int):
+    """Returns the versions of an Employee that the If-Match header accepts, or None if it accepts any"""
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    tags = filter(None, map(parse_etag, request.if_match.as_set()))
+    return [version for tagged_id, version in tags if tagged_id == employee_id]
+
+
+def precondition_failed(employee_id: int) -> None:
+    """Aborts with 412_PRECONDITION_FAILED because the Employee is not at a version that If-Match accepts"""
+    app.logger.warning("If-Match precondition failed for employee %s", employee_id)
+    abort(status.HTTP_412_PRECONDITION_FAILED, "The resource has been changed since it was last read.")
@@ -5,6 +5,8 @@ import factory
 from factory.fuzzy import FuzzyChoice
 from service.models import Employee, Gender
 
+DEPARTMENTS = ["Finance", "Engineering", "HR", "Marketing"]
+
 
 class EmployeeFactory(factory.Factory):
     """Creates fake employees that you don't have to feed"""
@@ -17,6 +19,6 @@ class EmployeeFactory(factory.Factory):
     id = factory.Sequence(lambda n: n)
     first_name = factory.Faker("first_name")
     last_name = factory.Faker("last_name")
-    department = FuzzyChoice(choices=["Finance", "Engineering", "HR", "Marketing"])
+    department = FuzzyChoice(choices=DEPARTMENTS)
     gender = FuzzyChoice(choices=[Gender.MALE, Gender.FEMALE, Gender.UNKNOWN])
     # birthday = FuzzyDate(date(2008, 1, 1))
@@ -0,0 +1,44 @@
+"""
+Fake clocks and clients shared by the test cases
+"""
+import fnmatch
+
+
+class FakeClock:  # pylint: disable=too-few-public-methods
+    """A clock that only moves when told to"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRedis:
+    """An in-memory stand in for a shared Redis client that answers every script with a set wait"""
+
+    def __init__(self, wait: str = "0"):
+        self.data = {}
+        self.wait = wait
+        self.calls = []
+
+    def get(self, key):
+        """Returns the value of key"""
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):  # pylint: disable=unused-argument
+        """Stores value under key"""
+        self.data[key] = value
+
+    def delete(self, key):
+        """Removes key"""
+        self.data.pop(key, None)
+
+    def scan_iter(self, match="*"):
+        """Yields the keys that match a glob pattern"""
+        return (key for key in self.data if fnmatch.fnmatch(key, match))
+
+    def eval(self, script, numkeys, *keys_and_args):
+        """Records the call and returns the wait"""
+        self.calls.append((script, numkeys) + keys_and_args)
+        return self.wait
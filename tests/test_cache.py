@@ -0,0 +1,117 @@
+"""
+Test cases for the Cache backends
+"""
+from unittest import TestCase
+from flask import Flask
+from service.common.cache import Cache, CacheBackend, LRUCache, NullCache, SharedCache
+from tests.fakes import FakeClock, FakeRedis
+
+
+class TestLRUCache(TestCase):
+    """LRU Cache Tests"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = LRUCache(maxsize=2, ttl=10, clock=self.clock)
+
+    def test_hit_and_miss(self):
+        """It should count hits and misses"""
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.set("a", {"id": 1})
+        self.assertEqual(self.cache.get("a"), {"id": 1})
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["size"], 1)
+
+    def test_evicts_least_recently_used(self):
+        """It should evict the least recently used key when full"""
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(self.cache.get("c"), 3)
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_expires_after_ttl(self):
+        """It should expire keys after the ttl"""
+        self.cache.set("a", 1)
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.stats()["expirations"], 1)
+        self.assertEqual(self.cache.stats()["size"], 0)
+
+    def test_delete_and_clear(self):
+        """It should delete one key or all of them"""
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.delete("a")
+        self.cache.delete("missing")
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.clear()
+        self.assertIsNone(self.cache.get("b"))
+
+
+class TestSharedCache(TestCase):
+    """Shared Cache Tests"""
+
+    def setUp(self):
+        self.client = FakeRedis()
+        self.cache = SharedCache(self.client, ttl=10, prefix="test:")
+
+    def test_round_trip(self):
+        """It should store values as JSON in the client"""
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.set("a", {"id": 1})
+        self.assertEqual(self.client.data["test:a"], '{"id": 1}')
+        self.assertEqual(self.cache.get("a"), {"id": 1})
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_delete_and_clear(self):
+        """It should only clear keys under its prefix"""
+        self.client.data["other"] = "1"
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.delete("a")
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.clear()
+        self.assertEqual(self.client.data, {"other": "1"})
+
+
+class TestCacheFacade(TestCase):
+    """Cache Configuration Tests"""
+
+    def test_init_app(self):
+        """It should build its backend from the app config"""
+        app = Flask(__name__)
+        cache = Cache()
+        app.config["CACHE_SIZE"] = 10
+        cache.init_app(app)
+        self.assertIsInstance(cache.backend, LRUCache)
+        self.assertEqual(cache.backend.maxsize, 10)
+        app.config["CACHE_SIZE"] = 0
+        cache.init_app(app)
+        self.assertIsInstance(cache.backend, NullCache)
+        cache.init_app(app, backend=SharedCache(FakeRedis()))
+        self.assertIsInstance(cache.backend, SharedCache)
+
+    def test_null_cache(self):
+        """It should never return anything when disabled"""
+        cache = Cache()
+        cache.set("a", 1)
+        self.assertIsNone(cache.get("a"))
+        cache.delete("a")
+        cache.clear()
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_backend_interface(self):
+        """It should require backends to implement every method"""
+        backend = CacheBackend()
+        self.assertRaises(NotImplementedError, backend.get, "a")
+        self.assertRaises(NotImplementedError, backend.set, "a", 1)
+        self.assertRaises(NotImplementedError, backend.delete, "a")
+        self.assertRaises(NotImplementedError, backend.clear)
+        self.assertRaises(NotImplementedError, backend.stats)
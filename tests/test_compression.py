@@ -0,0 +1,104 @@
+"""
+Test cases for the response compression
+"""
+import gzip
+import zlib
+from unittest import TestCase, skipUnless
+from flask import Flask, Response, jsonify, request
+from service.common.compression import ResponseCompression, brotli
+
+
+class TestResponseCompression(TestCase):
+    """Response Compression Tests"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config.update(COMPRESS_MIN_SIZE=100)
+        self.compression = ResponseCompression()
+        self.compression.init_app(self.app)
+        self.closed = []
+
+        @self.app.route("/items/<int:count>")
+        def items(count):
+            response = jsonify([{"id": number, "name": "employee"} for number in range(count)])
+            response.set_etag("v1")
+            return response.make_conditional(request)
+
+        @self.app.route("/stream")
+        def stream():
+            def generate():
+                try:
+                    for number in range(3):
+                        yield f'{{"id": {number}}}\n' * 50
+                finally:
+                    self.closed.append(True)
+            return Response(generate(), mimetype="application/x-ndjson")
+
+        @self.app.route("/image")
+        def image():
+            return Response(b"x" * 1000, mimetype="image/png")
+
+    def test_gzip(self):
+        """It should gzip large responses for clients that accept it and make the ETag weak"""
+        response = self.app.test_client().get("/items/100", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        self.assertEqual(response.headers["ETag"], 'W/"v1"')
+        body = gzip.decompress(response.data)
+        self.assertEqual(body.count(b'"name"'), 100)
+        self.assertEqual(int(response.headers["Content-Length"]), len(response.data))
+        self.assertLess(len(response.data), len(body))
+
+    def test_small_response(self):
+        """It should send responses under the size threshold as they are"""
+        response = self.app.test_client().get("/items/1", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        self.assertEqual(response.headers["ETag"], '"v1"')
+
+    def test_not_accepted(self):
+        """It should not compress for clients that do not accept an encoding it has"""
+        client = self.app.test_client()
+        for accept in (None, "identity", "gzip;q=0", "compress"):
+            headers = {"Accept-Encoding": accept} if accept else {}
+            response = client.get("/items/100", headers=headers)
+            self.assertNotIn("Content-Encoding", response.headers, accept)
+            self.assertEqual(response.get_json()[99]["id"], 99)
+
+    def test_not_compressible(self):
+        """It should leave binary, HEAD and not modified responses alone"""
+        client = self.app.test_client()
+        headers = {"Accept-Encoding": "gzip"}
+        self.assertNotIn("Content-Encoding", client.get("/image", headers=headers).headers)
+        self.assertNotIn("Content-Encoding", client.head("/items/100", headers=headers).headers)
+        response = client.get("/items/100", headers={"Accept-Encoding": "gzip", "If-None-Match": '"v1"'})
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_stream(self):
+        """It should compress streamed responses chunk by chunk and close the original body"""
+        response = self.app.test_client().get("/stream", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Length", response.headers)
+        chunks = list(response.response)
+        response.close()
+        self.assertEqual(len(chunks), 4)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        # every chunk can be decompressed as soon as it arrives
+        self.assertEqual(decompressor.decompress(chunks[0]), b'{"id": 0}\n' * 50)
+        body = decompressor.decompress(b"".join(chunks[1:])) + decompressor.flush()
+        self.assertEqual(body, b'{"id": 1}\n' * 50 + b'{"id": 2}\n' * 50)
+        self.assertEqual(self.closed, [True])
+
+    def test_disabled(self):
+        """It should not register the hook when COMPRESS_RESPONSES is off"""
+        app = Flask(__name__)
+        app.config.update(COMPRESS_RESPONSES=False)
+        ResponseCompression().init_app(app)
+        self.assertEqual(app.after_request_funcs, {})
+
+    @skipUnless(brotli, "brotli is not installed")
+    def test_brotli(self):  # pragma: no cover
+        """It should prefer brotli when the client accepts it as much as gzip"""
+        response = self.app.test_client().get("/items/100", headers={"Accept-Encoding": "gzip, br"})
+        self.assertEqual(response.headers["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(response.data).count(b'"name"'), 100)
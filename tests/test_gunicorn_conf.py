@@ -0,0 +1,98 @@
+"""
+Test cases for the gunicorn configuration
+"""
+import os
+import importlib.util
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import patch, mock_open
+from wsgi import app
+from service import after_fork
+from service.models import db
+
+CONFIG_FILE = Path(__file__).resolve().parent.parent / "gunicorn.conf.py"
+
+
+def load_config(**env):
+    """Returns gunicorn.conf.py evaluated with the given environment variables"""
+    spec = importlib.util.spec_from_file_location("gunicorn_conf", CONFIG_FILE)
+    module = importlib.util.module_from_spec(spec)
+    with patch.dict(os.environ, env):
+        for name in ("GUNICORN_WORKERS", "WEB_CONCURRENCY", "GUNICORN_THREADS", "GUNICORN_WORKER_CLASS"):
+            if name not in env:
+                os.environ.pop(name, None)
+        spec.loader.exec_module(module)
+    return module
+
+
+class TestGunicornConfig(TestCase):
+    """Gunicorn Configuration Tests"""
+
+    def test_defaults(self):
+        """It should run preloaded gthread workers derived from the CPU count"""
+        conf = load_config(PORT="9000")
+        self.assertEqual(conf.worker_class, "gthread")
+        self.assertEqual(conf.workers, max(2, conf.cpu_count()))
+        self.assertEqual(conf.threads, 4)
+        self.assertTrue(conf.preload_app)
+        self.assertEqual(conf.bind, "0.0.0.0:9000")
+        self.assertEqual(conf.max_requests_jitter, conf.max_requests // 10)
+
+    def test_environment(self):
+        """It should take the settings from the environment"""
+        conf = load_config(GUNICORN_WORKER_CLASS="sync", GUNICORN_WORKERS="3", GUNICORN_PRELOAD="false",
+                           GUNICORN_KEEPALIVE="75", GUNICORN_BIND="127.0.0.1:8001")
+        self.assertEqual((conf.worker_class, conf.workers, conf.threads), ("sync", 3, 1))
+        self.assertFalse(conf.preload_app)
+        self.assertEqual(conf.keepalive, 75)
+        self.assertEqual(conf.bind, "127.0.0.1:8001")
+        self.assertEqual(load_config(WEB_CONCURRENCY="5").workers, 5)
+
+    def test_default_workers(self):
+        """It should run a worker per CPU when threaded and 2 * CPUs + 1 otherwise"""
+        conf = load_config()
+        self.assertEqual(conf.default_workers(1, True), 2)
+        self.assertEqual(conf.default_workers(8, True), 8)
+        self.assertEqual(conf.default_workers(2, False), 5)
+        self.assertEqual(conf.default_threads(True, 2), 2)
+        self.assertEqual(conf.default_threads(False, 20), 1)
+
+    def test_cpu_quota(self):
+        """It should count no more CPUs than the cgroup quota allows"""
+        conf = load_config()
+        with patch("os.sched_getaffinity", return_value={0, 1, 2, 3}):
+            with patch("builtins.open", mock_open(read_data="150000 100000\n")):
+                self.assertEqual(conf.cpu_count(), 2)
+            with patch("builtins.open", mock_open(read_data="20000 100000\n")):
+                self.assertEqual(conf.cpu_count(), 1)
+            with patch("builtins.open", mock_open(read_data="max 100000\n")):
+                self.assertEqual(conf.cpu_count(), 4)
+            with patch("builtins.open", side_effect=FileNotFoundError):
+                self.assertEqual(conf.cpu_count(), 4)
+
+    def test_post_fork(self):
+        """It should prepare the workers only when the app was preloaded"""
+        conf = load_config()
+        with patch("service.after_fork") as prepare:
+            conf.post_fork(SimpleNamespace(cfg=SimpleNamespace(preload_app=False)), None)
+            prepare.assert_not_called()
+            conf.post_fork(SimpleNamespace(cfg=SimpleNamespace(preload_app=True)), None)
+            prepare.assert_called_once_with(app)
+
+    def test_worker_exit(self):
+        """It should keep the metrics of an exiting worker"""
+        conf = load_config()
+        with patch("service.common.metrics.metrics.retire") as retire:
+            conf.worker_exit(None, None)
+        retire.assert_called_once_with()
+
+    def test_after_fork(self):
+        """It should give a forked worker new connection pools and a new log thread"""
+        with app.app_context():
+            pools = [engine.pool for engine in db.engines.values()]
+            with patch("service.common.log_handlers.restart_queue_listener") as restart:
+                after_fork(app)
+            restart.assert_called_once_with()
+            for engine, pool in zip(db.engines.values(), pools):
+                self.assertIsNot(engine.pool, pool)
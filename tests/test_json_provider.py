@@ -0,0 +1,54 @@
+"""
+Test cases for the JSON provider
+"""
+import json
+from datetime import datetime, timezone
+from unittest import TestCase, skipUnless
+from flask import Flask
+from service.common.json_provider import JSONProvider, orjson
+
+
+class TestJSONProvider(TestCase):
+    """JSON Provider Tests"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.json = JSONProvider(self.app)
+
+    @skipUnless(orjson, "orjson is not installed")
+    def test_orjson_matches_standard_library(self):
+        """It should encode the same values as the standard library"""
+        self.assertTrue(self.app.json.use_orjson)
+        data = {"b": [1, 2.5, None, True], "a": "café", "when": datetime(2024, 1, 2, tzinfo=timezone.utc)}
+        expected = json.loads(self.app.json.dumps(data, default=self.app.json.default, sort_keys=True))
+        self.assertEqual(json.loads(self.app.json.dumps(data)), expected)
+        self.assertEqual(expected["when"], "Tue, 02 Jan 2024 00:00:00 GMT")
+        self.assertEqual(list(json.loads(self.app.json.dumps(data))), ["a", "b", "when"])
+
+    def test_standard_library_encoder(self):
+        """It should use the standard library when configured to"""
+        self.app.config["JSON_ENCODER"] = "json"
+        provider = JSONProvider(self.app)
+        self.assertFalse(provider.use_orjson)
+        with self.app.app_context():
+            response = provider.response({"id": 1})
+        self.assertEqual(response.get_data(as_text=True), '{"id":1}\n')
+
+    def test_response(self):
+        """It should build compact responses, or indented ones in debug mode"""
+        with self.app.app_context():
+            response = self.app.json.response([{"id": 1}])
+            self.assertEqual(response.get_data(as_text=True), '[{"id":1}]\n')
+            self.assertEqual(response.mimetype, "application/json")
+            self.app.debug = True
+            response = self.app.json.response(id=1)
+            self.assertEqual(response.get_data(as_text=True), '{\n  "id": 1\n}\n')
+
+    def test_fallback(self):
+        """It should fall back to the standard library for what orjson cannot encode"""
+        with self.app.app_context():
+            response = self.app.json.response(big=2**70)
+        self.assertEqual(response.get_json(), {"big": 2**70})
+        self.assertEqual(self.app.json.dumps({"id": 1}, indent=4), '{\n    "id": 1\n}')
+        self.assertEqual(json.loads(self.app.json.dumps({1: "one"})), {"1": "one"})
+        self.assertRaises(TypeError, self.app.json.dumps, {"bad": object()})
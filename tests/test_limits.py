@@ -0,0 +1,191 @@
+"""
+Test cases for the rate limits and load shedding
+"""
+import time
+import threading
+from unittest import TestCase
+from flask import Flask, jsonify, request
+from service.common.limits import (
+    ConcurrencyLimiter, MemoryBuckets, RateLimitBackend, RequestLimiter, SharedBuckets,
+)
+from service.common.metrics import Registry
+from tests.fakes import FakeClock, FakeRedis
+
+
+class TestMemoryBuckets(TestCase):
+    """Memory Token Bucket Tests"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.buckets = MemoryBuckets(maxsize=2, clock=self.clock)
+
+    def test_burst_then_rate(self):
+        """It should allow a burst, then one request per token gained"""
+        self.assertEqual([self.buckets.take("a", 2, 3) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(self.buckets.take("a", 2, 3), 0.5)
+        self.clock.now = 0.25
+        self.assertAlmostEqual(self.buckets.take("a", 2, 3), 0.25)
+        self.clock.now = 0.5
+        self.assertEqual(self.buckets.take("a", 2, 3), 0)
+        self.assertAlmostEqual(self.buckets.take("a", 2, 3), 0.5)
+        self.clock.now = 60
+        self.assertEqual([self.buckets.take("a", 2, 3) for _ in range(3)], [0, 0, 0])
+
+    def test_keys(self):
+        """It should keep a bucket per key and forget the least recently used ones"""
+        self.assertEqual(self.buckets.take("a", 1, 1), 0)
+        self.assertEqual(self.buckets.take("b", 1, 1), 0)
+        self.assertEqual(self.buckets.take("a", 1, 1), 1)
+        self.assertEqual(self.buckets.take("c", 1, 1), 0)
+        # b was forgotten and is full again
+        self.assertEqual(self.buckets.take("b", 1, 1), 0)
+
+    def test_backend_interface(self):
+        """It should require backends to implement take()"""
+        self.assertRaises(NotImplementedError, RateLimitBackend().take, "a", 1, 1)
+
+
+class TestSharedBuckets(TestCase):
+    """Shared Token Bucket Tests"""
+
+    def test_take(self):
+        """It should update the bucket with one script call and parse the wait"""
+        client = FakeRedis("0.25")
+        buckets = SharedBuckets(client, prefix="test:")
+        self.assertEqual(buckets.take("10.0.0.1|list_employees", 4, 8), 0.25)
+        script, numkeys, key, rate, burst = client.calls[0]
+        self.assertIn("redis.call('TIME')", script)
+        self.assertEqual((numkeys, key, rate, burst), (1, "test:10.0.0.1|list_employees", 4, 8))
+        client.wait = "0"
+        self.assertEqual(buckets.take("a", 4, 8), 0)
+
+
+class TestConcurrencyLimiter(TestCase):
+    """Concurrency Limiter Tests"""
+
+    def test_limit(self):
+        """It should let limit callers in and turn the others away when nobody may wait"""
+        limiter = ConcurrencyLimiter(2)
+        self.assertTrue(limiter.acquire())
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire())
+        self.assertEqual(limiter.active, 2)
+        limiter.release()
+        self.assertTrue(limiter.acquire())
+
+    def test_queue(self):
+        """It should let queue_size callers wait for a slot and turn the others away at once"""
+        limiter = ConcurrencyLimiter(1, queue_size=1, timeout=5)
+        limiter.acquire()
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(limiter.acquire()))
+        waiter.start()
+        deadline = time.monotonic() + 5
+        while limiter.waiting == 0 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        self.assertEqual(limiter.waiting, 1)
+        start = time.monotonic()
+        self.assertFalse(limiter.acquire())
+        self.assertLess(time.monotonic() - start, 1)
+        limiter.release()
+        waiter.join()
+        self.assertEqual(results, [True])
+        self.assertEqual((limiter.active, limiter.waiting), (1, 0))
+
+    def test_timeout(self):
+        """It should give up waiting after the timeout"""
+        limiter = ConcurrencyLimiter(1, queue_size=1, timeout=0.01)
+        limiter.acquire()
+        self.assertFalse(limiter.acquire())
+        self.assertEqual(limiter.waiting, 0)
+
+
+class TestRequestLimiter(TestCase):
+    """Request Limiter Hook Tests"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config.update(
+            RATE_LIMIT_PER_SECOND=1, RATE_LIMIT_BURST=2, RATE_LIMIT_CLIENT_HEADER="X-Client-Id",
+            CONCURRENCY_LIMIT=1, CONCURRENCY_QUEUE=0,
+        )
+        self.clock = FakeClock()
+        self.limiter = RequestLimiter()
+        self.limiter.init_app(self.app, MemoryBuckets(clock=self.clock))
+
+        @self.app.route("/work")
+        @self.limiter.uses_database
+        def work():
+            return jsonify(active=self.limiter.concurrency.active)
+
+        @self.app.route("/lazy")
+        def lazy():
+            active = self.limiter.concurrency.active
+            if request.args.get("miss"):
+                self.limiter.use_database()
+                self.limiter.use_database()
+            return jsonify(before=active, after=self.limiter.concurrency.active)
+
+        @self.app.route("/health")
+        @self.limiter.exempt
+        def health():
+            return jsonify(status="ok")
+
+    def test_rate_limit(self):
+        """It should answer 429 with Retry-After to each client past its own bucket"""
+        client = self.app.test_client()
+        for _ in range(2):
+            self.assertEqual(client.get("/work").status_code, 200)
+        response = client.get("/work")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual(client.get("/work", headers={"X-Client-Id": "other"}).status_code, 200)
+        self.clock.now = 1
+        self.assertEqual(client.get("/work").status_code, 200)
+
+    def test_exempt(self):
+        """It should never limit exempt views or unknown URLs"""
+        self.limiter.concurrency.acquire()
+        client = self.app.test_client()
+        for _ in range(5):
+            self.assertEqual(client.get("/health").status_code, 200)
+            self.assertEqual(client.get("/missing").status_code, 404)
+
+    def test_concurrency(self):
+        """It should hold a slot for the length of a request and shed requests when none is free"""
+        client = self.app.test_client()
+        self.assertEqual(client.get("/work").get_json(), {"active": 1})
+        self.assertEqual(self.limiter.concurrency.active, 0)
+        self.limiter.concurrency.acquire()
+        response = client.get("/work")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+
+    def test_use_database(self):
+        """It should hold a slot only once a view uses the database, and hold one slot however often it asks"""
+        client = self.app.test_client()
+        self.assertEqual(client.get("/lazy").get_json(), {"before": 0, "after": 0})
+        self.assertEqual(client.get("/lazy?miss=1", headers={"X-Client-Id": "other"}).get_json(), {"before": 0, "after": 1})
+        self.assertEqual(self.limiter.concurrency.active, 0)
+        self.limiter.concurrency.acquire()
+        self.clock.now = 10
+        self.assertEqual(client.get("/lazy").status_code, 200)
+        self.assertEqual(client.get("/lazy?miss=1").status_code, 503)
+
+    def test_collect(self):
+        """It should report the requests using the database and waiting for it"""
+        registry = Registry()
+        self.limiter.concurrency.acquire()
+        self.limiter.collect(registry)
+        self.assertEqual(registry.samples[("http_requests_db_active", ())], 1)
+        self.assertEqual(registry.samples[("http_requests_db_waiting", ())], 0)
+
+    def test_disabled(self):
+        """It should let everything through when both limits are off"""
+        app = Flask(__name__)
+        limiter = RequestLimiter()
+        limiter.init_app(app)
+        app.add_url_rule("/work", "work", lambda: "ok")
+        client = app.test_client()
+        self.assertEqual([client.get("/work").status_code for _ in range(5)], [200] * 5)
+        self.assertIsNone(limiter.concurrency)
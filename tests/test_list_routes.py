@@ -0,0 +1,184 @@
+"""
+Test routes for listing and streaming Employees
+"""
+import gzip
+import json
+from wsgi import app
+from service.common import status
+from service.models import Employee, page_cursor
+from tests.test_routes import BASE_URL, TestCaseBase
+
+
+class TestEmployeeListService(TestCaseBase):
+    """Employee List Server Tests"""
+
+    def test_get_employee_list_paginated(self):
+        """It should Get a list of Employees one page at a time"""
+        employees = self._create_employees(5)
+        response = self.client.get(BASE_URL, query_string={"limit": 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual([row["id"] for row in data], [employee.id for employee in employees[:2]])
+        self.assertEqual(response.headers["X-Next-Cursor"], page_cursor([employees[1].id]))
+        self.assertIn('rel="next"', response.headers["Link"])
+        response = self.client.get(BASE_URL, query_string={"limit": 2, "cursor": response.headers["X-Next-Cursor"]})
+        self.assertEqual([row["id"] for row in response.get_json()], [employee.id for employee in employees[2:4]])
+
+        # an id is still a cursor of the id order
+        response = self.client.get(BASE_URL, query_string={"limit": 2, "after_id": employees[3].id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual([row["id"] for row in data], [employees[4].id])
+        self.assertNotIn("Link", response.headers)
+        self.assertNotIn("X-Next-Cursor", response.headers)
+
+    def test_get_employee_list_bad_limit(self):
+        """It should not Get a list of Employees with a bad limit"""
+        response = self.client.get(BASE_URL, query_string={"limit": "ten"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(BASE_URL, query_string={"limit": 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_employee_list_filtered(self):
+        """It should Get only the Employees that match the query"""
+        employees = self._create_employees(6)
+        department = employees[0].department
+        response = self.client.get(BASE_URL, query_string={"department": department, "fields": "first_name,department"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        expected = [employee for employee in employees if employee.department == department]
+        self.assertEqual(data, [{"first_name": row.first_name, "department": department} for row in expected])
+
+    def test_get_employee_list_sorted(self):
+        """It should Get pages of Employees sorted on a field"""
+        employees = self._create_employees(5)
+        expected = sorted(employees, key=lambda employee: (employee.last_name, employee.id))
+        response = self.client.get(BASE_URL, query_string={"sort": "last_name", "limit": 3})
+        self.assertEqual([row["id"] for row in response.get_json()], [employee.id for employee in expected[:3]])
+        response = self.client.get(response.headers["Link"].split(";")[0].strip("<>"))
+        self.assertEqual([row["id"] for row in response.get_json()], [employee.id for employee in expected[3:]])
+
+    def test_get_employee_list_sorted_cursor_deleted(self):
+        """It should keep paging in the sort order after the last Employee of a page is deleted"""
+        employees = self._create_employees(5)
+        expected = sorted(employees, key=lambda employee: (employee.last_name, employee.id))
+        response = self.client.get(BASE_URL, query_string={"sort": "last_name", "limit": 2, "fields": "first_name"})
+        self.assertEqual(response.get_json(), [{"first_name": employee.first_name} for employee in expected[:2]])
+        self.client.delete(f"{BASE_URL}/{expected[1].id}")
+        response = self.client.get(response.headers["Link"].split(";")[0].strip("<>"))
+        self.assertEqual(response.get_json(), [{"first_name": employee.first_name} for employee in expected[2:4]])
+        self.assertIn('rel="next"', response.headers["Link"])
+
+    def test_get_employee_list_bad_cursor(self):
+        """It should not Get a list of Employees with a cursor that does not fit the sort"""
+        employees = self._create_employees(1)
+        for query in ({"cursor": "bogus"}, {"cursor": page_cursor([employees[0].id]), "sort": "last_name"},
+                      {"after_id": employees[0].id, "sort": "last_name"}):
+            response = self.client.get(BASE_URL, query_string=query)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_employee_list_bad_query(self):
+        """It should not Get a list of Employees with an unknown field or gender"""
+        response = self.client.get(BASE_URL, query_string={"sort": "salary"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(BASE_URL, query_string={"fields": "id,salary"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(BASE_URL, query_string={"gender": "robot"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        for query in ({"fields": "bogus"}, {"sort": "bogus"}, {"gender": "xx"}):
+            response = self.client.get(BASE_URL, query_string=dict(query, stream="true"))
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_stream_employee_list(self):
+        """It should Stream the list of Employees as a JSON array"""
+        response = self.client.get(BASE_URL, query_string={"stream": "true"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), [])
+
+        employees = self._create_employees(3)
+        app.config["STREAM_BATCH_SIZE"] = 2
+        try:
+            response = self.client.get(BASE_URL, query_string={"stream": "true"})
+        finally:
+            app.config["STREAM_BATCH_SIZE"] = 1000
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.mimetype, "application/json")
+        data = response.get_json()
+        self.assertEqual([row["id"] for row in data], [employee.id for employee in employees])
+
+    def test_stream_employee_list_projected(self):
+        """It should Stream only the requested fields of the Employees"""
+        employees = self._create_employees(2)
+        response = self.client.get(BASE_URL, query_string={"stream": "true", "fields": "last_name"})
+        self.assertEqual(response.get_json(), [{"last_name": employee.last_name} for employee in employees])
+
+    def test_stream_employee_list_ndjson(self):
+        """It should Stream the list of Employees as NDJSON"""
+        employees = self._create_employees(3)
+        response = self.client.get(
+            BASE_URL, query_string={"stream": "true"}, headers={"Accept": "application/x-ndjson"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line)["id"] for line in lines], [employee.id for employee in employees])
+
+    def test_get_employee_list_ndjson(self):
+        """It should Get a page of Employees as NDJSON"""
+        employees = self._create_employees(3)
+        response = self.client.get(BASE_URL, query_string={"limit": 2}, headers={"Accept": "application/x-ndjson"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line)["id"] for line in lines], [employee.id for employee in employees[:2]])
+        self.assertIn('rel="next"', response.headers["Link"])
+
+    def test_get_employee_list_columnar(self):
+        """It should Get a page of Employees as one array per field"""
+        employees = self._create_employees(3)
+        headers = {"Accept": "application/vnd.columnar+json"}
+        response = self.client.get(BASE_URL, headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.mimetype, "application/vnd.columnar+json")
+        data = json.loads(response.data)
+        self.assertEqual(sorted(data), sorted(Employee.FIELDS))
+        self.assertEqual(data["id"], [employee.id for employee in employees])
+        self.assertEqual(data["last_name"], [employee.last_name for employee in employees])
+
+        response = self.client.get(BASE_URL, query_string={"fields": "first_name"}, headers=headers)
+        self.assertEqual(json.loads(response.data), {"first_name": [employee.first_name for employee in employees]})
+        response = self.client.get(BASE_URL, query_string={"after_id": employees[-1].id, "fields": "gender"}, headers=headers)
+        self.assertEqual(json.loads(response.data), {"gender": []})
+
+    def test_get_employee_list_compressed(self):
+        """It should gzip large pages of Employees for clients that accept it"""
+        employees = self._create_employees(30)
+        response = self.client.get(BASE_URL, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        data = json.loads(gzip.decompress(response.data))
+        self.assertEqual([row["id"] for row in data], [employee.id for employee in employees])
+        # the weak ETag still matches the list
+        response = self.client.get(BASE_URL, headers={"Accept-Encoding": "gzip", "If-None-Match": response.headers["ETag"]})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_get_employee_list_not_modified(self):
+        """It should answer 304 Not Modified until the employee list changes"""
+        self._create_employees(2)
+        response = self.client.get(BASE_URL)
+        etag = response.headers["ETag"]
+        response = self.client.get(BASE_URL, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(BASE_URL, query_string={"limit": 1}, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(BASE_URL, query_string={"stream": "true"})
+        self.assertIn("ETag", response.headers)
+        self._create_employees(1)
+        response = self.client.get(BASE_URL, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # an update within the same second changes it too
+        etag = self.client.get(BASE_URL).headers["ETag"]
+        employee = self.client.get(BASE_URL).get_json()[0]
+        self.client.put(f"{BASE_URL}/{employee['id']}", json=dict(employee, department="Legal"))
+        response = self.client.get(BASE_URL, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
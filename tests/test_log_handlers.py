@@ -0,0 +1,134 @@
+"""
+Test cases for the JSON log pipeline
+"""
+import sys
+import json
+import logging
+from unittest import TestCase
+from flask import Flask
+from service.common import log_handlers
+from service.common.log_handlers import JsonFormatter, init_logging, stop_queue_listener
+
+
+class ListHandler(logging.Handler):
+    """Keeps the formatted records in a list"""
+
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+class TestJsonFormatter(TestCase):
+    """JSON Formatter Tests"""
+
+    def test_format(self):
+        """It should format the message and the extra fields as JSON"""
+        record = logging.makeLogRecord({"msg": "hello %s", "args": ("world",), "levelname": "INFO", "route": "/"})
+        data = json.loads(JsonFormatter().format(record))
+        self.assertEqual(data["message"], "hello world")
+        self.assertEqual(data["level"], "INFO")
+        self.assertEqual(data["route"], "/")
+        self.assertNotIn("args", data)
+
+    def test_format_exception(self):
+        """It should include the traceback of exceptions"""
+        record = logging.makeLogRecord({"msg": "failed"})
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            record.exc_info = sys.exc_info()
+        data = json.loads(JsonFormatter().format(record))
+        self.assertEqual(data["message"], "failed")
+        self.assertIn("ValueError: boom", data["exception"])
+
+
+class TestRequestLogging(TestCase):
+    """Request Summary Logging Tests"""
+
+    def setUp(self):
+        self.models_logger = logging.getLogger("flask.app")
+        self.saved = (self.models_logger.handlers, self.models_logger.level, self.models_logger.propagate)
+        self.handler = ListHandler()
+        gunicorn_logger = logging.getLogger("test.gunicorn")
+        gunicorn_logger.handlers = [self.handler]
+
+    def tearDown(self):
+        stop_queue_listener()
+        self.models_logger.handlers, self.models_logger.level, self.models_logger.propagate = self.saved
+
+    def make_app(self, **config):
+        """Returns an app with a few routes and the logging set up with config"""
+        app = Flask("logging_test")
+        app.config.update({"LOGGING_LEVEL": logging.INFO, **config})
+
+        @app.route("/ok/<int:number>", methods=["POST"])
+        def ok(number):  # pylint: disable=unused-variable
+            app.logger.debug("Processing: %s", number)
+            return {"number": number}
+
+        @app.route("/fail")
+        def fail():  # pylint: disable=unused-variable
+            return {"error": "fail"}, 500
+
+        init_logging(app, "test.gunicorn")
+        return app
+
+    def test_summary_line(self):
+        """It should write one JSON summary line per request through the queue"""
+        client = self.make_app().test_client()
+        client.post("/ok/7", json={"secret": "payload"})
+        stop_queue_listener()
+        lines = [json.loads(line) for line in self.handler.lines]
+        summary = lines[-1]
+        self.assertEqual(summary["message"], "POST /ok/<int:number> 200")
+        self.assertEqual(summary["route"], "/ok/<int:number>")
+        self.assertEqual(summary["status"], 200)
+        self.assertEqual(summary["db_queries"], 0)
+        self.assertNotIn("payload", "".join(self.handler.lines))
+
+    def test_restart_listener(self):
+        """It should start a new log thread after a fork and leave the inherited records to the parent"""
+        client = self.make_app().test_client()
+        inherited = log_handlers._listener  # pylint: disable=protected-access
+        inherited.stop()
+        inherited.queue.put(logging.makeLogRecord({"msg": "written by the parent"}))
+        log_handlers.restart_queue_listener()
+        client.post("/ok/2")
+        stop_queue_listener()
+        self.assertNotIn("written by the parent", "".join(self.handler.lines))
+        self.assertEqual(json.loads(self.handler.lines[-1])["message"], "POST /ok/<int:number> 200")
+
+    def test_sampling(self):
+        """It should sample successful requests but always log failures"""
+        client = self.make_app(LOG_SAMPLE_RATE=0.0).test_client()
+        client.post("/ok/1")
+        client.get("/missing")
+        client.get("/fail")
+        stop_queue_listener()
+        lines = [json.loads(line) for line in self.handler.lines]
+        self.assertEqual([line["status"] for line in lines if "status" in line], [404, 500])
+        self.assertEqual(lines[-1]["level"], "WARNING")
+
+    def test_text_without_queue(self):
+        """It should write text lines straight to the handlers when the queue is off"""
+        app = self.make_app(LOG_FORMAT="text", LOG_QUEUE=False)
+        self.assertEqual(app.logger.handlers, [self.handler])
+        app.test_client().post("/ok/3")
+        self.assertIn("[INFO] [log_handlers] POST /ok/<int:number> 200", self.handler.lines[-1])
+
+    def test_debug_payload(self):
+        """It should log payloads only when the level is DEBUG"""
+        app = self.make_app(LOGGING_LEVEL=logging.DEBUG, LOG_QUEUE=False)
+        app.test_client().post("/ok/42")
+        self.assertTrue(any("Processing: 42" in line for line in self.handler.lines))
+
+    def test_level(self):
+        """It should not build summary lines below the level of the logger"""
+        app = self.make_app(LOGGING_LEVEL=logging.WARNING, LOG_QUEUE=False)
+        app.test_client().post("/ok/1")
+        app.test_client().get("/fail")
+        self.assertEqual(len(self.handler.lines), 1)
+        self.assertIn('"status": 500', self.handler.lines[0])
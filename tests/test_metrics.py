@@ -0,0 +1,135 @@
+"""
+Test cases for the Prometheus metrics
+"""
+import os
+import json
+import tempfile
+from unittest import TestCase
+from flask import Flask, jsonify
+from sqlalchemy import create_engine, text
+from service.common.metrics import Metrics, Registry, merge, render
+
+
+class TestRegistry(TestCase):
+    """Metric Registry Tests"""
+
+    def test_counter_and_gauge(self):
+        """It should render counters and gauges with their labels"""
+        registry = Registry()
+        registry.inc("http_requests_total", {"endpoint": "index", "method": "GET", "status": "200"})
+        registry.inc("http_requests_total", {"endpoint": "index", "method": "GET", "status": "200"})
+        registry.set("db_pool_checked_out", value=3)
+        output = render(merge([(True, registry.dump())]))
+        self.assertIn("# TYPE http_requests_total counter", output)
+        self.assertIn('http_requests_total{endpoint="index",method="GET",status="200"} 2.0', output)
+        self.assertIn("db_pool_checked_out 3.0", output)
+        self.assertNotIn("cache_hits_total", output)
+
+    def test_histogram(self):
+        """It should render cumulative histogram buckets, the sum and the count"""
+        registry = Registry()
+        for value in (0, 2, 500):
+            registry.observe("http_request_db_queries", {"endpoint": "list"}, value)
+        output = render(merge([(True, registry.dump())]))
+        self.assertIn('http_request_db_queries_bucket{endpoint="list",le="0.0"} 1', output)
+        self.assertIn('http_request_db_queries_bucket{endpoint="list",le="2.0"} 2', output)
+        self.assertIn('http_request_db_queries_bucket{endpoint="list",le="+Inf"} 3', output)
+        self.assertIn('http_request_db_queries_sum{endpoint="list"} 502.0', output)
+        self.assertIn('http_request_db_queries_count{endpoint="list"} 3', output)
+
+    def test_merge_processes(self):
+        """It should add up every process but ignore the gauges of dead ones"""
+        first, second = Registry(), Registry()
+        for registry in (first, second):
+            registry.inc("http_requests_in_progress")
+            registry.inc("cache_hits_total", amount=2)
+            registry.observe("http_request_db_seconds", {"endpoint": "list"}, 0.002)
+        registry.inc("unknown_metric")
+        samples = merge([(True, first.dump()), (False, json.loads(json.dumps(second.dump())))])
+        self.assertEqual(samples[("http_requests_in_progress", ())], 1.0)
+        self.assertEqual(samples[("cache_hits_total", ())], 4.0)
+        self.assertEqual(sum(samples[("http_request_db_seconds", (("endpoint", "list"),))][:-1]), 2)
+        self.assertNotIn(("unknown_metric", ()), samples)
+
+    def test_escape_labels(self):
+        """It should escape quotes, backslashes and newlines in label values"""
+        registry = Registry()
+        registry.inc("http_requests_total", {"endpoint": 'a"b\\c\nd'})
+        registry.clear()
+        registry.inc("http_requests_total", {"endpoint": 'a"b\\c\nd'})
+        self.assertIn('endpoint="a\\"b\\\\c\\nd"', render(merge([(True, registry.dump())])))
+
+
+class TestMetricsHooks(TestCase):
+    """Metrics Request Hook Tests"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.engine = create_engine("sqlite://")
+        self.app = Flask(__name__)
+        self.app.config["PROMETHEUS_MULTIPROC_DIR"] = self.directory.name
+        self.app.config["METRICS_FLUSH_INTERVAL"] = 0
+        self.metrics = Metrics()
+        self.metrics.init_app(self.app, self.engine)
+
+        @self.app.route("/query")
+        def query():
+            with self.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+                connection.execute(text("SELECT 2"))
+            self.metrics.observe_serialization(0.5)
+            return jsonify(ok=True)
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def test_request_metrics(self):
+        """It should count requests, queries and serialization time in every worker"""
+        client = self.app.test_client()
+        self.assertEqual(client.get("/query").status_code, 200)
+        self.assertEqual(client.get("/missing").status_code, 404)
+        # a worker that has exited leaves its counters but not its gauges behind
+        with open(os.path.join(self.directory.name, "metrics-999999999.json"), "w", encoding="utf-8") as file:
+            dead = Registry()
+            dead.inc("http_requests_in_progress")
+            dead.inc("http_requests_total", {"endpoint": "query", "method": "GET", "status": "200"})
+            json.dump({"pid": 999999999, "samples": dead.dump()}, file)
+
+        output = self.metrics.report()
+        self.assertIn('http_requests_total{endpoint="query",method="GET",status="200"} 2.0', output)
+        self.assertIn('http_requests_total{endpoint="none",method="GET",status="404"} 1.0', output)
+        self.assertIn('http_request_db_queries_sum{endpoint="query"} 2.0', output)
+        self.assertIn('http_request_serialization_seconds_sum{endpoint="query"} 0.5', output)
+        self.assertIn("http_requests_in_progress 0.0", output)
+        self.assertIn("db_pool_checkouts_total", output)
+        self.assertIn("cache_hits_total", output)
+        # and its file is folded into the one of exited workers
+        self.assertEqual(sorted(os.listdir(self.directory.name)),
+                         [f"metrics-{os.getpid()}.json", "metrics-exited.json", "metrics.lock"])
+        self.assertEqual(self.metrics.report(), output)
+
+    def test_retire(self):
+        """It should keep the counters of exited workers in one file"""
+        client = self.app.test_client()
+        client.get("/query")
+        self.metrics.retire()
+        self.metrics.registry.clear()
+        client.get("/query")
+        self.metrics.retire()
+        self.metrics.registry.clear()
+        self.assertEqual(sorted(os.listdir(self.directory.name)), ["metrics-exited.json", "metrics.lock"])
+        with open(os.path.join(self.directory.name, "metrics-exited.json"), encoding="utf-8") as file:
+            names = {name for name, _, _ in json.load(file)["samples"]}
+        self.assertNotIn("http_requests_in_progress", names)
+        output = self.metrics.report()
+        self.assertIn('http_requests_total{endpoint="query",method="GET",status="200"} 2.0', output)
+        self.metrics.directory = None
+        self.metrics.retire()
+
+    def test_single_process(self):
+        """It should report only this process when there is no multiprocess directory"""
+        self.metrics.directory = None
+        self.app.test_client().get("/query")
+        self.assertIn('http_requests_total{endpoint="query",method="GET",status="200"} 1.0', self.metrics.report())
+        self.assertEqual(os.listdir(self.directory.name), [])
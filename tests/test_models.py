@@ -2,11 +2,18 @@
 Test cases for Employee Model
 """
 import os
+import json
 import logging
-from unittest import TestCase
+from datetime import datetime, timedelta
+from unittest import TestCase, skipUnless
 from unittest.mock import patch  # noqa: F401
+from sqlalchemy.dialects import postgresql
 from wsgi import app
-from service.models import Employee, Gender, DataValidationError, db
+from service.models import (
+    Employee, EmployeeTombstone, Gender, DataValidationError, IdempotencyKey, TableVersion, db, init_db, database_now,
+    changes_horizon, make_etag, page_cursor,
+)
+from service.common.cache import cache
 from tests.factories import EmployeeFactory
 
 DATABASE_URI = os.getenv(
@@ -24,6 +31,7 @@ class TestCaseBase(TestCase):
         app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
         app.logger.setLevel(logging.CRITICAL)
         app.app_context().push()
+        db.create_all()
 
     @classmethod
     def tearDownClass(cls):
@@ -31,7 +39,10 @@ class TestCaseBase(TestCase):
 
     def setUp(self):
         db.session.query(Employee).delete()
+        db.session.query(EmployeeTombstone).delete()
+        db.session.query(IdempotencyKey).delete()
         db.session.commit()
+        cache.clear()
 
     def tearDown(self):
         db.session.remove()
@@ -39,6 +50,13 @@ class TestCaseBase(TestCase):
 
 class TestEmployeeModel(TestCaseBase):
     """Employee Model CRUD Tests"""
+    def test_init_db(self):
+        """It should create only the missing tables"""
+        employee = EmployeeFactory()
+        employee.create()
+        init_db()
+        self.assertEqual(Employee.find(employee.id).id, employee.id)
+
     def test_create_an_employee(self):
         """It should Create an employee and assert that it exists"""
         employee = Employee(first_name="John", last_name="Daniel", gender=Gender.MALE, department="Engineering")
@@ -88,7 +106,7 @@ class TestEmployeeModel(TestCaseBase):
         self.assertRaises(DataValidationError, employee.update)
 
 
-class TestModelQueries(TestCaseBase):
+class TestModelQueries(TestCaseBase):  # pylint: disable=too-many-public-methods
     """Employee Model Query Tests"""
 
     def test_find_employee(self):
@@ -108,6 +126,304 @@ class TestModelQueries(TestCaseBase):
         self.assertEqual(employee.department, employees[1].department)
         self.assertEqual(employee.gender, employees[1].gender)
 
+    def test_find_page(self):
+        """It should find a page of Employees after an ID"""
+        employees = EmployeeFactory.create_batch(5)
+        for employee in employees:
+            employee.create()
+        page = Employee.find_page(2)
+        self.assertEqual(page, [employee.serialize() for employee in employees[:2]])
+        page = Employee.find_page(10, page_cursor([employees[2].id]))
+        self.assertEqual([row["id"] for row in page], [employee.id for employee in employees[3:]])
+
+    def test_find_page_filtered(self):
+        """It should find a page of Employees matching filters"""
+        for first_name, last_name, department, gender in [
+            ("Ann", "Smith", "HR", Gender.FEMALE),
+            ("Bob", "Smithers", "HR", Gender.MALE),
+            ("Cat", "Jones", "HR", Gender.FEMALE),
+            ("Dan", "Smith_", "Finance", Gender.MALE),
+        ]:
+            Employee(first_name=first_name, last_name=last_name, department=department, gender=gender).create()
+        page = Employee.find_page(10, filters={"department": "HR", "gender": "female"})
+        self.assertEqual([row["first_name"] for row in page], ["Ann", "Cat"])
+        page = Employee.find_page(10, filters={"last_name": "Smith"})
+        self.assertEqual([row["first_name"] for row in page], ["Ann", "Bob", "Dan"])
+        page = Employee.find_page(10, filters={"last_name": "Smith_"})
+        self.assertEqual([row["first_name"] for row in page], ["Dan"])
+        self.assertRaises(DataValidationError, Employee.find_page, 10, filters={"gender": "other"})
+
+    def test_find_page_sorted(self):
+        """It should find pages of Employees sorted on any field"""
+        for first_name, last_name in [("Ann", "Young"), ("Bob", "Adams"), ("Cat", "Young"), ("Dan", "Adams")]:
+            Employee(first_name=first_name, last_name=last_name, department="HR", gender=Gender.UNKNOWN).create()
+        page = Employee.find_page(10, sort=["last_name", "-first_name"], fields=["first_name"])
+        self.assertEqual([row["first_name"] for row in page], ["Dan", "Bob", "Cat", "Ann"])
+        # the sort fields are selected too, to make the cursor of the next page
+        self.assertEqual(set(page[0]), {"id", "first_name", "last_name"})
+        # page through the same order with the keyset cursor
+        sort = ["last_name", "-first_name"]
+        page = Employee.find_page(2, sort=sort)
+        page = Employee.find_page(2, Employee.page_cursor(page[-1], sort), sort=sort)
+        self.assertEqual([row["first_name"] for row in page], ["Cat", "Ann"])
+        page = Employee.find_page(10, page_cursor([page[0]["id"]]), sort=["-id"])
+        self.assertEqual([row["first_name"] for row in page], ["Bob", "Ann"])
+        self.assertRaises(DataValidationError, Employee.find_page, 10, sort=["salary"])
+
+    def test_find_page_cursor(self):
+        """It should page on the sort values in the cursor, even when that Employee is gone"""
+        for first_name, last_name, gender in [("Ann", "Young", Gender.FEMALE), ("Bob", "Adams", Gender.MALE),
+                                              ("Cat", "Moore", Gender.FEMALE), ("Dan", "Brown", Gender.UNKNOWN)]:
+            Employee(first_name=first_name, last_name=last_name, department="HR", gender=gender).create()
+        page = Employee.find_page(2, sort=["last_name"])
+        cursor = Employee.page_cursor(page[-1], ["last_name"])
+        Employee.find(page[-1]["id"]).delete()
+        page = Employee.find_page(10, cursor, sort=["last_name"])
+        self.assertEqual([row["first_name"] for row in page], ["Cat", "Ann"])
+        # the database decides how genders sort, so page through them and compare with one page
+        everyone = Employee.find_page(10, sort=["gender"])
+        page = Employee.find_page(1, sort=["gender"])
+        page += Employee.find_page(10, Employee.page_cursor(page[-1], ["gender"]), sort=["gender"])
+        self.assertEqual(page, everyone)
+        for cursor in ("!", page_cursor({"id": 1}), page_cursor([1]), page_cursor(["Adams", True]),
+                       page_cursor([1, 2])):
+            self.assertRaises(DataValidationError, Employee.find_page, 10, cursor, sort=["last_name"])
+        self.assertRaises(DataValidationError, Employee.find_page, 10, page_cursor(["ROBOT", 1]), sort=["gender"])
+
+    def test_stream(self):
+        """It should stream all Employees in id order"""
+        employees = EmployeeFactory.create_batch(5)
+        for employee in employees:
+            employee.create()
+        batches = list(Employee.stream(batch_size=2))
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        streamed = [row for batch in batches for row in batch]
+        self.assertEqual(streamed, [employee.serialize() for employee in employees])
+
+    def test_bulk_create(self):
+        """It should create many Employees in one transaction"""
+        employees = EmployeeFactory.build_batch(5)
+        ids = Employee.bulk_create(employees, chunk_size=2)
+        self.assertEqual(len(ids), 5)
+        self.assertEqual([employee.id for employee in employees], ids)
+        self.assertEqual(Employee.find(ids[3]).last_name, employees[3].last_name)
+
+    def test_bulk_update(self):
+        """It should update many Employees and report the ids found"""
+        employees = EmployeeFactory.build_batch(3)
+        Employee.bulk_create(employees)
+        for employee in employees:
+            employee.department = "HR"
+        missing = EmployeeFactory(id=0)
+        updated = Employee.bulk_update(employees + [missing], chunk_size=2)
+        self.assertEqual(updated, {employee.id for employee in employees})
+        db.session.expire_all()
+        self.assertTrue(all(employee.department == "HR" for employee in Employee.all()))
+
+    def test_bulk_delete(self):
+        """It should delete many Employees and report the ids found"""
+        employees = EmployeeFactory.build_batch(3)
+        ids = Employee.bulk_create(employees)
+        deleted = Employee.bulk_delete([ids[0], ids[1], 0], chunk_size=2)
+        self.assertEqual(deleted, {ids[0], ids[1]})
+        self.assertEqual([employee.id for employee in Employee.all()], [ids[2]])
+
+    def test_changes(self):
+        """It should list the changes after a watermark, with tombstones for deletions"""
+        employees = EmployeeFactory.build_batch(3)
+        Employee.bulk_create(employees)
+        changes = Employee.changes()
+        self.assertEqual([change["id"] for change in changes], [employee.id for employee in employees])
+        self.assertEqual(changes[0]["gender"], employees[0].gender.name)
+        last = changes[0]
+        since = (last["changed_at"], 0, last["id"])
+        Employee.find(employees[1].id).delete()
+        changes = Employee.changes(since, until=database_now())
+        self.assertEqual([(change["id"], change["deleted"]) for change in changes],
+                         [(employees[2].id, False), (employees[1].id, True)])
+        self.assertEqual(Employee.changes(since, limit=1)[0]["id"], employees[2].id)
+
+    def test_changes_horizon(self):
+        """It should hold back the changes younger than the settle time"""
+        self.assertLessEqual(changes_horizon(3600), database_now() - timedelta(seconds=3600))
+
+    @skipUnless(DATABASE_URI.startswith("postgresql"), "SQLite stamps rows when they are written")
+    def test_changes_horizon_open_transaction(self):  # pragma: no cover
+        """It should hold back the changes of a transaction that is still writing, however long it has run"""
+        with db.engine.connect() as held:
+            held.execute(db.insert(Employee).values(EmployeeFactory.build().to_row()))
+            stamped = held.scalar(db.select(db.func.max(Employee.last_updated)))
+            self.assertLess(changes_horizon(0), stamped)
+            held.commit()
+        # like a new request, start a transaction that sees the activity as it is now
+        db.session.commit()
+        self.assertGreaterEqual(changes_horizon(0), stamped)
+
+    def test_stats(self):
+        """It should count the Employees with one GROUP BY and cache the counts"""
+        Employee.bulk_create([EmployeeFactory(department="HR", gender=Gender.MALE) for _ in range(2)])
+        expected = {
+            "total": 2, "by_department": {"HR": 2}, "by_gender": {"MALE": 2}, "by_department_gender": {"HR": {"MALE": 2}}
+        }
+        self.assertEqual(Employee.stats(), expected)
+        self.assertEqual(cache.get(Employee.STATS_KEY), expected)
+        Employee.bulk_update([])
+        self.assertIsNone(cache.get(Employee.STATS_KEY))
+
+    def test_single_statement_writes(self):
+        """It should create, update and delete an Employee returning what the routes need"""
+        employee = EmployeeFactory()
+        data, etag = Employee.create_serialized(employee)
+        self.assertEqual(data, employee.serialize())
+        self.assertEqual(etag, Employee.find(employee.id).etag)
+        employee.first_name = "Changed"
+        data, _ = Employee.update_serialized(employee.id, employee)
+        self.assertEqual(data["first_name"], "Changed")
+        self.assertTrue(Employee.delete_by_id(employee.id))
+        self.assertIsNone(Employee.update_serialized(employee.id, employee))
+        self.assertFalse(Employee.delete_by_id(employee.id))
+        self.assertEqual(db.session.query(EmployeeTombstone).count(), 1)
+
+    def test_version(self):
+        """It should give every write of an Employee a new version and ETag, even within the same second"""
+        employee = EmployeeFactory()
+        _, created = Employee.create_serialized(employee)
+        _, updated = Employee.update_serialized(employee.id, employee)
+        _, again = Employee.update_serialized(employee.id, employee)
+        self.assertEqual(len({created, updated, again}), 3)
+        Employee.bulk_update([employee])
+        employee = Employee.find(employee.id)
+        self.assertEqual(employee.version, 4)
+        employee.update()
+        self.assertEqual(Employee.find(employee.id).version, 5)
+        self.assertEqual(Employee.find_serialized(employee.id)[1], make_etag(employee.id, 5))
+
+    def test_single_statement_write_error(self):
+        """It should roll back and raise a DataValidationError when a write fails"""
+        employee = EmployeeFactory(first_name=None)
+        self.assertRaises(DataValidationError, Employee.create_serialized, employee)
+        self.assertEqual(Employee.all(), [])
+
+    def test_search_statement(self):
+        """It should build a trigram search on PostgreSQL and a prefix search elsewhere"""
+        sql = str(Employee.search_statement("Jo Sm", "postgresql").compile(dialect=postgresql.dialect()))
+        self.assertIn("word_similarity", sql)
+        self.assertIn("<%", sql)
+        sql = str(Employee.search_statement("Jo Sm", "mysql"))
+        self.assertEqual(sql.count("lower(employee.first_name) LIKE"), 2)
+        # too short for the trigram index, so only prefixes
+        sql = str(Employee.search_statement("a", "postgresql").compile(dialect=postgresql.dialect()))
+        self.assertNotIn("word_similarity", sql)
+        self.assertIn("lower(employee.first_name) LIKE", sql)
+        compiled = Employee.search_statement("jo_sm", "postgresql").compile(dialect=postgresql.dialect())
+        self.assertIn("ESCAPE", str(compiled))
+        self.assertIn("%jo\\_sm%", compiled.params.values())
+        self.assertRaises(DataValidationError, Employee.search_statement, "?", "sqlite")
+
+    def test_rebuild_search_index(self):
+        """It should index the Employees that were there before the index"""
+        employee = EmployeeFactory(first_name="Zebulon")
+        employee.create()
+        sqlite = db.engine.dialect.name == "sqlite"
+        db.session.commit()  # the DDL must not wait on the locks of the session
+        with db.engine.begin() as connection:
+            # the trigram index of PostgreSQL is not a table of its own, so it is dropped instead
+            connection.exec_driver_sql("DELETE FROM employee_fts" if sqlite else "DROP INDEX ix_employee_search_trgm")
+        if sqlite:
+            self.assertEqual(Employee.search("zebulon"), [])
+        Employee.rebuild_search_index()
+        if not sqlite:
+            indexes = {index["name"] for index in db.inspect(db.engine).get_indexes("employee")}
+            self.assertIn("ix_employee_search_trgm", indexes)
+        self.assertEqual([found["id"] for found in Employee.search("zebulon")], [employee.id])
+
+    def test_prune_tombstones(self):
+        """It should remove old tombstones only"""
+        Employee.bulk_create(EmployeeFactory.build_batch(2))
+        Employee.bulk_delete([employee.id for employee in Employee.all()])
+        self.assertEqual(EmployeeTombstone.prune(datetime(2000, 1, 1)), 0)
+        self.assertEqual(EmployeeTombstone.prune(database_now() + timedelta(days=1)), 2)
+
+    def test_idempotency_key(self):
+        """It should reserve an idempotency key once and keep the response committed with the Employee"""
+        day, minute = timedelta(days=1), timedelta(minutes=1)
+        self.assertIsNone(IdempotencyKey.claim("key-1", "a" * 64, day, minute))
+        record = IdempotencyKey.claim("key-1", "b" * 64, day, minute)
+        self.assertEqual((record["fingerprint"], record["status_code"]), ("a" * 64, None))
+
+        def keep(created, etag):
+            return IdempotencyKey.complete("key-1", 201, json.dumps(created), f"/employees/{created['id']}", etag)
+        data, etag = Employee.create_serialized(EmployeeFactory(), keep)
+        record = IdempotencyKey.claim("key-1", "a" * 64, day, minute)
+        self.assertEqual(record["status_code"], 201)
+        self.assertEqual(json.loads(record["body"]), data)
+        self.assertEqual((record["location"], record["etag"]), (f"/employees/{data['id']}", etag))
+
+        # a finished request keeps its key until the TTL, an unfinished one only until the lock expires
+        self.assertIsNotNone(IdempotencyKey.claim("key-1", "c" * 64, day, -minute))
+        self.assertIsNone(IdempotencyKey.claim("key-1", "c" * 64, -day, minute))
+        self.assertIsNotNone(IdempotencyKey.claim("key-1", "c" * 64, day, minute))
+        self.assertIsNone(IdempotencyKey.claim("key-1", "c" * 64, day, -minute))
+        IdempotencyKey.release("key-1")
+        self.assertIsNone(IdempotencyKey.claim("key-1", "d" * 64, day, minute))
+        self.assertRaises(DataValidationError, IdempotencyKey.claim, "key-1", "d" * 64, day, minute, attempts=0)
+
+    def test_prune_idempotency_keys(self):
+        """It should remove old idempotency keys only"""
+        IdempotencyKey.claim("key-1", "a" * 64, timedelta(days=1), timedelta(minutes=1))
+        self.assertEqual(IdempotencyKey.prune(datetime(2000, 1, 1)), 0)
+        self.assertEqual(IdempotencyKey.prune(database_now() + timedelta(days=1)), 1)
+
+    def test_find_serialized(self):
+        """It should find a serialized Employee and cache it until it changes"""
+        self.assertIsNone(Employee.find_serialized(0))
+        employee = EmployeeFactory()
+        employee.create()
+        data, etag = Employee.find_serialized(employee.id)
+        self.assertEqual(data, employee.serialize())
+        self.assertEqual(etag, employee.etag)
+        self.assertEqual(cache.get(Employee.cache_key(employee.id)), {"data": data, "etag": etag})
+        employee.department = "HR"
+        employee.update()
+        self.assertIsNone(cache.get(Employee.cache_key(employee.id)))
+        self.assertEqual(Employee.find_serialized(employee.id)[0]["department"], "HR")
+        employee.delete()
+        self.assertIsNone(cache.get(Employee.cache_key(employee.id)))
+        self.assertIsNone(Employee.find_serialized(employee.id))
+
+    def test_collection_version(self):
+        """It should change the collection version with every write, however it is made"""
+        versions = [Employee.collection_version()]
+        employee = EmployeeFactory()
+        employee.create()
+        versions.append(Employee.collection_version())
+        Employee.update_serialized(employee.id, employee)
+        versions.append(Employee.collection_version())
+        Employee.update_serialized(employee.id, employee)
+        versions.append(Employee.collection_version())
+        db.session.execute(db.update(Employee).values(department="Legal"))
+        db.session.commit()
+        versions.append(Employee.collection_version())
+        employee.delete()
+        versions.append(Employee.collection_version())
+        self.assertEqual(len(set(versions)), len(versions))
+        # reading it does not scan the table
+        self.assertEqual(TableVersion.current("missing"), 0)
+
+    @skipUnless(DATABASE_URI.startswith("postgresql"), "SQLite has one writer at a time")
+    def test_collection_version_slots(self):  # pragma: no cover
+        """It should count a write in another slot than the one a long transaction holds"""
+        statement = db.insert(Employee).values(EmployeeFactory.build().to_row())
+        with db.engine.connect() as held:
+            held.execute(statement)
+            before = int(Employee.collection_version())
+            with db.engine.begin() as connection:
+                connection.exec_driver_sql("SET LOCAL lock_timeout = '2s'")
+                connection.execute(statement)
+            self.assertEqual(int(Employee.collection_version()), before + 1)
+            held.commit()
+        self.assertEqual(int(Employee.collection_version()), before + 2)
+
 
 class TestExceptionHandlers(TestCaseBase):
     """Test REST Exception Handling"""
@@ -131,3 +447,23 @@ class TestExceptionHandlers(TestCaseBase):
         exception_mock.side_effect = Exception()
         employee = EmployeeFactory()
         self.assertRaises(DataValidationError, employee.delete)
+
+    @patch("service.models.db.session.commit")
+    def test_bulk_create_exception(self, exception_mock):
+        """It should catch a bulk create exception"""
+        exception_mock.side_effect = Exception()
+        employees = EmployeeFactory.build_batch(2)
+        self.assertRaises(DataValidationError, Employee.bulk_create, employees)
+
+    @patch("service.models.db.session.commit")
+    def test_bulk_update_exception(self, exception_mock):
+        """It should catch a bulk update exception"""
+        exception_mock.side_effect = Exception()
+        employees = EmployeeFactory.build_batch(2)
+        self.assertRaises(DataValidationError, Employee.bulk_update, employees)
+
+    @patch("service.models.db.session.commit")
+    def test_bulk_delete_exception(self, exception_mock):
+        """It should catch a bulk delete exception"""
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, Employee.bulk_delete, [1, 2])
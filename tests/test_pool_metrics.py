@@ -0,0 +1,61 @@
+"""
+Test cases for the connection pool metrics
+"""
+import sqlite3
+from unittest import TestCase
+from flask import Flask
+from sqlalchemy import exc
+from service.common.pool_metrics import InstrumentedQueuePool, PoolMetrics, pool_metrics, init_pool_metrics
+
+
+class TestPoolMetrics(TestCase):
+    """Connection Pool Metrics Tests"""
+
+    def setUp(self):
+        pool_metrics.reset()
+        self.pool = InstrumentedQueuePool(lambda: sqlite3.connect(":memory:"), pool_size=1, max_overflow=0, timeout=0.01)
+
+    def tearDown(self):
+        self.pool.dispose()
+
+    def test_checkout_and_checkin(self):
+        """It should count checkouts, checkins and new connections"""
+        connection = self.pool.connect()
+        data = pool_metrics.snapshot(self.pool)
+        self.assertEqual(data["checkouts"], 1)
+        self.assertEqual(data["connects"], 1)
+        self.assertEqual(data["checked_out"], 1)
+        self.assertEqual(data["size"], 1)
+        self.assertGreaterEqual(data["wait_seconds_max"], 0)
+        connection.close()
+        data = pool_metrics.snapshot(self.pool)
+        self.assertEqual(data["checkins"], 1)
+        self.assertEqual(data["checked_out"], 0)
+
+    def test_timeout(self):
+        """It should count checkouts that timed out waiting for a connection"""
+        connection = self.pool.connect()
+        self.assertRaises(exc.TimeoutError, self.pool.connect)
+        self.assertEqual(pool_metrics.snapshot()["timeouts"], 1)
+        connection.close()
+
+    def test_invalidate(self):
+        """It should count invalidated connections"""
+        connection = self.pool.connect()
+        connection.invalidate()
+        self.assertEqual(pool_metrics.snapshot()["invalidations"], 1)
+
+    def test_snapshot_without_pool(self):
+        """It should only report counters when there is no QueuePool"""
+        self.assertNotIn("size", PoolMetrics().snapshot())
+
+    def test_init_pool_metrics(self):
+        """It should use the instrumented pool except for in-memory SQLite"""
+        app = Flask(__name__)
+        app.config["SQLALCHEMY_DATABASE_URI"] = "postgresql+psycopg://localhost/test"
+        init_pool_metrics(app)
+        self.assertIs(app.config["SQLALCHEMY_ENGINE_OPTIONS"]["poolclass"], InstrumentedQueuePool)
+        app = Flask(__name__)
+        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        init_pool_metrics(app)
+        self.assertNotIn("SQLALCHEMY_ENGINE_OPTIONS", app.config)
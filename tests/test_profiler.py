@@ -0,0 +1,113 @@
+"""
+Test cases for the SQL profiler
+"""
+from unittest import TestCase
+from flask import Flask, g, jsonify
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from service.common.profiler import QueryProfiler, QueryProfile, PROFILE_HEADER, _quote
+
+
+class TestQueryProfile(TestCase):
+    """Query Profile Tests"""
+
+    def test_slowest(self):
+        """It should count every statement and keep only the slowest ones"""
+        profile = QueryProfile(top=2)
+        for seconds, statement in ((0.003, "A"), (0.001, "B"), (0.005, "C"), (0.002, "D")):
+            profile.add(seconds, statement)
+        self.assertEqual(profile.count, 4)
+        self.assertAlmostEqual(profile.seconds, 0.011)
+        timing = profile.server_timing()
+        self.assertIn('db;dur=11.000;desc="4 queries"', timing)
+        self.assertIn('sql-1;dur=5.000;desc="C", sql-2;dur=3.000;desc="A"', timing)
+        self.assertNotIn('"B"', timing)
+
+    def test_no_statements_kept(self):
+        """It should only count the statements when none are to be kept"""
+        profile = QueryProfile(top=0)
+        profile.add(0.001, "A")
+        self.assertEqual(profile.count, 1)
+        self.assertNotIn("sql-", profile.server_timing())
+
+    def test_quote(self):
+        """It should put statements on one short line that fits in a quoted header parameter"""
+        self.assertEqual(_quote('SELECT "a\\b"\n  FROM t'), 'SELECT \\"a\\\\b\\" FROM t')
+        self.assertEqual(len(_quote("SELECT " + "x, " * 100)), 100)
+        self.assertEqual(_quote("SELECT 'é'"), "SELECT '?'")
+
+
+class TestQueryProfiler(TestCase):
+    """SQL Profiler Request Hook Tests"""
+
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        self.app = Flask(__name__)
+        self.app.config.update(SQL_PROFILE_HEADER=True, SQL_PROFILE_TOP=3, SLOW_QUERY_MS=0)
+        self.profiler = QueryProfiler()
+        self.profiler.init_app(self.app, self.engine)
+
+        @self.app.route("/query/<int:count>")
+        def query(count):
+            with self.engine.connect() as connection:
+                for number in range(count):
+                    connection.execute(text(f"SELECT {number}"))
+            return jsonify(ok=True)
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_profile_on_request(self):
+        """It should profile the requests that send the header"""
+        client = self.app.test_client()
+        self.assertNotIn("Server-Timing", client.get("/query/2").headers)
+        timing = client.get("/query/5", headers={PROFILE_HEADER: "1"}).headers["Server-Timing"]
+        self.assertIn('desc="5 queries"', timing)
+        self.assertIn("app;dur=", timing)
+        self.assertEqual(timing.count("sql-"), 3)
+
+    def test_profile_header_not_allowed(self):
+        """It should ignore the header unless SQL_PROFILE_HEADER allows it"""
+        self.profiler.allow_header = False
+        response = self.app.test_client().get("/query/1", headers={PROFILE_HEADER: "1"})
+        self.assertNotIn("Server-Timing", response.headers)
+
+    def test_profile_every_request(self):
+        """It should profile every request when SQL_PROFILE is on"""
+        self.profiler.always = True
+        response = self.app.test_client().get("/query/1")
+        self.assertIn('desc="1 queries"', response.headers["Server-Timing"])
+
+    def test_slow_query_log(self):
+        """It should log the statements slower than SLOW_QUERY_MS with their route"""
+        self.profiler.slow_seconds = 1e-9
+        with self.assertLogs("flask.app", "WARNING") as logs:
+            self.app.test_client().get("/query/1")
+        self.assertEqual(logs.records[0].route, "/query/<int:count>")
+        self.assertEqual(logs.records[0].statement, "SELECT 0")
+        self.assertIn("Slow query", logs.output[0])
+
+    def test_slow_query_outside_request(self):
+        """It should log slow statements run outside of a request without a route"""
+        self.profiler.slow_seconds = 1e-9
+        with self.assertLogs("flask.app", "WARNING") as logs:
+            with self.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+        self.assertIsNone(logs.records[0].route)
+
+    def test_fast_queries_not_logged(self):
+        """It should not log the statements faster than SLOW_QUERY_MS"""
+        self.profiler.slow_seconds = 60
+        with self.assertNoLogs("flask.app", "WARNING"):
+            self.app.test_client().get("/query/3")
+
+    def test_failed_statement(self):
+        """It should keep nothing on the connection for a statement that fails"""
+        self.profiler.always = True
+        with self.app.test_request_context():
+            self.app.preprocess_request()
+            with self.engine.connect() as connection:
+                self.assertRaises(OperationalError, connection.execute, text("SELECT * FROM missing"))
+                connection.execute(text("SELECT 1"))
+                self.assertEqual(dict(connection.info), {})
+            self.assertEqual(g.sql_profile.count, 1)
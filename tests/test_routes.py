@@ -1,14 +1,24 @@
 """
 Test routes for Employee API Service
 """
+import io
 import os
+import hashlib
+import json
+import threading
 import logging
+from contextlib import contextmanager
 from unittest import TestCase
+from unittest.mock import patch
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
 
 from wsgi import app
 
 from service.common import status
-from service.models import Employee, db
+from service.common.cache import cache
+from service.common.limits import ConcurrencyLimiter, MemoryBuckets, limiter
+from service.models import Employee, EmployeeTombstone, DataValidationError, IdempotencyKey, db
 from tests.factories import EmployeeFactory
 
 
@@ -18,8 +28,8 @@ DATABASE_URI = os.getenv(
 BASE_URL = "/employees"
 
 
-class TestEmployeeService(TestCase):
-    """Employee Server Tests"""
+class TestCaseBase(TestCase):
+    """Base Test Case for common setup"""
 
     @classmethod
     def setUpClass(cls):
@@ -30,6 +40,7 @@ class TestEmployeeService(TestCase):
         app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
         app.logger.setLevel(logging.CRITICAL)
         app.app_context().push()
+        db.create_all()
 
     @classmethod
     def tearDownClass(cls):
@@ -39,11 +50,29 @@ class TestEmployeeService(TestCase):
         """Runs for each test"""
         self.client = app.test_client()
         db.session.query(Employee).delete()  # clean up the last tests
+        db.session.query(EmployeeTombstone).delete()
+        db.session.query(IdempotencyKey).delete()
         db.session.commit()
+        cache.clear()
 
     def tearDown(self):
         db.session.remove()
 
+    @contextmanager
+    def assert_statements(self, count: int):
+        """Asserts that the block runs exactly count SQL statements"""
+        statements = []
+
+        def record(_connection, _cursor, statement, *_args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+        self.assertEqual(len(statements), count, "\n".join(statements))
+
     def _create_employees(self, count: int = 1) -> list:
         """Utility function to bulk create employees"""
         employees = []
@@ -58,6 +87,10 @@ class TestEmployeeService(TestCase):
             employees.append(test_employee)
         return employees
 
+
+class TestEmployeeService(TestCaseBase):
+    """Employee Server Tests"""
+
     def test_index(self):
         """It should call the Home Page"""
         response = self.client.get("/")
@@ -73,6 +106,44 @@ class TestEmployeeService(TestCase):
         self.assertEqual(data["status"], 200)
         self.assertEqual(data["message"], "Healthy")
 
+    def test_ready(self):
+        """It should be ready when the database is reachable"""
+        response = self.client.get("/ready")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual(data["message"], "Ready")
+        self.assertEqual(data["database"], "ok")
+        self.assertGreaterEqual(data["latency_ms"], 0)
+
+    def test_ready_database_unavailable(self):
+        """It should not be ready when the database is unreachable"""
+        with patch.object(db.engine, "connect", side_effect=OperationalError("SELECT 1", {}, Exception("down"))):
+            response = self.client.get("/ready")
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        data = response.get_json()
+        self.assertEqual(data["database"], "unreachable")
+        self.assertEqual(self.client.get("/health").status_code, status.HTTP_200_OK)
+
+    def test_pool_stats(self):
+        """It should report the connection pool counters"""
+        self._create_employees(1)
+        response = self.client.get("/pool/stats")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertGreater(data["checkouts"], 0)
+        self.assertIn("checked_out", data)
+
+    def test_metrics(self):
+        """It should report request metrics in the Prometheus format"""
+        self._create_employees(1)
+        self.client.get(BASE_URL)
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.mimetype, "text/plain")
+        output = response.get_data(as_text=True)
+        self.assertIn('http_requests_total{endpoint="list_employees",method="GET",status="200"}', output)
+        self.assertIn('http_request_db_queries_count{endpoint="create_employees"}', output)
+
     def test_get_employee_list(self):
         """It should Get a list of Employees"""
         self._create_employees(5)
@@ -99,6 +170,131 @@ class TestEmployeeService(TestCase):
         logging.debug("Response data = %s", data)
         self.assertIn("was not found", data["message"])
 
+    def test_get_employee_cached(self):
+        """It should Get a single employee from the cache after the first read, without a database slot"""
+        test_employee = self._create_employees(1)[0]
+        hits = cache.stats()["hits"]
+        for _ in range(2):
+            response = self.client.get(f"{BASE_URL}/{test_employee.id}")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.get_json()["last_name"], test_employee.last_name)
+        response = self.client.get("/cache/stats")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["hits"], hits + 1)
+        # a read served from the cache needs no database slot, unlike a miss
+        uncached = self._create_employees(1)[0]
+        busy = ConcurrencyLimiter(1)
+        busy.acquire()
+        with patch.object(limiter, "concurrency", busy):
+            self.assertEqual(self.client.get("/").status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get(f"{BASE_URL}/{test_employee.id}").status_code, status.HTTP_200_OK)
+            response = self.client.get(f"{BASE_URL}/{uncached.id}")
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_update_employee_invalidates_cache(self):
+        """It should not Get a stale employee from the cache after an update"""
+        test_employee = self._create_employees(1)[0]
+        data = self.client.get(f"{BASE_URL}/{test_employee.id}").get_json()
+        data["department"] = "Sales"
+        response = self.client.put(f"{BASE_URL}/{test_employee.id}", json=data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(f"{BASE_URL}/{test_employee.id}")
+        self.assertEqual(response.get_json()["department"], "Sales")
+
+    def test_get_employee_not_modified(self):
+        """It should answer 304 Not Modified when the employee ETag matches"""
+        test_employee = self._create_employees(1)[0]
+        response = self.client.get(f"{BASE_URL}/{test_employee.id}")
+        etag = response.headers["ETag"]
+        self.assertIsNotNone(etag)
+        response = self.client.get(f"{BASE_URL}/{test_employee.id}", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.headers["ETag"], etag)
+        self.assertEqual(len(response.data), 0)
+        response = self.client.get(f"{BASE_URL}/{test_employee.id}", headers={"If-None-Match": '"stale"'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_get_employee_modified_twice_in_a_second(self):
+        """It should change the ETag on every update, however close together"""
+        test_employee = self._create_employees(1)[0]
+        etag = self.client.get(f"{BASE_URL}/{test_employee.id}").headers["ETag"]
+        data = dict(test_employee.serialize(), department="HR")
+        first = self.client.put(f"{BASE_URL}/{test_employee.id}", json=data).headers["ETag"]
+        second = self.client.put(f"{BASE_URL}/{test_employee.id}", json=data).headers["ETag"]
+        self.assertEqual(len({etag, first, second}), 3)
+        response = self.client.get(f"{BASE_URL}/{test_employee.id}", headers={"If-None-Match": first})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["ETag"], second)
+
+    def test_update_employee_if_match(self):
+        """It should only Update an Employee when If-Match has its current ETag"""
+        test_employee = self._create_employees(1)[0]
+        response = self.client.get(f"{BASE_URL}/{test_employee.id}")
+        etag = response.headers["ETag"]
+        data = response.get_json()
+        data["department"] = "HR"
+        response = self.client.put(f"{BASE_URL}/{test_employee.id}", json=data, headers={"If-Match": '"stale"'})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(response.get_json()["error"], "Precondition Failed")
+        response = self.client.put(f"{BASE_URL}/{test_employee.id}", json=data, headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("ETag", response.headers)
+
+    def test_simultaneous_conditional_updates(self):
+        """It should let only one of several updates with the same If-Match win"""
+        test_employee = self._create_employees(1)[0]
+        etag = self.client.get(f"{BASE_URL}/{test_employee.id}").headers["ETag"]
+        start = threading.Barrier(4)
+        codes = []
+
+        def send(department):
+            client = app.test_client()
+            data = dict(test_employee.serialize(), department=department)
+            start.wait()
+            with app.app_context():
+                response = client.put(f"{BASE_URL}/{test_employee.id}", json=data, headers={"If-Match": etag})
+                codes.append(response.status_code)
+                db.session.remove()
+
+        threads = [threading.Thread(target=send, args=(f"Department {number}",)) for number in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(codes), [status.HTTP_200_OK] + [status.HTTP_412_PRECONDITION_FAILED] * 3)
+        self.assertEqual(Employee.find(test_employee.id).version, 2)
+
+    def test_if_match_ignores_the_cache(self):
+        """It should refuse a stale If-Match even while the cache still holds that version"""
+        test_employee = self._create_employees(1)[0]
+        etag = self.client.get(f"{BASE_URL}/{test_employee.id}").headers["ETag"]
+        # another worker changes the Employee, which leaves the cache of this one alone
+        db.session.execute(
+            db.update(Employee).where(Employee.id == test_employee.id).values(department="Legal", version=Employee.version + 1)
+        )
+        db.session.commit()
+        self.assertEqual(self.client.get(f"{BASE_URL}/{test_employee.id}").headers["ETag"], etag)
+        data = dict(test_employee.serialize(), department="HR")
+        response = self.client.put(f"{BASE_URL}/{test_employee.id}", json=data, headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = self.client.delete(f"{BASE_URL}/{test_employee.id}", headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(Employee.find(test_employee.id).department, "Legal")
+        # a missing Employee is not found whatever If-Match says
+        response = self.client.put(f"{BASE_URL}/0", json=data, headers={"If-Match": "*"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_delete_employee_if_match(self):
+        """It should only Delete an Employee when If-Match has its current ETag"""
+        test_employee = self._create_employees(1)[0]
+        etag = self.client.get(f"{BASE_URL}/{test_employee.id}").headers["ETag"]
+        response = self.client.delete(f"{BASE_URL}/{test_employee.id}", headers={"If-Match": '"stale"'})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = self.client.delete(f"{BASE_URL}/{test_employee.id}", headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.delete(f"{BASE_URL}/{test_employee.id}", headers={"If-Match": "*"})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
     def test_create_employee(self):
         """It should Create a new Employee"""
         test_employee = EmployeeFactory()
@@ -154,6 +350,428 @@ class TestEmployeeService(TestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
 
+class TestBulkEmployeeService(TestCaseBase):
+    """Bulk Employee Server Tests"""
+
+    def test_bulk_create_employees(self):
+        """It should Create many Employees in one request"""
+        test_employees = EmployeeFactory.build_batch(3)
+        app.config["BULK_CHUNK_SIZE"] = 2
+        try:
+            response = self.client.post(f"{BASE_URL}/bulk", json=[employee.serialize() for employee in test_employees])
+        finally:
+            app.config["BULK_CHUNK_SIZE"] = 1000
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        results = response.get_json()
+        self.assertEqual([result["index"] for result in results], [0, 1, 2])
+        self.assertTrue(all(result["status"] == status.HTTP_201_CREATED for result in results))
+
+        # Check each of the new employees
+        for result, test_employee in zip(results, test_employees):
+            response = self.client.get(f"{BASE_URL}/{result['id']}")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.get_json()["last_name"], test_employee.last_name)
+
+    def test_bulk_create_employees_invalid_row(self):
+        """It should not Create any Employees when one row is not valid"""
+        rows = [employee.serialize() for employee in EmployeeFactory.build_batch(3)]
+        del rows[1]["department"]
+        rows[2]["gender"] = 7
+        response = self.client.post(f"{BASE_URL}/bulk", json=rows)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.get_json()["errors"]
+        self.assertEqual([error["index"] for error in errors], [1, 2])
+        self.assertEqual(self.client.get(BASE_URL).get_json(), [])
+
+    def test_bulk_create_employees_not_a_list(self):
+        """It should not Create Employees from a body that is not an array"""
+        response = self.client.post(f"{BASE_URL}/bulk", json={"first_name": "John"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_update_employees(self):
+        """It should Update many Employees in one request"""
+        employees = self._create_employees(2)
+        rows = [dict(employee.serialize(), department="HR") for employee in employees]
+        rows.append(dict(rows[0], id=0))
+        response = self.client.put(f"{BASE_URL}/bulk", json=rows)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.get_json()
+        self.assertEqual(
+            [result["status"] for result in results],
+            [status.HTTP_200_OK, status.HTTP_200_OK, status.HTTP_404_NOT_FOUND],
+        )
+        for employee in employees:
+            response = self.client.get(f"{BASE_URL}/{employee.id}")
+            self.assertEqual(response.get_json()["department"], "HR")
+
+    def test_bulk_update_employees_no_id(self):
+        """It should not Update many Employees when a row has no id"""
+        rows = [employee.serialize() for employee in EmployeeFactory.build_batch(2)]
+        rows[0].pop("id")
+        response = self.client.put(f"{BASE_URL}/bulk", json=rows)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.get_json()["errors"][0]["index"], 0)
+
+    def test_bulk_update_employees_boolean_id(self):
+        """It should not Update many Employees when a row has true as its id"""
+        employee = self._create_employees(1)[0]
+        rows = [dict(EmployeeFactory.build().serialize(), id=True)]
+        response = self.client.put(f"{BASE_URL}/bulk", json=rows)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.get_json()["errors"][0]["message"], "Invalid employee: missing id")
+        self.assertEqual(self.client.get(f"{BASE_URL}/{employee.id}").get_json(), employee.serialize())
+
+    def test_bulk_delete_employees(self):
+        """It should Delete many Employees in one request"""
+        employees = self._create_employees(3)
+        ids = [employees[0].id, employees[2].id, 0]
+        response = self.client.delete(f"{BASE_URL}/bulk", json=ids)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.get_json()
+        self.assertEqual(
+            [result["status"] for result in results],
+            [status.HTTP_204_NO_CONTENT, status.HTTP_204_NO_CONTENT, status.HTTP_404_NOT_FOUND],
+        )
+        data = self.client.get(BASE_URL).get_json()
+        self.assertEqual([row["id"] for row in data], [employees[1].id])
+
+    def test_bulk_delete_employees_bad_ids(self):
+        """It should not Delete many Employees with ids that are not integers"""
+        response = self.client.delete(f"{BASE_URL}/bulk", json=["one", 2])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_delete_employees_boolean_ids(self):
+        """It should not Delete many Employees with true or false as ids"""
+        employee = self._create_employees(1)[0]
+        response = self.client.delete(f"{BASE_URL}/bulk", json=[True, False])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(f"{BASE_URL}/{employee.id}").status_code, status.HTTP_200_OK)
+
+
+class TestEmployeeStats(TestCaseBase):
+    """Employee Statistics Tests"""
+
+    def test_stats(self):
+        """It should count the Employees by department, gender and both"""
+        employees = self._create_employees(6)
+        response = self.client.get(f"{BASE_URL}/stats")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual(data["total"], 6)
+        for employee in employees:
+            department, gender = employee.department, employee.gender.name
+            count = sum(1 for other in employees if (other.department, other.gender.name) == (department, gender))
+            self.assertEqual(data["by_department_gender"][department][gender], count)
+        self.assertEqual(sum(data["by_department"].values()), 6)
+        self.assertEqual(data["by_gender"].get("MALE", 0), sum(1 for e in employees if e.gender.name == "MALE"))
+
+    def test_stats_empty(self):
+        """It should count no Employees in an empty table"""
+        data = self.client.get(f"{BASE_URL}/stats").get_json()
+        self.assertEqual(data, {"total": 0, "by_department": {}, "by_gender": {}, "by_department_gender": {}})
+
+    def test_stats_invalidated(self):
+        """It should recount after every write and answer 304 until then"""
+        employee = self._create_employees(1)[0]
+        response = self.client.get(f"{BASE_URL}/stats")
+        etag = response.headers["ETag"]
+        response = self.client.get(f"{BASE_URL}/stats", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        data = dict(employee.serialize(), department="Research")
+        self.client.put(f"{BASE_URL}/{employee.id}", json=data)
+        stats = self.client.get(f"{BASE_URL}/stats", headers={"If-None-Match": etag}).get_json()
+        self.assertEqual(stats["by_department"], {"Research": 1})
+
+        self.client.delete(f"{BASE_URL}/{employee.id}")
+        self.assertEqual(self.client.get(f"{BASE_URL}/stats").get_json()["total"], 0)
+        self.client.post(f"{BASE_URL}/bulk", json=[data, data])
+        self.assertEqual(self.client.get(f"{BASE_URL}/stats").get_json()["by_department"], {"Research": 2})
+
+
+class TestEmployeeSearch(TestCaseBase):
+    """Employee Search Tests"""
+
+    def _create(self, first_name: str, last_name: str, department: str = "Sales") -> int:
+        data = EmployeeFactory.build(first_name=first_name, last_name=last_name, department=department).serialize()
+        response = self.client.post(BASE_URL, json=data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.get_json()["id"]
+
+    def _search(self, **query) -> list:
+        response = self.client.get(f"{BASE_URL}/search", query_string=query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [employee["id"] for employee in response.get_json()]
+
+    def test_search_prefix(self):
+        """It should find the Employees whose names start with every word"""
+        john = self._create("John", "Smith")
+        johanna = self._create("Johanna", "Smithers")
+        self._create("Mary", "Johnson")
+        self.assertEqual(set(self._search(q="john sm")), {john})
+        self.assertEqual(set(self._search(q="Smith")), {john, johanna})
+        self.assertEqual(self._search(q="nobody"), [])
+
+    def test_search_ranked(self):
+        """It should rank a match on the name above a match on the department"""
+        by_department = self._create("Ann", "Lee", "Engineering")
+        by_name = self._create("Engel", "Brown", "Sales")
+        self.assertEqual(self._search(q="eng"), [by_name, by_department])
+
+    def test_search_kept_in_sync(self):
+        """It should find Employees by their current names only"""
+        employee_id = self._create("Olga", "Petrova")
+        data = self.client.get(f"{BASE_URL}/{employee_id}").get_json()
+        self.client.put(f"{BASE_URL}/{employee_id}", json=dict(data, last_name="Ivanova"))
+        self.assertEqual(self._search(q="petrova"), [])
+        self.assertEqual(self._search(q="ivanova"), [employee_id])
+        self.client.delete(f"{BASE_URL}/{employee_id}")
+        self.assertEqual(self._search(q="ivanova"), [])
+
+    def test_search_paged(self):
+        """It should return the matches a page at a time"""
+        ids = [self._create("Pat", f"Doe{number}") for number in range(5)]
+        response = self.client.get(f"{BASE_URL}/search", query_string={"q": "pat", "limit": 2})
+        self.assertEqual(len(response.get_json()), 2)
+        self.assertIn("offset=2", response.headers["Link"])
+        seen = [employee["id"] for employee in response.get_json()]
+        seen += self._search(q="pat", limit=2, offset=2)
+        response = self.client.get(f"{BASE_URL}/search", query_string={"q": "pat", "limit": 2, "offset": 4})
+        self.assertNotIn("Link", response.headers)
+        seen += [employee["id"] for employee in response.get_json()]
+        self.assertEqual(sorted(seen), ids)
+
+    def test_search_max_results(self):
+        """It should not page past SEARCH_MAX_RESULTS"""
+        for number in range(3):
+            self._create("Pat", f"Doe{number}")
+        with patch.dict(app.config, {"SEARCH_MAX_RESULTS": 2}):
+            response = self.client.get(f"{BASE_URL}/search", query_string={"q": "pat"})
+            self.assertEqual(len(response.get_json()), 2)
+            self.assertNotIn("Link", response.headers)
+            self.assertEqual(self._search(q="pat", offset=2), [])
+
+    def test_search_bad_query(self):
+        """It should require search text with letters or digits"""
+        for query in ({}, {"q": " "}, {"q": "*!"}):
+            response = self.client.get(f"{BASE_URL}/search", query_string=query)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestEmployeeChangeFeed(TestCaseBase):
+    """Employee Change Feed Tests"""
+
+    def setUp(self):
+        super().setUp()
+        self.settle_seconds = app.config["CHANGES_SETTLE_SECONDS"]
+        app.config["CHANGES_SETTLE_SECONDS"] = 0
+
+    def tearDown(self):
+        app.config["CHANGES_SETTLE_SECONDS"] = self.settle_seconds
+        super().tearDown()
+
+    def test_changes_paged(self):
+        """It should return every change oldest first, a page at a time"""
+        employees = self._create_employees(5)
+        seen, since, has_more = [], "", True
+        while has_more:
+            response = self.client.get(f"{BASE_URL}/changes", query_string={"since": since, "limit": 2})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            data = response.get_json()
+            self.assertLessEqual(len(data["changes"]), 2)
+            self.assertEqual(response.headers["X-Next-Watermark"], data["next"])
+            seen.extend(data["changes"])
+            since, has_more = data["next"], data["has_more"]
+        self.assertEqual([change["id"] for change in seen], [employee.id for employee in employees])
+        self.assertEqual(seen[0]["first_name"], employees[0].first_name)
+        self.assertFalse(seen[0]["deleted"])
+
+        response = self.client.get(f"{BASE_URL}/changes", query_string={"since": since})
+        self.assertEqual(response.get_json(), {"changes": [], "next": since, "has_more": False})
+
+    def test_changes_deleted(self):
+        """It should report deleted Employees with tombstones"""
+        employees = self._create_employees(3)
+        since = self.client.get(f"{BASE_URL}/changes").get_json()["next"]
+        self.client.delete(f"{BASE_URL}/{employees[0].id}")
+        self.client.delete(f"{BASE_URL}/bulk", json=[employees[2].id])
+        data = self.client.get(f"{BASE_URL}/changes", query_string={"since": since}).get_json()
+        self.assertEqual(
+            [(change["id"], change["deleted"]) for change in data["changes"]],
+            [(employees[0].id, True), (employees[2].id, True)],
+        )
+        self.assertNotIn("first_name", data["changes"][0])
+
+    def test_changes_since_timestamp(self):
+        """It should accept a plain timestamp as the watermark"""
+        self._create_employees(2)
+        data = self.client.get(f"{BASE_URL}/changes", query_string={"since": "2000-01-01T00:00:00"}).get_json()
+        self.assertEqual(len(data["changes"]), 2)
+        data = self.client.get(f"{BASE_URL}/changes", query_string={"since": "2999-01-01T00:00:00"}).get_json()
+        self.assertEqual(data["changes"], [])
+
+    def test_changes_settle(self):
+        """It should hold back the changes younger than the settle time"""
+        self._create_employees(2)
+        app.config["CHANGES_SETTLE_SECONDS"] = 3600
+        data = self.client.get(f"{BASE_URL}/changes").get_json()
+        self.assertEqual(data, {"changes": [], "next": "", "has_more": False})
+
+    def test_changes_bad_watermark(self):
+        """It should not accept a watermark it did not make"""
+        for since in ("yesterday", "2024-01-01T00:00:00,1", "2024-01-01T00:00:00,x,1"):
+            response = self.client.get(f"{BASE_URL}/changes", query_string={"since": since})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestIdempotentCreate(TestCaseBase):
+    """Idempotency-Key Tests"""
+
+    def post(self, data: dict, key: str = "key-1"):
+        """Posts an Employee with an Idempotency-Key"""
+        return self.client.post(BASE_URL, json=data, headers={"Idempotency-Key": key})
+
+    def test_retry(self):
+        """It should answer a retry with the first response without creating another Employee"""
+        data = EmployeeFactory().serialize()
+        first = self.post(data)
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn("Idempotent-Replayed", first.headers)
+        with self.assert_statements(4):
+            retry = self.post(data)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.get_json(), first.get_json())
+        self.assertEqual(retry.headers["Location"], first.headers["Location"])
+        self.assertEqual(retry.headers["ETag"], first.headers["ETag"])
+        self.assertEqual(retry.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(Employee.query.count(), 1)
+        # another key creates another Employee
+        self.assertNotEqual(self.post(data, "key-2").get_json()["id"], first.get_json()["id"])
+
+    def test_different_request(self):
+        """It should refuse to reuse a key for a different Employee"""
+        self.post(EmployeeFactory().serialize())
+        response = self.post(EmployeeFactory().serialize())
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Employee.query.count(), 1)
+
+    def test_in_progress(self):
+        """It should answer 409 with Retry-After while the first request runs, and take over when it died"""
+        data = EmployeeFactory().serialize()
+        fingerprint = hashlib.sha256(app.json.dumps(data).encode("utf-8")).hexdigest()
+        db.session.add(IdempotencyKey(key="key-1", fingerprint=fingerprint))
+        db.session.commit()
+        response = self.post(data)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        with patch.dict(app.config, {"IDEMPOTENCY_LOCK_SECONDS": -1}):
+            response = self.post(data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Employee.query.count(), 1)
+
+    def test_expired(self):
+        """It should run a request again once its key has expired"""
+        data = EmployeeFactory().serialize()
+        first = self.post(data).get_json()
+        with patch.dict(app.config, {"IDEMPOTENCY_TTL_HOURS": -1}):
+            second = self.post(data).get_json()
+        self.assertNotEqual(first["id"], second["id"])
+
+    def test_failed_write(self):
+        """It should free the key when the write fails so that a retry runs again"""
+        data = EmployeeFactory().serialize()
+        with patch("service.models.Employee._write_returning", side_effect=DataValidationError("database is down")):
+            response = self.post(data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(db.session.query(IdempotencyKey).count(), 0)
+        self.assertEqual(self.post(data).status_code, status.HTTP_201_CREATED)
+
+    def test_bad_key(self):
+        """It should refuse empty and overlong keys"""
+        data = EmployeeFactory().serialize()
+        self.assertEqual(self.post(data, "").status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.post(data, "k" * 256).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Employee.query.count(), 0)
+
+    def test_simultaneous_retries(self):
+        """It should create one Employee when retries with the same key arrive at once"""
+        data = EmployeeFactory().serialize()
+        start = threading.Barrier(4)
+        codes = []
+
+        def send():
+            client = app.test_client()
+            start.wait()
+            with app.app_context():
+                response = client.post(BASE_URL, json=data, headers={"Idempotency-Key": "key-1"})
+                codes.append((response.status_code, response.headers.get("Idempotent-Replayed")))
+                db.session.remove()
+
+        threads = [threading.Thread(target=send) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(codes.count((status.HTTP_201_CREATED, None)), 1, codes)
+        self.assertTrue(all(code in (status.HTTP_201_CREATED, status.HTTP_409_CONFLICT) for code, _ in codes), codes)
+        self.assertEqual(Employee.query.count(), 1)
+
+
+class TestStatementCounts(TestCaseBase):
+    """SQL Statements per Endpoint Tests"""
+
+    def test_create(self):
+        """It should create an Employee with one INSERT ... RETURNING"""
+        data = EmployeeFactory.build().serialize()
+        with self.assert_statements(1):
+            response = self.client.post(BASE_URL, json=data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.headers["ETag"], self.client.get(response.headers["Location"]).headers["ETag"])
+
+    def test_update(self):
+        """It should update an Employee with one UPDATE ... RETURNING"""
+        employee = self._create_employees(1)[0]
+        data = dict(employee.serialize(), first_name="Changed")
+        with self.assert_statements(1):
+            response = self.client.put(f"{BASE_URL}/{employee.id}", json=data)
+        self.assertEqual(response.get_json()["first_name"], "Changed")
+        with self.assert_statements(1):
+            response = self.client.put(f"{BASE_URL}/0", json=data)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_conditional_update(self):
+        """It should check If-Match in the UPDATE itself, and only look the Employee up when it failed"""
+        employee = self._create_employees(1)[0]
+        etag = self.client.get(f"{BASE_URL}/{employee.id}").headers["ETag"]
+        with self.assert_statements(1):
+            response = self.client.put(f"{BASE_URL}/{employee.id}", json=employee.serialize(), headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assert_statements(2):
+            response = self.client.put(f"{BASE_URL}/{employee.id}", json=employee.serialize(), headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_delete(self):
+        """It should delete an Employee and write its tombstone in one statement on PostgreSQL"""
+        employee = self._create_employees(1)[0]
+        with self.assert_statements(1 if db.engine.dialect.name == "postgresql" else 2):
+            response = self.client.delete(f"{BASE_URL}/{employee.id}")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        with self.assert_statements(1):
+            response = self.client.delete(f"{BASE_URL}/{employee.id}")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(db.session.query(EmployeeTombstone).count(), 1)
+
+    def test_reads(self):
+        """It should read an Employee once and then from the cache, and a page with two queries"""
+        employee = self._create_employees(1)[0]
+        with self.assert_statements(1):
+            self.client.get(f"{BASE_URL}/{employee.id}")
+        with self.assert_statements(0):
+            self.client.get(f"{BASE_URL}/{employee.id}")
+        with self.assert_statements(2):
+            self.client.get(BASE_URL)
+
+
 class TestSadPath(TestCase):
     """Test REST Exception Handling"""
 
@@ -180,3 +798,60 @@ class TestSadPath(TestCase):
         """It should not Create en Employee with the wrong content type"""
         response = self.client.post(BASE_URL, data="hello", content_type="text/html")
         self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_create_employee_invalid_fields(self):
+        """It should reject Employees whose fields could not be saved, naming the field"""
+        valid = EmployeeFactory.build().serialize()
+        cases = {
+            "missing last_name": {key: value for key, value in valid.items() if key != "last_name"},
+            "first_name must be a string": dict(valid, first_name=7),
+            "department is longer than 255 characters": dict(valid, department="x" * 256),
+            "gender must be one of FEMALE, MALE, UNKNOWN": dict(valid, gender="OTHER"),
+            "body of request contained bad or no data": [valid],
+        }
+        for message, data in cases.items():
+            response = self.client.post(BASE_URL, json=data)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn(message, response.get_json()["message"])
+        response = self.client.put(f"{BASE_URL}/0", json=dict(valid, gender=None))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_employee_too_large(self):
+        """It should reject bodies over the size limit before reading them"""
+        data = dict(EmployeeFactory.build().serialize(), padding="x" * app.config["EMPLOYEE_MAX_CONTENT_LENGTH"])
+        response = self.client.post(BASE_URL, json=data)
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertEqual(response.get_json()["error"], "Request Entity Too Large")
+        with patch.dict(app.config, {"MAX_CONTENT_LENGTH": 10}):
+            response = self.client.post(f"{BASE_URL}/bulk", json=[EmployeeFactory.build().serialize()])
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        # a chunked body has no Content-Length to check up front
+        response = self.client.post(BASE_URL, input_stream=io.BytesIO(json.dumps(data).encode()),
+                                    content_type="application/json", headers={"Transfer-Encoding": "chunked"},
+                                    environ_overrides={"wsgi.input_terminated": True})
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertIn("at most", response.get_json()["message"])
+
+    def test_rate_limited(self):
+        """It should answer 429 with Retry-After to a client over its rate limit, but not to health checks"""
+        limits = {"rate": 0.5, "burst": 1, "backend": MemoryBuckets()}
+        with patch.multiple(limiter, **limits):
+            self.client.get(f"{BASE_URL}/search")
+            response = self.client.get(f"{BASE_URL}/search")
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(response.headers["Retry-After"], "2")
+            self.assertEqual(response.get_json()["error"], "Too Many Requests")
+            self.assertEqual(self.client.get("/health").status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get("/health").status_code, status.HTTP_200_OK)
+
+    def test_overloaded(self):
+        """It should shed requests with 503 and Retry-After when every database slot is taken"""
+        busy = ConcurrencyLimiter(1)
+        busy.acquire()
+        with patch.object(limiter, "concurrency", busy):
+            response = self.client.get(BASE_URL)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual(response.get_json()["error"], "Service Unavailable")
+        shed = 'http_requests_shed_total{endpoint="list_employees",reason="overloaded"}'
+        self.assertIn(shed, self.client.get("/metrics").text)